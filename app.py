@@ -1,14 +1,22 @@
+import hmac
+import importlib
+import io
 import sys
 import subprocess
-import pkg_resources
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import threading
+import time
+from flask import Flask, Request, Response, abort, g, render_template, request, jsonify, send_from_directory, stream_with_context
 import os
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import uuid
 import json
+import zipfile
 
-# Verificar dependências ao iniciar
+import metrics
+
+# Verificação de dependências em runtime (desligada por padrão: o build já instala tudo)
 REQUIRED_PACKAGES = [
     'Flask>=2.3.2',
     'Pillow>=9.5.0',
@@ -18,6 +26,7 @@ REQUIRED_PACKAGES = [
 ]
 
 def check_dependencies():
+    import pkg_resources
     missing_packages = []
     for package in REQUIRED_PACKAGES:
         try:
@@ -41,13 +50,15 @@ def check_dependencies():
     
     return len(missing_packages) == 0
 
-# Verificar dependências
-print("Verificando dependências...")
-check_dependencies()
+# Verificar dependências (só com CHECK_DEPENDENCIES=1)
+if os.environ.get('CHECK_DEPENDENCIES') == '1':
+    print("Verificando dependências...")
+    check_dependencies()
 
 # Agora importar o model_loader
 try:
-    from model_loader import ImageClassifier
+    # O registro de modelos (model_registry) cria os classificadores; aqui só se confirma o import
+    importlib.import_module('model_loader')
     MODEL_LOADER_AVAILABLE = True
 except ImportError as e:
     print(f"⚠️  Erro ao importar model_loader: {e}")
@@ -55,13 +66,22 @@ except ImportError as e:
 
 # Importar database
 try:
-    from database import db, UploadedImage, SearchResult, init_db
+    from database import db, init_db, history_page
     DATABASE_AVAILABLE = True
 except ImportError as e:
     print(f"⚠️  Erro ao importar database: {e}")
     DATABASE_AVAILABLE = False
 
+class AppRequest(Request):
+    @property
+    def max_content_length(self):
+        # A busca em lote recebe centenas de fotos por requisição
+        if self.endpoint in ('search_batch', 'admin_add_images'):
+            return app.config['MAX_BATCH_CONTENT_LENGTH']
+        return super().max_content_length
+
 app = Flask(__name__)
+app.request_class = AppRequest
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
 # Configurações
@@ -69,13 +89,26 @@ UPLOAD_FOLDER = 'uploads'
 EMBEDDINGS_FOLDER = 'embeddings'
 SAMPLE_IMAGES_FOLDER = 'sample_images'
 STATIC_FOLDER = 'static'
+THUMBNAIL_FOLDER = os.environ.get('THUMBNAIL_FOLDER', 'thumbnails')
+# Originais podem ser trocados no lugar: cache curto + revalidação por ETag/Last-Modified
+ORIGINAL_MAX_AGE = int(os.environ.get('ORIGINAL_MAX_AGE', 3600))
+# Miniaturas são endereçadas pelo conteúdo: o mesmo nome nunca muda
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+# Imagens de referência adicionadas pela API administrativa (desligada sem ADMIN_TOKEN)
+REFERENCE_IMAGES_FOLDER = os.environ.get('REFERENCE_IMAGES_FOLDER', 'reference_images')
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024  # 8MB max
+app.config['MAX_BATCH_CONTENT_LENGTH'] = int(os.environ.get('MAX_BATCH_CONTENT_LENGTH', 256 * 1024 * 1024))
+SEARCH_BATCH_SIZE = int(os.environ.get('SEARCH_BATCH_SIZE', 32))
+# Imagens por requisição em lote (arquivos soltos + membros dos .zip)
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', 1000))
 
 # Criar pastas necessárias
-for folder in [UPLOAD_FOLDER, EMBEDDINGS_FOLDER, SAMPLE_IMAGES_FOLDER, STATIC_FOLDER]:
+for folder in [UPLOAD_FOLDER, EMBEDDINGS_FOLDER, SAMPLE_IMAGES_FOLDER, STATIC_FOLDER, THUMBNAIL_FOLDER,
+               REFERENCE_IMAGES_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
 # Subpastas do static
@@ -91,15 +124,16 @@ if DATABASE_AVAILABLE:
         print(f"❌ Erro ao inicializar banco de dados: {e}")
         DATABASE_AVAILABLE = False
 
-# Inicializar classificador de imagens
+# Inicializar classificador de imagens: o modelo padrão já na inicialização, os outros do
+# registro (MODELS) no primeiro uso
 classifier = None
+model_registry = None
 if MODEL_LOADER_AVAILABLE:
     print("Carregando modelo CLIP e embeddings...")
     try:
-        classifier = ImageClassifier(
-            embeddings_path=EMBEDDINGS_FOLDER,
-            sample_images_path=SAMPLE_IMAGES_FOLDER
-        )
+        from model_registry import ModelRegistry
+        model_registry = ModelRegistry.from_env(EMBEDDINGS_FOLDER, SAMPLE_IMAGES_FOLDER)
+        classifier = model_registry.get()
         print("✅ Modelo carregado com sucesso!")
         
         # Verificar estatísticas
@@ -115,9 +149,163 @@ if MODEL_LOADER_AVAILABLE:
 else:
     print("⚠️  Model loader não disponível")
 
+# Miniaturas dos resultados, exemplos e uploads
+thumbnail_store = None
+try:
+    from thumbnails import ThumbnailStore
+    thumbnail_store = ThumbnailStore.from_env(THUMBNAIL_FOLDER)
+except Exception as e:
+    print(f"⚠️ Miniaturas indisponíveis: {e}")
+
+# Histórico gravado fora do caminho da requisição, em lotes (write-behind)
+history_writer = None
+if DATABASE_AVAILABLE:
+    from history_writer import HistoryWriter
+    history_writer = HistoryWriter.from_env(app, upload_folder=UPLOAD_FOLDER)
+
+# Retenção do histórico (idade / quantidade / cota em disco), periódica em background
+retention_job = None
+if DATABASE_AVAILABLE:
+    from retention import RetentionJob
+    retention_job = RetentionJob.from_env(app, upload_folder=UPLOAD_FOLDER)
+
+# Estado do aquecimento do modelo (readiness)
+warmup_state = {'started': False, 'ready': False, 'error': None, 'seconds': None}
+warmup_lock = threading.Lock()
+
+def run_warmup():
+    """Faz uma inferência de aquecimento e marca o serviço como pronto"""
+    start = time.time()
+    try:
+        classifier.warmup()
+        warmup_state['seconds'] = round(time.time() - start, 3)
+        warmup_state['ready'] = True
+        print(f"✅ Aquecimento concluído em {warmup_state['seconds']}s (pid {os.getpid()})")
+    except Exception as e:
+        warmup_state['error'] = str(e)
+        print(f"❌ Erro no aquecimento: {e}")
+
+def start_warmup():
+    """Dispara o aquecimento em background (uma vez por processo)"""
+    if classifier is None:
+        return
+    with warmup_lock:
+        if warmup_state['started']:
+            return
+        warmup_state['started'] = True
+    threading.Thread(target=run_warmup, name='warmup', daemon=True).start()
+
+def init_worker():
+    """Chamado pelo gunicorn em cada worker logo após o fork (ver gunicorn.conf.py)"""
+    if DATABASE_AVAILABLE:
+        # Conexões SQLite abertas no master não podem ser compartilhadas entre processos
+        with app.app_context():
+            db.engine.dispose(close=False)
+        retention_job.start()
+    if classifier is not None:
+        classifier.ensure_version_watcher()
+    start_warmup()
+
+# Métricas de processo e das filas, lidas a cada snapshot do metrics.py
+if classifier is not None:
+    metrics.register_gauge('app_index_vectors',
+                           lambda: classifier.index.ntotal if classifier.index is not None else len(classifier.image_paths))
+    if classifier.batcher is not None:
+        metrics.register_gauge('app_queue_depth', classifier.batcher.queue_depth, queue='search_batcher')
+if history_writer is not None:
+    metrics.register_gauge('app_queue_depth', history_writer.queue_depth, queue='history_writer')
+
+@app.before_request
+def start_request_timer():
+    request.start_time = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Rota pelo padrão da URL (não pelo caminho) para não explodir os rótulos
+    route = request.url_rule.rule if request.url_rule is not None else 'not_found'
+    start = getattr(request, 'start_time', None)
+    if start is not None and route != '/metrics':
+        metrics.observe('app_request_seconds', time.perf_counter() - start, route=route)
+        metrics.inc('app_requests_total', route=route, status=str(response.status_code))
+    return response
+
+def shutdown_worker():
+    """Chamado pelo gunicorn quando o worker encerra: grava o histórico pendente"""
+    if retention_job is not None:
+        retention_job.stop()
+    if history_writer is not None:
+        history_writer.close()
+
+def request_classifier():
+    """Classificador do modelo pedido na requisição (campo ou parâmetro "model"; sem ele, o padrão).
+    
+    Retorna (classificador, None) ou (None, resposta de erro). O classificador fica reservado
+    até o fim da requisição (não é fechado se o registro o descarregar nesse meio tempo).
+    """
+    if not classifier:
+        return None, (jsonify({'error': 'Modelo não carregado', 'model_loaded': False}), 500)
+    name = request.values.get('model') or (request.get_json(silent=True) or {}).get('model')
+    try:
+        clf = model_registry.acquire(name)
+        g.setdefault('model_leases', []).append(clf)
+        return clf, None
+    except KeyError:
+        return None, (jsonify({'error': f'Modelo desconhecido: {name}', 'models': model_registry.names}), 400)
+    except RuntimeError as e:
+        return None, (jsonify({'error': str(e), 'model_loaded': False}), 503)
+
+def search_params(values, max_k=10):
+    """k, nprobe e ef_search da requisição (JSON ou formulário), validados como inteiros positivos.
+    
+    Retorna ((k, nprobe, ef_search), None) ou (None, resposta de erro).
+    """
+    params = []
+    for name, default in (('k', 5), ('nprobe', None), ('ef_search', None)):
+        value = values.get(name)
+        if value is None or value == '':
+            params.append(default)
+            continue
+        try:
+            if isinstance(value, (bool, float)):
+                raise ValueError
+            value = int(value)
+        except (TypeError, ValueError):
+            value = 0
+        if value <= 0:
+            return None, (jsonify({'error': f'Parâmetro {name} inválido: use um inteiro positivo'}), 400)
+        params.append(value)
+    k, nprobe, ef_search = params
+    return (min(k, max_k), nprobe, ef_search), None
+
+@app.teardown_request
+def release_classifiers(exc=None):
+    # Com stream_with_context roda só quando a resposta termina de ser enviada
+    for clf in g.pop('model_leases', ()):
+        model_registry.release(clf)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def build_response_results(results):
+    """Converte os resultados do classificador no formato de resposta da API"""
+    response_results = []
+    for result in results:
+        # URL já resolvida pelo catálogo do classificador; sem arquivo local, pular
+        url_path = result.get('url')
+        if not result['display_path'] or not url_path:
+            continue
+        
+        response_results.append({
+            'id': result.get('id'),
+            'url': url_path,
+            'thumbnail_url': result.get('thumbnail_url') or url_path,
+            'original_path': result['original_path'],
+            'distance': result['distance'],
+            'similarity_percent': round(result['similarity_percent'], 1),
+            'filename': result['filename']
+        })
+    return response_results
+
 @app.route('/')
 def index():
     """Página inicial"""
@@ -140,12 +328,19 @@ def index():
 @app.route('/api/stats')
 def get_stats():
     """API para obter estatísticas"""
-    if not classifier:
-        return jsonify({'error': 'Modelo não carregado', 'model_loaded': False}), 500
+    clf, error = request_classifier()
+    if error:
+        return error
     
     try:
-        stats = classifier.get_dataset_stats()
+        stats = clf.get_dataset_stats()
         stats['model_loaded'] = True
+        stats['models'] = model_registry.stats()
+        stats['history_writer'] = history_writer.stats() if history_writer is not None else None
+        stats['retention'] = {
+            'policies': retention_job.policies(),
+            'last_report': retention_job.last_report
+        } if retention_job is not None else None
         return jsonify(stats)
     except Exception as e:
         return jsonify({'error': str(e), 'model_loaded': False}), 500
@@ -186,29 +381,14 @@ def upload_image():
                 os.remove(filepath)
                 return jsonify({'error': f'Arquivo de imagem inválido: {img_error}'}), 400
             
-            # Salvar no banco de dados
-            uploaded_image = None
-            if DATABASE_AVAILABLE:
-                try:
-                    uploaded_image = UploadedImage(
-                        filename=filename,
-                        original_filename=original_filename,
-                        file_size=file_size
-                    )
-                    db.session.add(uploaded_image)
-                    db.session.commit()
-                    image_id = uploaded_image.id
-                except Exception as db_error:
-                    print(f"Erro ao salvar no banco: {db_error}")
-                    image_id = None
-            else:
-                image_id = None
+            # Registro no banco é gravado em background: a resposta identifica o upload pelo filename
+            if history_writer is not None:
+                history_writer.record_upload(filename, original_filename, file_size)
             
             return jsonify({
                 'success': True,
                 'filename': filename,
                 'original_filename': original_filename,
-                'image_id': image_id,
                 'file_size': file_size,
                 'image_format': img_format,
                 'image_dimensions': img_size,
@@ -224,12 +404,17 @@ def upload_image():
 
 @app.route('/search', methods=['POST'])
 def search_similar():
-    if not classifier:
-        return jsonify({'error': 'Modelo não carregado', 'model_loaded': False}), 500
+    clf, error = request_classifier()
+    if error:
+        return error
     
-    data = request.json
+    data = request.get_json(silent=True) or {}
     filename = data.get('filename')
-    k = min(int(data.get('k', 5)), 10)  # Limitar a 10 resultados máximo
+    # Limitar a 10 resultados; nprobe (índices IVF) e ef_search (HNSW) ajustam a busca
+    params, error = search_params(data)
+    if error:
+        return error
+    k, nprobe, ef_search = params
     
     if not filename:
         return jsonify({'error': 'Nome do arquivo não fornecido'}), 400
@@ -241,118 +426,436 @@ def search_similar():
     
     try:
         # Buscar imagens similares
-        results = classifier.search_similar_images(filepath, k=k)
+        results = clf.search_similar_images(filepath, k=k, nprobe=nprobe, ef_search=ef_search)
         
-        # Salvar resultados no banco de dados
-        uploaded_image = None
-        if DATABASE_AVAILABLE:
-            try:
-                uploaded_image = UploadedImage.query.filter_by(filename=filename).first()
-                if uploaded_image and results:
-                    for result in results:
-                        search_result = SearchResult(
-                            uploaded_image_id=uploaded_image.id,
-                            similar_image_path=result['original_path'],
-                            similarity_score=result['distance']
-                        )
-                        db.session.add(search_result)
-                    db.session.commit()
-            except Exception as db_error:
-                print(f"Erro ao salvar resultados: {db_error}")
+        # Resultados vão para a fila do histórico (gravados em background)
+        if history_writer is not None and results:
+            history_writer.record_results(filename, results)
         
         # Preparar resposta
-        response_results = []
-        for result in results:
-            # Converter caminho para URL acessível
-            display_path = result['display_path']
-            url_path = ""
-            
-            if os.path.exists(display_path):
-                # Se estiver na pasta de samples
-                if display_path.startswith(SAMPLE_IMAGES_FOLDER):
-                    url_path = f"/sample_images/{os.path.basename(display_path)}"
-                else:
-                    # Tentar servir do caminho original
-                    try:
-                        rel_path = os.path.relpath(display_path, start='.')
-                        url_path = f"/dataset/{rel_path}"
-                    except:
-                        url_path = ""
-            else:
-                # Se o arquivo não existir localmente, pular
-                continue
-            
-            response_results.append({
-                'url': url_path,
-                'original_path': result['original_path'],
-                'distance': result['distance'],
-                'similarity_percent': round(result['similarity_percent'], 1),
-                'filename': result['filename']
+        with metrics.timer('app_stage_seconds', stage='response_build'):
+            response_results = build_response_results(results)
+            response = jsonify({
+                'success': True,
+                'results': response_results,
+                'count': len(response_results),
+                'model_loaded': True
             })
+        return response
         
-        return jsonify({
+    except Exception as e:
+        print(f"Erro na busca: {e}")
+        return jsonify({'error': f'Erro na busca: {str(e)}', 'model_loaded': True}), 500
+
+def read_zip_member(archive, member, limit):
+    """Bytes do membro, ou None se descompactado ele passa de limit (não confia só no cabeçalho)"""
+    if member.file_size > limit:
+        return None
+    with archive.open(member) as f:
+        data = f.read(limit + 1)
+    return data if len(data) <= limit else None
+
+def iter_batch_uploads(files):
+    """Gera (nome, bytes, erro) para cada imagem enviada, abrindo arquivos .zip.
+    
+    Cada imagem (solta ou dentro do zip) tem o limite de um upload simples
+    (MAX_CONTENT_LENGTH) e a requisição, no máximo MAX_BATCH_FILES imagens.
+    """
+    limit = app.config['MAX_CONTENT_LENGTH']
+    count = 0
+    for file in files:
+        name = secure_filename(file.filename or '')
+        if name.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(file.stream) as archive:
+                    for member in archive.infolist():
+                        if member.is_dir() or not allowed_file(member.filename):
+                            continue
+                        count += 1
+                        if count > MAX_BATCH_FILES:
+                            yield name, None, f'Limite de {MAX_BATCH_FILES} imagens por requisição atingido'
+                            return
+                        data = read_zip_member(archive, member, limit)
+                        if data is None:
+                            yield member.filename, None, f'Arquivo muito grande. Tamanho máximo: {limit / 1024 / 1024:.0f}MB'
+                        else:
+                            yield member.filename, data, None
+            except zipfile.BadZipFile as e:
+                yield name, None, f'Arquivo zip inválido: {e}'
+        elif allowed_file(name):
+            count += 1
+            if count > MAX_BATCH_FILES:
+                yield name, None, f'Limite de {MAX_BATCH_FILES} imagens por requisição atingido'
+                return
+            yield name, file.read(), None
+        else:
+            yield name, None, 'Tipo de arquivo não permitido'
+
+def persist_upload(filename, original_filename, data, results):
+    """Grava o arquivo enviado e o histórico da busca fora do caminho da requisição"""
+    if history_writer is not None:
+        return history_writer.record_upload(filename, original_filename, len(data), results, data=data)
+    try:
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'wb') as f:
+            f.write(data)
+        return True
+    except OSError as e:
+        print(f"Erro ao persistir upload {filename}: {e}")
+        return False
+
+def read_request_image(clf):
+    """Lê e decodifica (uma única vez, em memória) a imagem enviada na requisição.
+    
+    Aceita multipart (campo "file") ou a imagem crua no corpo. Retorna
+    (upload, None) ou (None, resposta de erro).
+    """
+    if 'file' in request.files:
+        file = request.files['file']
+        original_filename = secure_filename(file.filename or '')
+        if original_filename == '':
+            return None, (jsonify({'error': 'Nenhum arquivo selecionado'}), 400)
+        if not allowed_file(original_filename):
+            return None, (jsonify({'error': 'Tipo de arquivo não permitido'}), 400)
+        data = file.read()
+        options = request.form
+    else:
+        data = request.get_data()
+        original_filename = secure_filename(request.args.get('filename', 'upload.jpg'))
+        options = request.args
+    
+    if not data:
+        return None, (jsonify({'error': 'Nenhum arquivo enviado'}), 400)
+    
+    # Decodificação (valida a imagem) em uma única passada, já reduzida para o CLIP quando possível
+    try:
+        with metrics.timer('app_stage_seconds', stage='decode'):
+            img, img_format, img_size = clf.decode_image(data)
+    except Exception as img_error:
+        return None, (jsonify({'error': f'Arquivo de imagem inválido: {img_error}'}), 400)
+    
+    return {
+        'data': data,
+        'original_filename': original_filename,
+        'options': options,
+        'image': img,
+        'format': img_format,
+        'size': img_size
+    }, None
+
+@app.route('/upload_search', methods=['POST'])
+def upload_and_search():
+    """Upload + busca em uma única requisição, decodificando a imagem uma só vez em memória"""
+    clf, error = request_classifier()
+    if error:
+        return error
+    
+    upload, error = read_request_image(clf)
+    if error:
+        return error
+    data = upload['data']
+    original_filename = upload['original_filename']
+    options = upload['options']
+    img = upload['image']
+    
+    params, error = search_params(options)
+    if error:
+        return error
+    k, nprobe, ef_search = params
+    persist = options.get('persist', '1').lower() not in ('0', 'false', 'no')
+    
+    try:
+        results = clf.search_similar_pil(img, k=k, nprobe=nprobe, ef_search=ef_search)
+        # Identificação zero-shot reaproveita o embedding que a busca acabou de calcular
+        identification = None
+        if options.get('classify', '0').lower() in ('1', 'true', 'yes'):
+            identification = clf.classify_pil(img, k=k)
+    except Exception as e:
+        print(f"Erro na busca: {e}")
+        return jsonify({'error': f'Erro na busca: {str(e)}', 'model_loaded': True}), 500
+    
+    filename = None
+    if persist:
+        filename = f"{uuid.uuid4().hex}_{original_filename}"
+        persist = persist_upload(filename, original_filename, data, results)
+    
+    with metrics.timer('app_stage_seconds', stage='response_build'):
+        response_results = build_response_results(results)
+        response = jsonify({
             'success': True,
+            'filename': filename,
+            'original_filename': original_filename,
+            'file_size': len(data),
+            'image_format': upload['format'],
+            'image_dimensions': upload['size'],
             'results': response_results,
             'count': len(response_results),
-            'upload_id': uploaded_image.id if uploaded_image else None,
+            'identification': identification,
+            'persisted': persist,
             'model_loaded': True
         })
-        
+    return response
+
+@app.route('/classify', methods=['POST'])
+def classify_image():
+    """Identificação zero-shot do produto (código NDC) pela matriz de rótulos do CLIP"""
+    clf, error = request_classifier()
+    if error:
+        return error
+    
+    upload, error = read_request_image(clf)
+    if error:
+        return error
+    params, error = search_params(upload['options'], max_k=20)
+    if error:
+        return error
+    k = params[0]
+    
+    try:
+        labels = clf.classify_pil(upload['image'], k=k)
     except Exception as e:
-        print(f"Erro na busca: {e}")
+        print(f"Erro na classificação: {e}")
+        return jsonify({'error': f'Erro na classificação: {str(e)}', 'model_loaded': True}), 500
+    
+    return jsonify({
+        'success': True,
+        'labels': labels,
+        'count': len(labels),
+        'model_loaded': True
+    })
+
+@app.route('/search_text', methods=['POST'])
+def search_text():
+    """Busca imagens do catálogo a partir de um prompt de texto"""
+    clf, error = request_classifier()
+    if error:
+        return error
+    
+    data = request.json or {}
+    text = (data.get('text') or '').strip()
+    if not text:
+        return jsonify({'error': 'Texto não fornecido'}), 400
+    params, error = search_params(data)
+    if error:
+        return error
+    k, nprobe, ef_search = params
+    
+    try:
+        results = clf.search_text(text, k=k, nprobe=nprobe, ef_search=ef_search)
+    except Exception as e:
+        print(f"Erro na busca por texto: {e}")
         return jsonify({'error': f'Erro na busca: {str(e)}', 'model_loaded': True}), 500
+    
+    response_results = build_response_results(results)
+    return jsonify({
+        'success': True,
+        'results': response_results,
+        'count': len(response_results),
+        'model_loaded': True
+    })
+
+@app.route('/similar/<int:catalog_id>')
+def similar_images(catalog_id):
+    """'Mais como esta': vizinhos de uma imagem do catálogo, sem rodar o modelo"""
+    clf, error = request_classifier()
+    if error:
+        return error
+
+    params, error = search_params(request.args, max_k=50)
+    if error:
+        return error
+    k = params[0]
+    try:
+        results, source = clf.similar(catalog_id, k=k)
+    except IndexError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Erro na busca de similares: {e}")
+        return jsonify({'error': f'Erro na busca: {str(e)}', 'model_loaded': True}), 500
+
+    response_results = build_response_results(results)
+    return jsonify({
+        'success': True,
+        'id': catalog_id,
+        'results': response_results,
+        'count': len(response_results),
+        'source': source,
+        'model_loaded': True
+    })
+
+@app.route('/search_batch', methods=['POST'])
+def search_batch():
+    """Busca em lote: várias imagens (ou um .zip) e uma linha JSON por imagem (NDJSON)"""
+    clf, error = request_classifier()
+    if error:
+        return error
+    
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+    
+    params, error = search_params(request.form)
+    if error:
+        return error
+    k, nprobe, ef_search = params
+    
+    def search_chunk(chunk):
+        images, names, lines = [], [], []
+        for name, data, error in chunk:
+            if error:
+                lines.append({'filename': name, 'success': False, 'error': error})
+                continue
+            try:
+                images.append(clf.decode_image(data)[0])
+                names.append(name)
+            except Exception as img_error:
+                lines.append({'filename': name, 'success': False, 'error': f'Arquivo de imagem inválido: {img_error}'})
+        
+        if images:
+            try:
+                batch_results = clf.search_similar_image_batch(
+                    images, k=k, nprobe=nprobe, ef_search=ef_search
+                )
+                for name, results in zip(names, batch_results):
+                    response_results = build_response_results(results)
+                    lines.append({
+                        'filename': name,
+                        'success': True,
+                        'results': response_results,
+                        'count': len(response_results)
+                    })
+            except Exception as e:
+                print(f"Erro na busca em lote: {e}")
+                lines.extend({'filename': name, 'success': False, 'error': f'Erro na busca: {e}'} for name in names)
+        return lines
+    
+    def generate():
+        chunk = []
+        for item in iter_batch_uploads(files):
+            chunk.append(item)
+            if len(chunk) >= SEARCH_BATCH_SIZE:
+                for line in search_chunk(chunk):
+                    yield json.dumps(line) + '\n'
+                chunk = []
+        if chunk:
+            for line in search_chunk(chunk):
+                yield json.dumps(line) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+def history_args():
+    """(limit, cursor) da query string do histórico"""
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        limit = HISTORY_PAGE_SIZE
+    return max(1, min(limit, HISTORY_MAX_PAGE_SIZE)), request.args.get('cursor') or None
 
 @app.route('/history')
 def history():
     """Página de histórico"""
     uploads = []
+    next_cursor = None
     if DATABASE_AVAILABLE:
         try:
-            uploads = UploadedImage.query.order_by(UploadedImage.upload_date.desc()).limit(50).all()
+            limit, cursor = history_args()
+            rows, next_cursor = history_page(limit, cursor)
             
-            # Adicionar contagem de resultados para cada upload
-            for upload in uploads:
-                upload.result_count = SearchResult.query.filter_by(uploaded_image_id=upload.id).count()
+            # Contagem de resultados já vem na mesma consulta
+            for upload, result_count in rows:
+                upload.result_count = result_count
+                uploads.append(upload)
+        except ValueError as e:
+            return str(e), 400
         except Exception as e:
             print(f"Erro ao carregar histórico: {e}")
     
-    return render_template('history.html', uploads=uploads, database_available=DATABASE_AVAILABLE)
+    return render_template('history.html', uploads=uploads, next_cursor=next_cursor,
+                           database_available=DATABASE_AVAILABLE)
 
 @app.route('/api/history')
 def api_history():
-    """API para histórico"""
+    """API para histórico (paginada: ?limit=&cursor=<next_cursor da página anterior>)"""
     uploads_data = []
+    next_cursor = None
     
     if DATABASE_AVAILABLE:
         try:
-            uploads = UploadedImage.query.order_by(UploadedImage.upload_date.desc()).limit(50).all()
+            limit, cursor = history_args()
+            rows, next_cursor = history_page(limit, cursor)
             
-            for upload in uploads:
-                upload_dict = {
-                    'id': upload.id,
-                    'filename': upload.filename,
-                    'original_filename': upload.original_filename,
-                    'upload_date': upload.upload_date.strftime('%Y-%m-%d %H:%M:%S'),
-                    'file_size': upload.file_size
-                }
-                upload_dict['result_count'] = SearchResult.query.filter_by(uploaded_image_id=upload.id).count()
+            for upload, result_count in rows:
+                upload_dict = upload.to_dict()
+                upload_dict['result_count'] = result_count
                 uploads_data.append(upload_dict)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         except Exception as e:
             print(f"Erro na API de histórico: {e}")
     
     return jsonify({
         'success': True,
         'uploads': uploads_data,
+        'next_cursor': next_cursor,
         'database_available': DATABASE_AVAILABLE
     })
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=ORIGINAL_MAX_AGE)
 
 @app.route('/sample_images/<filename>')
 def sample_image(filename):
-    return send_from_directory(SAMPLE_IMAGES_FOLDER, filename)
+    return send_from_directory(SAMPLE_IMAGES_FOLDER, filename, max_age=ORIGINAL_MAX_AGE)
+
+def resolve_original(url_path):
+    """Caminho local do original por trás de uma URL /uploads, /sample_images ou /dataset"""
+    kind, _, filename = url_path.partition('/')
+    if kind == 'uploads':
+        return safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if kind == 'sample_images':
+        return safe_join(SAMPLE_IMAGES_FOLDER, filename)
+    if kind == 'dataset':
+        path = safe_join('.', filename)
+        if path and os.path.isfile(path):
+            return path
+        return safe_join(SAMPLE_IMAGES_FOLDER, os.path.basename(filename))
+    return None
+
+def send_thumbnail(name, etag, immutable=True):
+    max_age = THUMBNAIL_MAX_AGE if immutable else ORIGINAL_MAX_AGE
+    response = send_from_directory(thumbnail_store.folder, name, mimetype=thumbnail_store.mimetype,
+                                   etag=False, max_age=max_age, conditional=False)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.immutable = immutable
+    return response.make_conditional(request)
+
+@app.route('/thumbnails/<name>')
+def thumbnail_file(name):
+    """Miniatura já gerada, pelo nome endereçado pelo conteúdo"""
+    if thumbnail_store is None:
+        abort(404)
+    return send_thumbnail(name, name.rsplit('.', 1)[0])
+
+@app.route('/thumb/<path:url_path>')
+def thumbnail(url_path):
+    """Miniatura de um original, gerada na primeira requisição"""
+    path = resolve_original(url_path)
+    if not path or not os.path.isfile(path):
+        abort(404)
+    if thumbnail_store is None:
+        return send_from_directory(os.path.dirname(path) or '.', os.path.basename(path), max_age=ORIGINAL_MAX_AGE)
+
+    try:
+        name, etag = thumbnail_store.ensure(path)
+    except Exception as e:
+        print(f"Erro ao gerar miniatura de {url_path}: {e}")
+        abort(404)
+    # A URL segue o original (que pode mudar): revalidar pelo ETag do conteúdo
+    return send_thumbnail(name, etag, immutable=False)
 
 @app.route('/dataset/<path:filename>')
 def dataset_file(filename):
@@ -360,13 +863,13 @@ def dataset_file(filename):
     try:
         # Verificar se o arquivo existe
         if os.path.exists(filename):
-            return send_from_directory('.', filename)
+            return send_from_directory('.', filename, max_age=ORIGINAL_MAX_AGE)
         
         # Tentar encontrar na pasta de samples
         basename = os.path.basename(filename)
         sample_path = os.path.join(SAMPLE_IMAGES_FOLDER, basename)
         if os.path.exists(sample_path):
-            return send_from_directory(SAMPLE_IMAGES_FOLDER, basename)
+            return send_from_directory(SAMPLE_IMAGES_FOLDER, basename, max_age=ORIGINAL_MAX_AGE)
         
         # Se não encontrar, retornar imagem placeholder
         return "Arquivo não encontrado", 404
@@ -377,51 +880,155 @@ def dataset_file(filename):
 
 @app.route('/clear_history', methods=['POST'])
 def clear_history():
-    """Limpa histórico antigo"""
+    """Aplica a retenção do histórico agora (mesmas políticas da execução em background)"""
     if not DATABASE_AVAILABLE:
         return jsonify({'error': 'Banco de dados não disponível'}), 500
     
     try:
-        # Manter apenas os últimos 50 uploads
-        all_uploads = UploadedImage.query.order_by(UploadedImage.upload_date.desc()).all()
-        
-        if len(all_uploads) > 50:
-            old_uploads = all_uploads[50:]
-            deleted_count = 0
-            
-            for upload in old_uploads:
-                # Deletar resultados relacionados
-                SearchResult.query.filter_by(uploaded_image_id=upload.id).delete()
-                
-                # Deletar arquivo físico
-                filepath = os.path.join(UPLOAD_FOLDER, upload.filename)
-                if os.path.exists(filepath):
-                    try:
-                        os.remove(filepath)
-                    except:
-                        pass
-                
-                # Deletar do banco
-                db.session.delete(upload)
-                deleted_count += 1
-            
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': f'Histórico limpo: {deleted_count} registros removidos',
-                'deleted': deleted_count
-            })
+        # Registros ainda na fila entram na contagem da política
+        history_writer.flush(timeout=10)
+        # Sem política configurada: o comportamento original da rota (mantém os últimos N)
+        keep = None if retention_job.enabled else int(os.environ.get('CLEAR_HISTORY_KEEP', 50))
+        report = retention_job.run(max_uploads=keep)
+        if report['skipped']:
+            message = 'Retenção já em andamento em outro processo'
         else:
-            return jsonify({
-                'success': True,
-                'message': 'Nada para limpar (menos de 50 registros)',
-                'deleted': 0
-            })
-            
+            message = (f"Histórico limpo: {report['uploads_deleted']} registros removidos, "
+                       f"{report['bytes_reclaimed'] / 1024 / 1024:.1f} MB liberados")
+        return jsonify({
+            'success': True,
+            'message': message,
+            'deleted': report['uploads_deleted'],
+            'report': report
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def admin_error():
+    """(classificador do modelo pedido, None), ou (None, resposta de erro) se a requisição não pode
+    usar a API administrativa"""
+    if not ADMIN_TOKEN:
+        return None, (jsonify({'error': 'API administrativa desativada (defina ADMIN_TOKEN)'}), 404)
+    auth = request.headers.get('Authorization', '')
+    token = auth[len('Bearer '):] if auth.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return None, (jsonify({'error': 'Não autorizado'}), 401)
+    return request_classifier()
+
+def admin_update(update):
+    """Executa uma atualização do catálogo e traduz os erros para a resposta da API"""
+    try:
+        return update(), None
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    except RuntimeError as e:
+        return None, (jsonify({'error': str(e)}), 409)
+    except Exception as e:
+        print(f"❌ Erro ao atualizar o catálogo: {e}")
+        return None, (jsonify({'error': f'Erro ao atualizar o catálogo: {e}'}), 500)
+
+@app.route('/admin/images', methods=['POST'])
+def admin_add_images():
+    """Adiciona imagens de referência (arquivos ou .zip) ao catálogo em uma versão nova"""
+    clf, error = admin_error()
+    if error:
+        return error
+    
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+    try:
+        metadata = json.loads(request.form['metadata']) if request.form.get('metadata') else None
+    except ValueError:
+        return jsonify({'error': 'metadata deve ser uma lista JSON (um objeto por imagem)'}), 400
+    
+    from PIL import Image
+    images, paths, rejected = [], [], []
+    for name, data, upload_error in iter_batch_uploads(files):
+        if upload_error:
+            rejected.append({'filename': name, 'error': upload_error})
+            continue
+        try:
+            img = Image.open(io.BytesIO(data))
+            img.load()
+        except Exception as img_error:
+            rejected.append({'filename': name, 'error': f'Arquivo de imagem inválido: {img_error}'})
+            continue
+        path = os.path.join(REFERENCE_IMAGES_FOLDER, f"{uuid.uuid4().hex}_{secure_filename(name)}")
+        with open(path, 'wb') as f:
+            f.write(data)
+        images.append(img.convert('RGB'))
+        paths.append(path)
+    
+    if not images:
+        return jsonify({'error': 'Nenhuma imagem válida', 'rejected': rejected}), 400
+    if metadata is not None and (not isinstance(metadata, list) or len(metadata) != len(images)):
+        for path in paths:
+            os.remove(path)
+        return jsonify({'error': f'metadata deve ter um objeto para cada uma das {len(images)} imagens'}), 400
+    
+    result, error = admin_update(lambda: clf.add_images(images, paths, metadata))
+    if error:
+        for path in paths:
+            os.remove(path)
+        return error
+    version, ids = result
+    return jsonify({
+        'success': True,
+        'version': version,
+        'added': [{'id': i, 'path': path} for i, path in zip(ids, paths)],
+        'rejected': rejected,
+        'total_images': len(clf.image_paths)
+    })
+
+@app.route('/admin/images/<int:image_id>', methods=['DELETE'])
+@app.route('/admin/images', methods=['DELETE'])
+def admin_remove_images(image_id=None):
+    """Remove imagens do catálogo (por id ou caminho) em uma versão nova"""
+    clf, error = admin_error()
+    if error:
+        return error
+    
+    if image_id is not None:
+        ids, paths = [image_id], []
+    else:
+        body = request.get_json(silent=True) or {}
+        ids, paths = body.get('ids') or [], body.get('paths') or []
+        if not ids and not paths:
+            return jsonify({'error': 'Informe ids e/ou paths'}), 400
+    
+    result, error = admin_update(lambda: clf.remove_images(ids=ids, paths=paths))
+    if error:
+        return error
+    version, removed = result
+    # Os arquivos ficam: versões anteriores (ainda em uso por outros workers) apontam para eles
+    return jsonify({
+        'success': True,
+        'version': version,
+        'removed': removed,
+        'total_images': len(clf.image_paths)
+    })
+
+@app.route('/admin/versions')
+def admin_versions():
+    """Versões do catálogo publicadas e a carregada neste worker"""
+    clf, error = admin_error()
+    if error:
+        return error
+    import snapshots
+    return jsonify({
+        'current': snapshots.current_version(clf.embeddings_path),
+        'loaded': clf.state.version,
+        'versions': snapshots.list_versions(clf.embeddings_path),
+        'total_images': len(clf.image_paths),
+        'pid': os.getpid()
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas de todos os workers no formato texto do Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health')
 def health_check():
     """Endpoint de verificação de saúde da aplicação"""
@@ -446,6 +1053,22 @@ def health_check():
     
     return jsonify(health_status)
 
+@app.route('/ready')
+def readiness_check():
+    """Readiness: só responde 200 quando o serviço consegue de fato responder buscas"""
+    if classifier is None:
+        return jsonify({'ready': False, 'reason': 'Modelo não carregado'}), 503
+    
+    # Sem o hook do gunicorn (ex.: python app.py sem preload) o aquecimento começa aqui
+    start_warmup()
+    status = {
+        'ready': warmup_state['ready'],
+        'warmup_seconds': warmup_state['seconds'],
+        'error': warmup_state['error'],
+        'pid': os.getpid()
+    }
+    return jsonify(status), 200 if warmup_state['ready'] else 503
+
 @app.route('/static/<path:filename>')
 def static_files(filename):
     """Serve arquivos estáticos"""
@@ -462,7 +1085,12 @@ def internal_error(error):
 
 @app.errorhandler(413)
 def too_large(error):
-    return jsonify({'error': 'Arquivo muito grande. Tamanho máximo: 8MB'}), 413
+    # O limite depende da rota (a busca em lote aceita MAX_BATCH_CONTENT_LENGTH)
+    limit = request.max_content_length or app.config['MAX_CONTENT_LENGTH']
+    return jsonify({
+        'error': f'Arquivo muito grande. Tamanho máximo: {limit / 1024 / 1024:.0f}MB',
+        'max_content_length': limit
+    }), 413
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -480,4 +1108,7 @@ if __name__ == '__main__':
         print(f"⚠️  AVISO: Arquivo de embeddings não encontrado em {embeddings_file}")
         print("   A aplicação funcionará, mas não poderá fazer buscas.")
     
+    start_warmup()
+    if retention_job is not None:
+        retention_job.start()
     app.run(debug=debug_mode, host='0.0.0.0', port=port)
\ No newline at end of file
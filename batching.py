@@ -0,0 +1,110 @@
+# batching.py
+"""
+Micro-batching dinâmico: junta as requisições que chegam dentro de uma janela
+curta (até um tamanho máximo de lote) e processa todas em uma única chamada.
+Cada requisição recebe um Future com o seu próprio resultado.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Item que encerra a thread do batcher (close)
+_STOP = object()
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size=16, window_ms=5.0, name="micro-batcher"):
+        """run_batch recebe uma lista de itens e devolve uma lista de resultados na mesma ordem"""
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.batches = 0
+        self.items = 0
+
+    @classmethod
+    def from_env(cls, run_batch, name="micro-batcher"):
+        """Cria o batcher se BATCH_WINDOW_MS > 0, senão retorna None"""
+        window_ms = float(os.environ.get('BATCH_WINDOW_MS', 0))
+        if window_ms <= 0:
+            return None
+        return cls(run_batch, max_batch_size=int(os.environ.get('BATCH_MAX_SIZE', 16)),
+                   window_ms=window_ms, name=name)
+
+    def _ensure_started(self):
+        # A thread é criada no primeiro uso (e recriada após um fork do gunicorn)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        """Enfileira um item e retorna um Future com o resultado"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def close(self):
+        """Encerra a thread (os itens já enfileirados ainda são processados)"""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                self._queue.put((_STOP, None))
+                self._thread = None
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        stop = False
+        while not stop:
+            batch = self._collect()
+            stop = any(item is _STOP for item, _ in batch)
+            batch = [(item, future) for item, future in batch if item is not _STOP]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = self.run_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            'window_ms': self.window * 1000.0,
+            'max_batch_size': self.max_batch_size,
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+            'queue_depth': self.queue_depth(),
+        }
@@ -0,0 +1,371 @@
+# benchmark.py
+"""
+Benchmark do serviço: carga nas rotas e divisão do tempo por etapa.
+
+Carga (latência p50/p95/p99 e consultas por segundo) com as imagens de
+sample_images/, pelo test client do Flask ou contra um servidor no ar:
+
+    python benchmark.py load --requests 200 --concurrency 8
+    python benchmark.py load --url http://localhost:5000 --concurrency 16 --scenario upload_search
+
+Etapas de uma consulta, medidas no processo (decode, preprocess,
+encode_image, index.search, resolução de caminhos e gravação no banco):
+
+    python benchmark.py stages --repeat 3
+
+Os resultados vão para um JSON (--output) e --compare mostra a diferença
+contra um JSON de uma execução anterior.
+
+A carga grava uploads e histórico como uma requisição real. Pelo test client
+eles são apagados no fim (arquivos, registros e resultados); contra um
+servidor no ar (--url) ficam lá, a não ser com --no-persist (upload_search
+com persist=0; o cenário upload+search sempre grava pelo /upload).
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SCENARIOS = ("upload_search", "upload+search")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def load_corpus(sample_images_path="sample_images", limit=None):
+    """(nome, bytes) das imagens de exemplo"""
+    names = sorted(f for f in os.listdir(sample_images_path) if f.lower().endswith(IMAGE_EXTENSIONS))
+    corpus = []
+    for name in names[:limit]:
+        with open(os.path.join(sample_images_path, name), "rb") as f:
+            corpus.append((name, f.read()))
+    if not corpus:
+        raise RuntimeError(f"Nenhuma imagem em {sample_images_path}")
+    return corpus
+
+
+def unique_variants(corpus, count):
+    """count imagens distintas (um pixel alterado) para não medir o cache de consultas"""
+    from PIL import Image
+    variants = []
+    for i in range(count):
+        name, data = corpus[i % len(corpus)]
+        img = Image.open(io.BytesIO(data)).convert("RGB")
+        img.putpixel((0, 0), (i % 256, (i // 256) % 256, (i // 65536) % 256))
+        buf = io.BytesIO()
+        img.save(buf, "PNG")
+        variants.append((f"{os.path.splitext(name)[0]}_{i}.png", buf.getvalue()))
+    return variants
+
+
+def summarize(latencies, elapsed=None):
+    """Percentis em ms (e QPS se elapsed for informado)"""
+    values = np.asarray(latencies, dtype="float64") * 1000.0
+    if not len(values):
+        return {'count': 0}
+    summary = {
+        'count': int(len(values)),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3),
+    }
+    if elapsed:
+        summary['qps'] = round(len(values) / elapsed, 2)
+    return summary
+
+
+class TestClientTarget:
+    """Requisições pelo test client do Flask (sem rede, mesmo processo)"""
+
+    def __init__(self):
+        from app import app
+        self.app = app
+        self.name = "flask-test-client"
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def upload(self, name, data, fields):
+        r = self._client().post(f"/{fields.pop('_route')}", data={'file': (io.BytesIO(data), name), **fields})
+        return r.status_code, r.get_json(silent=True) or {}
+
+    def search(self, filename, k):
+        r = self._client().post("/search", json={'filename': filename, 'k': k})
+        return r.status_code, r.get_json(silent=True) or {}
+
+    def cleanup(self, filenames):
+        """Apaga os uploads do benchmark: arquivos, registros e resultados no histórico"""
+        import app as app_module
+        from database import db, UploadedImage, SearchResult
+
+        if app_module.history_writer is not None:
+            app_module.history_writer.flush(timeout=30)
+        if app_module.DATABASE_AVAILABLE:
+            with self.app.app_context():
+                for start in range(0, len(filenames), 500):
+                    chunk = filenames[start:start + 500]
+                    ids = [row.id for row in db.session.query(UploadedImage.id).filter(UploadedImage.filename.in_(chunk))]
+                    SearchResult.query.filter(SearchResult.uploaded_image_id.in_(ids)).delete(synchronize_session=False)
+                    UploadedImage.query.filter(UploadedImage.id.in_(ids)).delete(synchronize_session=False)
+                db.session.commit()
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(self.app.config['UPLOAD_FOLDER'], filename))
+            except OSError:
+                pass
+
+
+class HttpTarget:
+    """Requisições HTTP contra um servidor no ar (ex.: gunicorn)"""
+
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip("/")
+        self.name = self.url
+        self.timeout = timeout
+
+    def _post(self, route, body, content_type):
+        req = urllib.request.Request(f"{self.url}/{route}", data=body, method="POST",
+                                     headers={'Content-Type': content_type})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return resp.status, json.loads(resp.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            return e.code, {}
+
+    def upload(self, name, data, fields):
+        route = fields.pop('_route')
+        boundary = uuid.uuid4().hex
+        parts = []
+        for key, value in fields.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode())
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b"\r\n")
+        parts.append(f"--{boundary}--\r\n".encode())
+        return self._post(route, b"".join(parts), f"multipart/form-data; boundary={boundary}")
+
+    def search(self, filename, k):
+        return self._post("search", json.dumps({'filename': filename, 'k': k}).encode(), "application/json")
+
+    def cleanup(self, filenames):
+        if filenames:
+            print(f"⚠️ {len(filenames)} uploads do benchmark ficaram em {self.url} (uploads/ e histórico)")
+
+
+def run_load(target, corpus, scenario="upload_search", requests=100, concurrency=4, k=5, warmup=2, offset=0,
+             persist=True, uploaded=None):
+    """Dispara `requests` consultas com `concurrency` threads e mede cada uma.
+
+    Usa as imagens offset.. do corpus (aquecimento primeiro, depois as medidas, sem repetir);
+    os nomes gravados no servidor vão para a lista uploaded.
+    """
+    uploaded = [] if uploaded is None else uploaded
+
+    def one(i):
+        name, data = corpus[i % len(corpus)]
+        start = time.perf_counter()
+        if scenario == "upload_search":
+            status, body = target.upload(name, data, {'_route': "upload_search", 'k': k,
+                                                      'persist': "1" if persist else "0"})
+        else:
+            status, body = target.upload(name, data, {'_route': "upload"})
+            if status == 200:
+                status, _ = target.search(body.get('filename'), k)
+        if body.get('filename'):
+            uploaded.append(body['filename'])
+        return time.perf_counter() - start, status
+
+    for i in range(offset, offset + warmup):
+        one(i)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(one, range(offset + warmup, offset + warmup + requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, status in outcomes if status == 200]
+    report = summarize(latencies, elapsed)
+    report.update({
+        'scenario': scenario,
+        'target': target.name,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': sum(1 for _, status in outcomes if status != 200),
+        'elapsed_s': round(elapsed, 3),
+    })
+    return report
+
+
+def _timed(timings, stage, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timings.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def run_stages(corpus, repeat=1, k=5, db_write=True):
+    """Tempo de cada etapa da consulta, sem o cache de consultas e sem micro-batching"""
+    import torch
+    from app import app, classifier, DATABASE_AVAILABLE
+
+    if classifier is None or not classifier.clip_loaded:
+        raise RuntimeError("Modelo não carregado")
+
+    def write_history(filename, results):
+        from database import db, UploadedImage, SearchResult
+        with app.app_context():
+            uploaded_image = UploadedImage(filename=filename, original_filename=filename, file_size=0)
+            db.session.add(uploaded_image)
+            db.session.flush()
+            for result in results:
+                db.session.add(SearchResult(uploaded_image_id=uploaded_image.id,
+                                            similar_image_path=result['original_path'],
+                                            similarity_score=result['distance']))
+            db.session.commit()
+            return uploaded_image.id
+
+    timings = {}
+    written = []
+    for _ in range(repeat):
+        for name, data in corpus:
+            start = time.perf_counter()
+            img = _timed(timings, "decode", lambda: classifier.decode_image(data)[0])
+            batch = _timed(timings, "preprocess", classifier.preprocess_images, [img])
+
+            def encode():
+                emb = classifier.encoder.encode(batch)
+                emb /= emb.norm(dim=-1, keepdim=True)
+                return emb.cpu().numpy().astype("float32")
+
+            with torch.no_grad():
+                query_emb = _timed(timings, "encode_image", encode)
+            distances, indices = _timed(timings, "index_search", classifier.search_embeddings, query_emb, k)
+            results = _timed(timings, "path_resolution", classifier.format_results, distances[0], indices[0])
+            if db_write and DATABASE_AVAILABLE:
+                written.append(_timed(timings, "db_write", write_history, f"benchmark_{uuid.uuid4().hex}", results))
+            timings.setdefault("total", []).append(time.perf_counter() - start)
+
+    # Não deixa as linhas do benchmark no histórico
+    if written:
+        from database import db, UploadedImage, SearchResult
+        with app.app_context():
+            SearchResult.query.filter(SearchResult.uploaded_image_id.in_(written)).delete(synchronize_session=False)
+            UploadedImage.query.filter(UploadedImage.id.in_(written)).delete(synchronize_session=False)
+            db.session.commit()
+
+    stages = {stage: summarize(values) for stage, values in timings.items()}
+    total = sum(np.mean(values) for stage, values in timings.items() if stage != "total")
+    for stage, summary in stages.items():
+        if stage != "total":
+            summary['share_percent'] = round(100.0 * np.mean(timings[stage]) / total, 1)
+    return stages
+
+
+def environment():
+    """Configuração da execução, para comparar resultados entre mudanças"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    keys = ("ENCODER_BACKEND", "INDEX_BACKEND", "INDEX_METRIC", "BATCH_WINDOW_MS", "QUERY_CACHE_SIZE",
+            "WEB_CONCURRENCY", "GUNICORN_THREADS")
+    return {
+        'commit': commit,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+        'env': {key: os.environ[key] for key in keys if key in os.environ},
+    }
+
+
+def compare(current, previous):
+    """Imprime a variação das métricas de latência contra uma execução anterior"""
+    def flatten(report, prefix=""):
+        for key, value in report.items():
+            if isinstance(value, dict):
+                yield from flatten(value, f"{prefix}{key}.")
+            elif key.endswith("_ms") or key == "qps":
+                yield f"{prefix}{key}", value
+
+    old = dict(flatten(previous.get('results', {})))
+    for key, value in flatten(current['results']):
+        if key in old and old[key]:
+            change = 100.0 * (value - old[key]) / old[key]
+            print(f"   {key:40s} {old[key]:10.2f} -> {value:10.2f} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de carga e de etapas do serviço")
+    parser.add_argument("command", choices=("load", "stages"))
+    parser.add_argument("--url", help="Servidor no ar (padrão: test client do Flask)")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="upload_search")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4],
+                        help="Um ou mais níveis de concorrência")
+    parser.add_argument("--repeat", type=int, default=1, help="Passadas pelo corpus (stages)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--limit", type=int, help="Máximo de imagens do corpus")
+    parser.add_argument("--unique", action="store_true",
+                        help="Uma imagem distinta por requisição (load), sem acertos no cache de consultas")
+    parser.add_argument("--no-persist", action="store_true",
+                        help="upload_search com persist=0 (não grava arquivo nem histórico)")
+    parser.add_argument("--sample-images", default="sample_images")
+    parser.add_argument("--no-db", action="store_true", help="Não medir a gravação no banco (stages)")
+    parser.add_argument("--output", help="Arquivo JSON com os resultados")
+    parser.add_argument("--compare", help="JSON de uma execução anterior")
+    args = parser.parse_args(argv)
+
+    try:
+        corpus = load_corpus(args.sample_images, args.limit)
+        if args.command == "load":
+            target = HttpTarget(args.url) if args.url else TestClientTarget()
+            warmup = 2
+            per_level = warmup + args.requests
+            if args.unique:
+                # Imagens distintas também entre os níveis de concorrência
+                corpus = unique_variants(corpus, per_level * len(args.concurrency))
+            uploaded = []
+            try:
+                results = {
+                    f"concurrency_{c}": run_load(target, corpus, args.scenario, args.requests, c, args.k, warmup,
+                                                 offset=level * per_level, persist=not args.no_persist,
+                                                 uploaded=uploaded)
+                    for level, c in enumerate(args.concurrency)
+                }
+            finally:
+                target.cleanup(uploaded)
+        else:
+            results = run_stages(corpus, args.repeat, args.k, db_write=not args.no_db)
+    except Exception as e:
+        print(f"❌ Erro no benchmark: {e}")
+        return 1
+
+    report = {'command': args.command, 'corpus_images': len(corpus), 'unique': args.unique,
+              'environment': environment(), 'results': results}
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Resultados salvos em {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(f"📊 Comparação com {args.compare}:")
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+# build_embeddings.py
+"""
+Gera embeddings/embeddings.npy, image_paths.npy e image_info.csv a partir de
+uma árvore de imagens (ex.: pastas do ePillID).
+
+Uso:
+    python build_embeddings.py epillid/ePillID_data/classification_data \
+        --output embeddings --workers 4 --batch-size 256
+
+A decodificação e o pré-processamento rodam em um pool de processos e o
+modelo CLIP codifica lotes grandes. O progresso é salvo em blocos em
+<output>/.build; se a execução cair, basta rodar o mesmo comando de novo que
+os blocos já prontos são reaproveitados.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from embedding_store import convert_npy
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif")
+CHECKPOINT_DIR = ".build"
+
+_transform = None
+
+
+def find_images(images_dir, base_dir="."):
+    """Lista as imagens da árvore em ordem determinística"""
+    paths = []
+    for root, dirs, files in os.walk(images_dir):
+        dirs.sort()
+        for f in sorted(files):
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(root, f), start=base_dir))
+    return paths
+
+
+def _init_worker(n_px):
+    global _transform
+    from clip.clip import _transform as clip_transform
+    _transform = clip_transform(n_px)
+
+
+def _preprocess(path):
+    """Decodifica e pré-processa uma imagem dentro do worker"""
+    try:
+        from PIL import Image
+        with Image.open(path) as img:
+            tensor = _transform(img.convert("RGB"))
+        return tensor.numpy()
+    except Exception as e:
+        print(f"⚠️ Imagem ignorada {path}: {e}")
+        return None
+
+
+def _atomic_write_text(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _file_list_hash(paths, model_name):
+    h = hashlib.sha1(model_name.encode("utf-8"))
+    for p in paths:
+        h.update(p.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _prepare_checkpoint(checkpoint_dir, paths, model_name, batch_size):
+    """Cria/valida o manifesto do checkpoint e retorna os blocos já concluídos"""
+    manifest_file = os.path.join(checkpoint_dir, "manifest.json")
+    manifest = {
+        'model': model_name,
+        'batch_size': batch_size,
+        'total_images': len(paths),
+        'file_list_hash': _file_list_hash(paths, model_name),
+    }
+
+    if os.path.exists(manifest_file):
+        with open(manifest_file, encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous == manifest:
+            done = set()
+            for f in os.listdir(checkpoint_dir):
+                if f.startswith("chunk_") and f.endswith(".npz"):
+                    done.add(int(f[len("chunk_"):-len(".npz")]))
+            return done
+        print("⚠️ Checkpoint de outra execução (arquivos ou parâmetros mudaram), recomeçando")
+        shutil.rmtree(checkpoint_dir)
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    _atomic_write_text(manifest_file, json.dumps(manifest, indent=2))
+    return set()
+
+
+def _chunk_file(checkpoint_dir, chunk_id):
+    return os.path.join(checkpoint_dir, f"chunk_{chunk_id:06d}.npz")
+
+
+def _encode_batch(model, tensors, device):
+    import torch
+    batch = torch.from_numpy(np.stack(tensors)).to(device)
+    with torch.no_grad():
+        emb = model.encode_image(batch).float()
+        emb /= emb.norm(dim=-1, keepdim=True)
+    return emb.cpu().numpy().astype("float32")
+
+
+def _submit_chunk(pool, paths, chunk_id, batch_size):
+    chunk_paths = paths[chunk_id * batch_size:(chunk_id + 1) * batch_size]
+    return [pool.submit(_preprocess, p) for p in chunk_paths]
+
+
+def embed_chunks(paths, checkpoint_dir, done, model, n_px, device, batch_size, workers):
+    """Codifica os blocos pendentes, salvando cada um assim que termina.
+
+    O pré-processamento do bloco seguinte roda no pool enquanto o bloco atual
+    passa pelo modelo, então no máximo dois blocos ficam em memória.
+    """
+    pending = [c for c in range((len(paths) + batch_size - 1) // batch_size) if c not in done]
+    if not pending:
+        return
+
+    total = sum(len(paths[c * batch_size:(c + 1) * batch_size]) for c in pending)
+    start = time.time()
+    processed = 0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(n_px,)) as pool:
+        next_futures = _submit_chunk(pool, paths, pending[0], batch_size)
+
+        for position, chunk_id in enumerate(pending):
+            futures = next_futures
+            if position + 1 < len(pending):
+                next_futures = _submit_chunk(pool, paths, pending[position + 1], batch_size)
+
+            tensors = []
+            valid = np.zeros(len(futures), dtype=bool)
+            for i, future in enumerate(futures):
+                tensor = future.result()
+                if tensor is not None:
+                    tensors.append(tensor)
+                    valid[i] = True
+
+            if tensors:
+                embeddings = _encode_batch(model, tensors, device)
+            else:
+                embeddings = np.zeros((0, 0), dtype="float32")
+
+            tmp_file = _chunk_file(checkpoint_dir, chunk_id) + ".tmp"
+            with open(tmp_file, "wb") as f:
+                np.savez(f, embeddings=embeddings, valid=valid)
+            os.replace(tmp_file, _chunk_file(checkpoint_dir, chunk_id))
+
+            processed += len(futures)
+            rate = processed / max(time.time() - start, 1e-6)
+            print(f"   bloco {chunk_id + 1}: {processed}/{total} imagens ({rate:.1f} img/s)")
+
+
+def collect_chunks(num_paths, checkpoint_dir, batch_size):
+    """Junta os blocos do checkpoint na ordem original"""
+    all_embeddings = []
+    valid = []
+    for chunk_id in range((num_paths + batch_size - 1) // batch_size):
+        with np.load(_chunk_file(checkpoint_dir, chunk_id)) as data:
+            if data['embeddings'].size:
+                all_embeddings.append(data['embeddings'])
+            valid.extend(data['valid'].tolist())
+    if not all_embeddings:
+        raise RuntimeError("Nenhuma imagem válida encontrada")
+    return np.concatenate(all_embeddings), valid
+
+
+def write_artifacts(output_dir, embeddings, paths, base_dir="."):
+    """Grava os três artefatos: tudo vai para .tmp primeiro e só então é renomeado"""
+    rows = []
+    for p in paths:
+        full_path = os.path.join(base_dir, p)
+        rows.append([p, os.path.basename(p), os.path.dirname(p), os.path.getsize(full_path)])
+
+    embeddings_file = os.path.join(output_dir, "embeddings.npy")
+    paths_file = os.path.join(output_dir, "image_paths.npy")
+    info_file = os.path.join(output_dir, "image_info.csv")
+
+    with open(f"{embeddings_file}.tmp", "wb") as f:
+        np.save(f, embeddings.astype("float32"))
+    with open(f"{paths_file}.tmp", "wb") as f:
+        np.save(f, np.array(paths, dtype=object), allow_pickle=True)
+    with open(f"{info_file}.tmp", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "filename", "folder", "size"])
+        writer.writerows(rows)
+
+    for final in (info_file, paths_file, embeddings_file):
+        os.replace(f"{final}.tmp", final)
+
+
+def build(images_dir, output_dir="embeddings", model_name="ViT-B/32", device="cpu",
+          batch_size=256, workers=None, base_dir=".", keep_checkpoint=False, index_config=None,
+          store_dtype="float32"):
+    """Executa o build completo (retomando de um checkpoint se existir)"""
+    import clip
+
+    paths = find_images(images_dir, base_dir=base_dir)
+    if not paths:
+        raise RuntimeError(f"Nenhuma imagem encontrada em {images_dir}")
+    print(f"📁 {len(paths)} imagens encontradas em {images_dir}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_dir = os.path.join(output_dir, CHECKPOINT_DIR)
+    done = _prepare_checkpoint(checkpoint_dir, paths, model_name, batch_size)
+    if done:
+        print(f"♻️  Retomando: {len(done)} blocos já concluídos")
+
+    print(f"Carregando modelo CLIP {model_name}...")
+    model, _ = clip.load(model_name, device=device)
+    model.eval()
+    n_px = model.visual.input_resolution
+
+    full_paths = [os.path.join(base_dir, p) for p in paths]
+    embed_chunks(full_paths, checkpoint_dir, done, model, n_px, device, batch_size, workers)
+
+    embeddings, valid = collect_chunks(len(paths), checkpoint_dir, batch_size)
+    valid_paths = [p for p, ok in zip(paths, valid) if ok]
+    write_artifacts(output_dir, embeddings, valid_paths, base_dir=base_dir)
+    # O store em mmap tem prioridade na carga, então precisa acompanhar os .npy
+    convert_npy(output_dir, dtype=store_dtype)
+    print(f"✅ {embeddings.shape[0]} embeddings salvos em {output_dir}")
+
+    if index_config:
+        import vector_index
+        index, meta = vector_index.build_index(embeddings, **index_config)
+        vector_index.save_index(index, meta, output_dir)
+        print(f"✅ Índice {meta['factory']} salvo em {output_dir}")
+
+    if not keep_checkpoint:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    return embeddings.shape
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera os embeddings CLIP do catálogo de imagens")
+    parser.add_argument("images_dir", help="Pasta raiz com as imagens de referência")
+    parser.add_argument("--output", default="embeddings", help="Pasta de saída dos artefatos")
+    parser.add_argument("--model", default="ViT-B/32", help="Modelo CLIP")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch-size", type=int, default=256, help="Imagens por lote do encode_image")
+    parser.add_argument("--workers", type=int, default=None, help="Processos de pré-processamento")
+    parser.add_argument("--base-dir", default=".", help="Caminhos gravados ficam relativos a esta pasta")
+    parser.add_argument("--keep-checkpoint", action="store_true", help="Não apagar a pasta .build ao final")
+    parser.add_argument("--store-dtype", choices=("float32", "float16"), default="float32",
+                        help="Tipo dos vetores no store em mmap")
+    parser.add_argument("--index-backend", choices=("flat", "ivf_flat", "ivf_pq", "hnsw"),
+                        help="Também treina e salva o índice FAISS com este backend")
+    parser.add_argument("--index-metric", choices=("l2", "ip"), default="l2")
+    parser.add_argument("--nlist", type=int, help="Listas do IVF (padrão: 4·√n)")
+    parser.add_argument("--pq-m", type=int, help="Subquantizadores do IVF-PQ")
+    parser.add_argument("--hnsw-m", type=int, help="Vizinhos por nó do HNSW")
+    parser.add_argument("--thumbnails", action="store_true", help="Gerar as miniaturas do catálogo ao final")
+    parser.add_argument("--perceptual-hashes", action="store_true",
+                        help="Gerar os hashes perceptuais do catálogo ao final (pré-filtro das consultas)")
+    parser.add_argument("--knn-graph", type=int, metavar="K",
+                        help="Calcular o grafo dos K vizinhos de cada imagem ao final (/similar)")
+    args = parser.parse_args(argv)
+
+    index_config = None
+    if args.index_backend:
+        index_config = {'backend': args.index_backend, 'metric': args.index_metric}
+        for key in ('nlist', 'pq_m', 'hnsw_m'):
+            if getattr(args, key):
+                index_config[key] = getattr(args, key)
+
+    try:
+        build(args.images_dir, output_dir=args.output, model_name=args.model, device=args.device,
+              batch_size=args.batch_size, workers=args.workers, base_dir=args.base_dir,
+              keep_checkpoint=args.keep_checkpoint, index_config=index_config, store_dtype=args.store_dtype)
+    except Exception as e:
+        print(f"❌ Erro no build: {e}")
+        return 1
+
+    if args.perceptual_hashes:
+        import perceptual
+        if perceptual.main([args.output]):
+            return 1
+    if args.knn_graph:
+        import knn_graph
+        if knn_graph.main([args.output, "--k", str(args.knn_graph)]):
+            return 1
+    if args.thumbnails:
+        import thumbnails
+        return thumbnails.main([args.output])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
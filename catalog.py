@@ -0,0 +1,156 @@
+# catalog.py
+"""
+Catálogo de resultados: para cada id de vetor guarda, já resolvidos, o caminho
+de exibição, a URL, o nome do arquivo e os metadados do image_info.csv.
+
+É montado uma vez quando o índice é carregado, listando cada pasta uma única
+vez (em vez de um os.path.exists por resultado). Uma thread em background
+confere o mtime das pastas e só remonta o catálogo quando algo mudou, então
+a busca faz apenas consultas em listas, sem chamadas ao sistema de arquivos.
+
+Cada entrada também aponta para a sua miniatura: /thumbnails/<nome> quando ela
+já foi gerada no build (manifest do thumbnails.py) ou /thumb/<url>, que gera
+a miniatura na primeira requisição.
+"""
+import os
+import threading
+
+SAMPLE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class ResultCatalog:
+    def __init__(self, image_paths, sample_images_path, metadata=None, refresh_interval=30.0,
+                 thumbnails=None):
+        self.image_paths = image_paths
+        self.sample_images_path = sample_images_path
+        self.metadata = metadata or {}
+        self.thumbnails = thumbnails or {}
+        self.refresh_interval = refresh_interval
+        self._watcher = None
+        self._watcher_pid = None
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.refresh()
+
+    @staticmethod
+    def _list_dir(folder):
+        try:
+            with os.scandir(folder or ".") as entries:
+                return [entry.name for entry in entries if entry.is_file()]
+        except OSError:
+            return []
+
+    def _folders(self):
+        folders = {os.path.dirname(p) for p in self.image_paths}
+        folders.add(self.sample_images_path)
+        return sorted(folders)
+
+    def _signature(self):
+        signature = []
+        for folder in self._folders():
+            try:
+                signature.append((folder, os.stat(folder or ".").st_mtime_ns))
+            except OSError:
+                signature.append((folder, None))
+        return tuple(signature)
+
+    def _thumbnail_url(self, display_path, url):
+        if not url:
+            return ""
+        name = self.thumbnails.get(display_path)
+        return f"/thumbnails/{name}" if name else f"/thumb{url}"
+
+    def refresh(self):
+        """Remonta o catálogo a partir de uma listagem de cada pasta"""
+        signature = self._signature()
+        existing = set()
+        for folder in {os.path.dirname(p) for p in self.image_paths}:
+            existing.update(os.path.join(folder, name) for name in self._list_dir(folder))
+
+        sample_dir = self.sample_images_path
+        sample_files = [f for f in self._list_dir(sample_dir) if f.lower().endswith(SAMPLE_EXTENSIONS)]
+        sample_set = set(sample_files)
+
+        display_paths = []
+        urls = []
+        thumbnail_urls = []
+        filenames = []
+        for img_path in self.image_paths:
+            filename = os.path.basename(img_path)
+            if img_path in existing:
+                display_path = img_path
+            elif filename in sample_set:
+                display_path = os.path.join(sample_dir, filename)
+            else:
+                display_path = None
+
+            if display_path is None:
+                url = ""
+            elif display_path.startswith(sample_dir):
+                url = f"/sample_images/{os.path.basename(display_path)}"
+            else:
+                url = f"/dataset/{os.path.relpath(display_path, start='.')}"
+
+            display_paths.append(display_path)
+            urls.append(url)
+            thumbnail_urls.append(self._thumbnail_url(display_path, url))
+            filenames.append(filename)
+
+        samples = []
+        for f in sample_files:
+            full_path = os.path.join(sample_dir, f)
+            samples.append({
+                'path': f"/sample_images/{f}",
+                'thumbnail': self._thumbnail_url(full_path, f"/sample_images/{f}"),
+                'filename': f,
+                'full_path': full_path,
+            })
+
+        # Troca tudo de uma vez: quem estiver lendo vê o catálogo antigo ou o novo inteiro
+        self._data = (display_paths, urls, filenames, samples, thumbnail_urls)
+        self._signature_value = signature
+        self.builds += 1
+
+    def _watch(self):
+        stop = self._stop
+        while not stop.wait(self.refresh_interval):
+            try:
+                if self._signature() != self._signature_value:
+                    self.refresh()
+                    print(f"♻️  Catálogo de resultados atualizado ({len(self.image_paths)} imagens)")
+            except Exception as e:
+                print(f"⚠️ Erro ao atualizar catálogo: {e}")
+
+    def _ensure_watcher(self):
+        # Criada no primeiro uso para sobreviver ao fork dos workers do gunicorn
+        if self.refresh_interval <= 0 or (self._watcher is not None and self._watcher_pid == os.getpid()):
+            return
+        with self._lock:
+            if self._watcher is None or self._watcher_pid != os.getpid():
+                self._stop = threading.Event()
+                self._watcher_pid = os.getpid()
+                self._watcher = threading.Thread(target=self._watch, name="catalog-watcher", daemon=True)
+                self._watcher.start()
+
+    def stop(self):
+        if self._watcher is not None and self._watcher_pid == os.getpid():
+            self._stop.set()
+
+    def entry(self, idx):
+        """Caminho de exibição, URL e nome do arquivo do vetor idx"""
+        self._ensure_watcher()
+        display_paths, urls, filenames, _, _ = self._data
+        return display_paths[idx], urls[idx], filenames[idx]
+
+    def thumbnail_url(self, idx):
+        return self._data[4][idx]
+
+    def metadata_row(self, idx):
+        return {column: values[idx] for column, values in self.metadata.items()}
+
+    def sample_images(self):
+        self._ensure_watcher()
+        return self._data[3]
+
+    def __len__(self):
+        return len(self.image_paths)
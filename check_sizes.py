@@ -11,6 +11,12 @@ def check_file_sizes():
         print(f"embeddings.npy: {emb_size:.2f} MB")
         total_size += emb_size
     
+    # Store em mmap (embedding_store.py)
+    if os.path.exists("embeddings/vectors.bin"):
+        store_size = os.path.getsize("embeddings/vectors.bin") / 1024 / 1024
+        print(f"vectors.bin (mmap, compartilhado entre workers): {store_size:.2f} MB")
+        total_size += store_size
+    
     # Verificar sample images
     sample_size = 0
     if os.path.exists("sample_images"):
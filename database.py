@@ -1,12 +1,19 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, select, tuple_
 from datetime import datetime
+import base64
 import os
 
 db = SQLAlchemy()
 
 class UploadedImage(db.Model):
+    # (upload_date, id) atende o ORDER BY do histórico e a paginação por cursor
+    __table_args__ = (
+        db.Index('ix_uploaded_image_upload_date_id', 'upload_date', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(200), nullable=False)
+    filename = db.Column(db.String(200), nullable=False, index=True)
     original_filename = db.Column(db.String(200), nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     file_size = db.Column(db.Integer)
@@ -22,13 +29,21 @@ class UploadedImage(db.Model):
 
 class SearchResult(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    uploaded_image_id = db.Column(db.Integer, db.ForeignKey('uploaded_image.id'), nullable=False)
+    uploaded_image_id = db.Column(db.Integer, db.ForeignKey('uploaded_image.id'), nullable=False, index=True)
     similar_image_path = db.Column(db.String(500), nullable=False)
     similarity_score = db.Column(db.Float)
     search_date = db.Column(db.DateTime, default=datetime.utcnow)
     
     uploaded_image = db.relationship('UploadedImage', backref='search_results')
 
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL: leitores não bloqueiam o escritor; synchronous=NORMAL basta com WAL"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+    cursor.close()
+
 def init_db(app):
     """Inicializa o banco de dados"""
     basedir = os.path.abspath(os.path.dirname(__file__))
@@ -38,4 +53,47 @@ def init_db(app):
     db.init_app(app)
     
     with app.app_context():
-        db.create_all()
\ No newline at end of file
+        event.listen(db.engine, 'connect', set_sqlite_pragmas)
+        db.create_all()
+        # create_all não cria índices em tabelas que já existiam
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+
+def encode_cursor(upload_date, upload_id):
+    raw = f"{upload_date.isoformat()}|{upload_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Converte o cursor opaco em (upload_date, id); ValueError se for inválido"""
+    try:
+        upload_date, upload_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(upload_date), int(upload_id)
+    except Exception:
+        raise ValueError(f"Cursor inválido: {cursor}")
+
+def history_page(limit=50, cursor=None):
+    """Uma página do histórico (mais recentes primeiro) com a contagem de resultados.
+
+    Uma única consulta: a contagem é uma subconsulta correlacionada que usa o
+    índice de SearchResult.uploaded_image_id, e a página começa depois do
+    cursor (upload_date, id) em vez de usar OFFSET, então o custo não cresce
+    com o tamanho da tabela. Retorna ([(upload, result_count)], next_cursor).
+    """
+    result_count = (
+        select(func.count(SearchResult.id))
+        .where(SearchResult.uploaded_image_id == UploadedImage.id)
+        .correlate(UploadedImage)
+        .scalar_subquery()
+    )
+    query = db.session.query(UploadedImage, result_count.label('result_count'))
+    if cursor:
+        query = query.filter(tuple_(UploadedImage.upload_date, UploadedImage.id) < tuple_(*decode_cursor(cursor)))
+    rows = query.order_by(UploadedImage.upload_date.desc(), UploadedImage.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1][0]
+        next_cursor = encode_cursor(last.upload_date, last.id)
+    return rows, next_cursor
\ No newline at end of file
@@ -0,0 +1,174 @@
+# embedding_cache.py
+"""
+Cache de embeddings de consulta indexado pelo hash dos pixels decodificados.
+
+Camada 1: LRU em memória, limitada em número de entradas.
+Camada 2 (opcional): um .npy por chave em disco, que sobrevive a reinícios e
+é compartilhado entre os workers do gunicorn. Limitada a
+QUERY_CACHE_DISK_MAX_ENTRIES arquivos: cada acerto renova o mtime do arquivo
+e, de tempos em tempos (a cada ~10% do limite em gravações por processo), os
+menos usados recentemente são apagados até sobrar 90% do limite.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Fração do limite que sobra depois de uma limpeza do disco
+DISK_PRUNE_TARGET = 0.9
+
+
+class QueryEmbeddingCache:
+    def __init__(self, max_entries=256, disk_path=None, namespace="", max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.max_disk_entries = max(1, int(max_disk_entries))
+        # Gravações até a próxima verificação do tamanho em disco (0: verifica na primeira)
+        self._puts_until_prune = 0
+        self.disk_evictions = 0
+        self.namespace = namespace
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_path:
+            os.makedirs(self.disk_path, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, namespace=""):
+        """Cria o cache a partir de QUERY_CACHE_SIZE, QUERY_CACHE_DIR e QUERY_CACHE_DISK_MAX_ENTRIES"""
+        return cls(
+            max_entries=int(os.environ.get('QUERY_CACHE_SIZE', 256)),
+            disk_path=os.environ.get('QUERY_CACHE_DIR') or None,
+            namespace=namespace,
+            max_disk_entries=int(os.environ.get('QUERY_CACHE_DISK_MAX_ENTRIES', 100000)),
+        )
+
+    def image_key(self, img):
+        """Hash dos pixels decodificados (mesma foto em outro arquivo gera a mesma chave)"""
+        h = hashlib.blake2b(digest_size=20)
+        h.update(self.namespace.encode("utf-8"))
+        h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}".encode("utf-8"))
+        h.update(img.tobytes())
+        return h.hexdigest()
+
+    def _disk_file(self, key):
+        return os.path.join(self.disk_path, key[:2], f"{key}.npy")
+
+    def get(self, key):
+        """Retorna o embedding em cache ou None"""
+        with self._lock:
+            emb = self._entries.get(key)
+            if emb is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return emb
+
+        if self.disk_path:
+            disk_file = self._disk_file(key)
+            try:
+                emb = np.load(disk_file)
+                # mtime = último uso (ordem da limpeza LRU)
+                os.utime(disk_file)
+            except (OSError, ValueError):
+                emb = None
+            if emb is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, emb)
+                return emb
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, emb):
+        """Guarda o embedding na memória e, se configurado, em disco"""
+        emb = np.ascontiguousarray(emb, dtype="float32")
+        emb.setflags(write=False)
+        self._remember(key, emb)
+
+        if self.disk_path:
+            disk_file = self._disk_file(key)
+            try:
+                os.makedirs(os.path.dirname(disk_file), exist_ok=True)
+                tmp_file = f"{disk_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_file, "wb") as f:
+                    np.save(f, emb)
+                os.replace(tmp_file, disk_file)
+            except OSError as e:
+                print(f"⚠️ Erro ao gravar cache em disco: {e}")
+                return
+            with self._lock:
+                self._puts_until_prune -= 1
+                prune = self._puts_until_prune <= 0
+                if prune:
+                    self._puts_until_prune = max(1, self.max_disk_entries // 10)
+            if prune:
+                self.prune_disk()
+
+    def _disk_entries(self):
+        entries = []
+        try:
+            with os.scandir(self.disk_path) as shards:
+                for shard in shards:
+                    if not shard.is_dir():
+                        continue
+                    with os.scandir(shard.path) as files:
+                        for entry in files:
+                            if entry.name.endswith(".npy"):
+                                try:
+                                    entries.append((entry.stat().st_mtime, entry.path))
+                                except OSError:
+                                    pass
+        except OSError:
+            pass
+        return entries
+
+    def prune_disk(self):
+        """Apaga os arquivos usados há mais tempo se o disco passou do limite; retorna quantos"""
+        if not self.disk_path:
+            return 0
+        entries = self._disk_entries()
+        if len(entries) <= self.max_disk_entries:
+            return 0
+        entries.sort()
+        removed = 0
+        for _, path in entries[:len(entries) - int(self.max_disk_entries * DISK_PRUNE_TARGET)]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                # Outro worker já apagou
+                pass
+        with self._lock:
+            self.disk_evictions += removed
+        return removed
+
+    def _remember(self, key, emb):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = emb
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'disk_enabled': bool(self.disk_path),
+                'max_disk_entries': self.max_disk_entries if self.disk_path else None,
+                'disk_evictions': self.disk_evictions,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
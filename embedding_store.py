@@ -0,0 +1,192 @@
+# embedding_store.py
+"""
+Formato compacto em disco para os embeddings, sem pickle.
+
+    store.json        cabeçalho (quantidade, dimensões, dtype, colunas)
+    vectors.bin       matriz float32/float16 crua, aberta com mmap
+    paths.strings     strings UTF-8 concatenadas
+    paths.offsets     int64 com n+1 offsets para paths.strings
+    meta_<coluna>.*   uma tabela de strings por coluna do image_info.csv
+
+Tudo é aberto com mmap somente leitura, então os workers do gunicorn
+compartilham o page cache do sistema em vez de cada um ter sua cópia, e a
+abertura não depende do tamanho do catálogo.
+
+Conversão dos artefatos .npy atuais:
+    python embedding_store.py embeddings --dtype float16
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+STORE_FILE = "store.json"
+VECTORS_FILE = "vectors.bin"
+STORE_VERSION = 1
+
+
+class StringTable:
+    """Lista de strings somente leitura indexada por offsets"""
+
+    def __init__(self, data_file, offsets_file):
+        self.offsets = np.memmap(offsets_file, dtype="<i8", mode="r")
+        if os.path.getsize(data_file):
+            self.data = np.memmap(data_file, dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def tolist(self):
+        return list(self)
+
+    @staticmethod
+    def write(strings, data_file, offsets_file):
+        offsets = np.zeros(len(strings) + 1, dtype="<i8")
+        with open(data_file, "wb") as f:
+            position = 0
+            for i, s in enumerate(strings):
+                encoded = str(s).encode("utf-8")
+                f.write(encoded)
+                position += len(encoded)
+                offsets[i + 1] = position
+        offsets.tofile(offsets_file)
+
+
+class EmbeddingStore:
+    """Embeddings + caminhos + metadados abertos via mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, STORE_FILE), encoding="utf-8") as f:
+            self.header = json.load(f)
+
+        count = self.header['count']
+        dimensions = self.header['dimensions']
+        self.vectors = np.memmap(os.path.join(path, VECTORS_FILE), dtype=self.header['dtype'],
+                                 mode="r", shape=(count, dimensions))
+        self.paths = StringTable(os.path.join(path, "paths.strings"),
+                                 os.path.join(path, "paths.offsets"))
+        self.metadata = {
+            column: StringTable(os.path.join(path, f"meta_{column}.strings"),
+                                os.path.join(path, f"meta_{column}.offsets"))
+            for column in self.header.get('metadata_columns', [])
+        }
+
+    def __len__(self):
+        return self.header['count']
+
+    def row(self, i):
+        """Metadados do image_info.csv para o vetor i"""
+        info = {'path': self.paths[i]}
+        for column, table in self.metadata.items():
+            info[column] = table[i]
+        return info
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, STORE_FILE))
+
+    @classmethod
+    def open(cls, path):
+        """Abre o store se ele existir, senão retorna None"""
+        if not cls.exists(path):
+            return None
+        return cls(path)
+
+    @staticmethod
+    def write(path, embeddings, paths, metadata=None, dtype="float32"):
+        """Grava o store; store.json é renomeado por último e marca o store como completo"""
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"dtype não suportado: {dtype}")
+        embeddings = np.asarray(embeddings)
+        if len(embeddings) != len(paths):
+            raise ValueError(f"{len(embeddings)} embeddings para {len(paths)} caminhos")
+        metadata = metadata or {}
+
+        os.makedirs(path, exist_ok=True)
+        renames = []
+
+        def tmp(name):
+            final = os.path.join(path, name)
+            renames.append((f"{final}.tmp", final))
+            return f"{final}.tmp"
+
+        np.ascontiguousarray(embeddings, dtype=dtype).tofile(tmp(VECTORS_FILE))
+        StringTable.write(paths, tmp("paths.strings"), tmp("paths.offsets"))
+        for column, values in metadata.items():
+            StringTable.write(values, tmp(f"meta_{column}.strings"), tmp(f"meta_{column}.offsets"))
+
+        header = {
+            'version': STORE_VERSION,
+            'count': int(embeddings.shape[0]),
+            'dimensions': int(embeddings.shape[1]),
+            'dtype': dtype,
+            'metadata_columns': list(metadata),
+        }
+        with open(tmp(STORE_FILE), "w", encoding="utf-8") as f:
+            json.dump(header, f, indent=2)
+
+        for tmp_name, final in renames:
+            os.replace(tmp_name, final)
+
+
+def read_image_info(info_file, paths):
+    """Lê o image_info.csv alinhado com a lista de caminhos (colunas exceto path)"""
+    if not os.path.exists(info_file):
+        return {}
+
+    with open(info_file, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        columns = [c for c in (reader.fieldnames or []) if c != "path"]
+        rows = {row.get('path'): row for row in reader}
+
+    metadata = {column: [] for column in columns}
+    for p in paths:
+        row = rows.get(p, {})
+        for column in columns:
+            metadata[column].append(row.get(column) or "")
+    return metadata
+
+
+def convert_npy(embeddings_path, dtype="float32"):
+    """Converte embeddings.npy/image_paths.npy/image_info.csv para o store"""
+    embeddings = np.load(os.path.join(embeddings_path, "embeddings.npy"), mmap_mode="r")
+    paths = [str(p) for p in np.load(os.path.join(embeddings_path, "image_paths.npy"), allow_pickle=True)]
+    metadata = read_image_info(os.path.join(embeddings_path, "image_info.csv"), paths)
+    EmbeddingStore.write(embeddings_path, embeddings, paths, metadata, dtype=dtype)
+    return len(paths)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Converte os artefatos .npy para o store com mmap")
+    parser.add_argument("embeddings_path", nargs="?", default="embeddings")
+    parser.add_argument("--dtype", choices=("float32", "float16"), default="float32")
+    args = parser.parse_args(argv)
+
+    try:
+        count = convert_npy(args.embeddings_path, dtype=args.dtype)
+    except Exception as e:
+        print(f"❌ Erro na conversão: {e}")
+        return 1
+    print(f"✅ Store {args.dtype} com {count} vetores gravado em {args.embeddings_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+# encoders.py
+"""
+Backends de inferência do encoder de imagens do CLIP em CPU.
+
+    eager        modelo PyTorch original (fp32)
+    torchscript  grafo TorchScript congelado (exportado ou traçado na carga)
+    compile      torch.compile sobre o encoder visual (torch >= 2.0)
+    onnx         sessão do ONNX Runtime (precisa de um .onnx exportado e do
+                 pacote opcional onnxruntime, fora do requirements.txt)
+    int8         quantização dinâmica int8 das camadas Linear
+
+Os backends exportados (torchscript, onnx, int8) não carregam o CLIP
+completo: só o encoder visual fica residente.
+
+Versão do torch: eager, torchscript, int8 e a exportação ONNX funcionam a
+partir do torch 1.13 (o instalado por setup.sh/build.sh). O backend compile
+precisa do torch 2.0+; em versões anteriores cai para eager com um aviso. A
+exportação ONNX usa o exportador TorchScript (dynamo=False a partir do torch
+2.5, onde o parâmetro existe; antes ele já é o único exportador). Sem o
+artefato .onnx ou sem o onnxruntime instalado, o backend onnx cai para eager
+com um aviso.
+
+Exportar e conferir contra a referência fp32:
+    python encoders.py export --backend onnx
+    python encoders.py check --backend onnx --tolerance 0.999
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+BACKENDS = ("eager", "torchscript", "compile", "onnx", "int8")
+EXPORTABLE_BACKENDS = ("torchscript", "onnx", "int8")
+DEFAULT_ENCODERS_DIR = os.path.join("embeddings", "encoders")
+# Versão mínima do torch para o torch.compile
+COMPILE_MIN_TORCH = (2, 0)
+# Primeira versão em que torch.onnx.export aceita o parâmetro dynamo
+ONNX_DYNAMO_ARG_TORCH = (2, 5)
+
+_ARTIFACT_SUFFIX = {
+    'torchscript': ".torchscript.pt",
+    'int8': ".int8.pt",
+    'onnx': ".onnx",
+}
+
+
+def torch_version():
+    """(major, minor) do torch instalado (ex.: '1.13.1+cpu' -> (1, 13))"""
+    parts = torch.__version__.split("+")[0].split(".")
+    return tuple(int("".join(ch for ch in part if ch.isdigit()) or 0) for part in parts[:2])
+
+
+def artifact_file(encoders_dir, model_name, backend):
+    return os.path.join(encoders_dir, model_name.replace("/", "-") + _ARTIFACT_SUFFIX[backend])
+
+
+class TorchEncoder:
+    """Encoder baseado em um módulo/função PyTorch"""
+
+    def __init__(self, backend, module):
+        self.backend = backend
+        self.module = module
+
+    def encode(self, batch):
+        with torch.no_grad():
+            return self.module(batch).float()
+
+
+class OnnxEncoder:
+    """Encoder executado pelo ONNX Runtime"""
+    backend = "onnx"
+
+    def __init__(self, onnx_file):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_file, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def encode(self, batch):
+        pixels = batch.cpu().numpy().astype("float32")
+        output = self.session.run(None, {self.input_name: pixels})[0]
+        return torch.from_numpy(output).float()
+
+
+def _visual_module(model):
+    return model.visual.float().eval()
+
+
+def _quantize_int8(model):
+    return torch.ao.quantization.quantize_dynamic(_visual_module(model), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _trace(module, n_px):
+    example = torch.randn(1, 3, n_px, n_px)
+    with torch.no_grad():
+        traced = torch.jit.trace(module, example)
+    return torch.jit.freeze(traced.eval())
+
+
+def _read_artifact_info(path):
+    info_file = f"{path}.json"
+    if not os.path.exists(info_file):
+        return None
+    with open(info_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_clip(model_name, device):
+    import clip
+    model, preprocess = clip.load(model_name, device=device)
+    return model.eval(), preprocess
+
+
+def load_image_encoder(model_name="ViT-B/32", backend="eager", device="cpu", encoders_dir=DEFAULT_ENCODERS_DIR):
+    """Retorna (encoder, preprocess, modelo CLIP ou None)"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de encoder desconhecido: {backend} (opções: {', '.join(BACKENDS)})")
+
+    if backend in EXPORTABLE_BACKENDS:
+        path = artifact_file(encoders_dir, model_name, backend)
+        info = _read_artifact_info(path)
+        encoder = None
+        if os.path.exists(path) and info:
+            if backend == "onnx":
+                try:
+                    encoder = OnnxEncoder(path)
+                except ImportError:
+                    print("⚠️ onnxruntime não instalado (pip install onnxruntime), usando eager")
+                    backend = "eager"
+            else:
+                encoder = TorchEncoder(backend, torch.jit.load(path, map_location=device))
+        if encoder is not None:
+            from clip.clip import _transform
+            preprocess = _transform(info['input_resolution'])
+            print(f"✅ Encoder {backend} carregado de {path}")
+            return encoder, preprocess, None
+
+        if backend == "onnx":
+            print(f"⚠️ {path} não encontrado (rode: python encoders.py export --backend onnx), usando eager")
+            backend = "eager"
+
+    if backend == "compile" and torch_version() < COMPILE_MIN_TORCH:
+        print(f"⚠️ Backend compile precisa do torch >= {'.'.join(map(str, COMPILE_MIN_TORCH))} "
+              f"(instalado: {torch.__version__}), usando eager")
+        backend = "eager"
+
+    model, preprocess = _load_clip(model_name, device)
+    n_px = model.visual.input_resolution
+
+    if backend == "eager":
+        encoder = TorchEncoder("eager", model.encode_image)
+    elif backend == "compile":
+        encoder = TorchEncoder("compile", torch.compile(_visual_module(model)))
+    elif backend == "int8":
+        encoder = TorchEncoder("int8", _quantize_int8(model))
+    else:
+        encoder = TorchEncoder("torchscript", _trace(_visual_module(model), n_px))
+    return encoder, preprocess, model
+
+
+def export_encoder(model_name="ViT-B/32", backend="onnx", device="cpu", encoders_dir=DEFAULT_ENCODERS_DIR):
+    """Exporta o encoder visual para o arquivo usado por load_image_encoder"""
+    if backend not in EXPORTABLE_BACKENDS:
+        raise ValueError(f"Backend sem exportação: {backend} (opções: {', '.join(EXPORTABLE_BACKENDS)})")
+
+    model, _ = _load_clip(model_name, device)
+    n_px = model.visual.input_resolution
+    os.makedirs(encoders_dir, exist_ok=True)
+    path = artifact_file(encoders_dir, model_name, backend)
+    tmp_path = f"{path}.tmp"
+
+    if backend == "onnx":
+        example = torch.randn(1, 3, n_px, n_px)
+        # Exportador TorchScript (dynamic_axes); o parâmetro dynamo só existe nas versões novas
+        extra = {'dynamo': False} if torch_version() >= ONNX_DYNAMO_ARG_TORCH else {}
+        torch.onnx.export(
+            _visual_module(model), example, tmp_path,
+            input_names=["pixel_values"], output_names=["image_embeds"],
+            dynamic_axes={'pixel_values': {0: "batch"}, 'image_embeds': {0: "batch"}},
+            opset_version=17, **extra,
+        )
+    elif backend == "int8":
+        torch.jit.save(_trace(_quantize_int8(model), n_px), tmp_path)
+    else:
+        torch.jit.save(_trace(_visual_module(model), n_px), tmp_path)
+
+    info = {'model': model_name, 'backend': backend, 'input_resolution': int(n_px),
+            'output_dim': int(model.visual.output_dim)}
+    with open(f"{path}.json.tmp", "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    os.replace(tmp_path, path)
+    os.replace(f"{path}.json.tmp", f"{path}.json")
+    return path
+
+
+def _embed(encoder, preprocess, images, batch_size=32):
+    embeddings = []
+    for start in range(0, len(images), batch_size):
+        batch = torch.stack([preprocess(img) for img in images[start:start + batch_size]])
+        emb = encoder.encode(batch)
+        emb /= emb.norm(dim=-1, keepdim=True)
+        embeddings.append(emb.cpu().numpy())
+    return np.concatenate(embeddings)
+
+
+def _catalog_images(embeddings_path, sample_images_path):
+    """Imagens do catálogo disponíveis localmente, com o índice do vetor salvo"""
+    from embedding_store import EmbeddingStore
+    store = EmbeddingStore.open(embeddings_path)
+    if store is not None:
+        paths, vectors = store.paths.tolist(), store.vectors
+    else:
+        paths = np.load(os.path.join(embeddings_path, "image_paths.npy"), allow_pickle=True).tolist()
+        vectors = np.load(os.path.join(embeddings_path, "embeddings.npy"), mmap_mode="r")
+
+    found = []
+    for i, p in enumerate(paths):
+        for candidate in (p, os.path.join(sample_images_path, os.path.basename(p))):
+            if os.path.exists(candidate):
+                found.append((i, candidate))
+                break
+    return found, vectors
+
+
+def check_encoder(backend, model_name="ViT-B/32", tolerance=0.99, embeddings_path="embeddings",
+                  sample_images_path="sample_images", encoders_dir=DEFAULT_ENCODERS_DIR):
+    """Compara o backend com o modelo eager fp32 nas imagens do catálogo disponíveis localmente"""
+    import time
+    from PIL import Image
+
+    found, catalog_vectors = _catalog_images(embeddings_path, sample_images_path)
+    if not found:
+        raise RuntimeError("Nenhuma imagem do catálogo encontrada localmente")
+    images = [Image.open(p).convert("RGB") for _, p in found]
+
+    reference_encoder, reference_preprocess, _ = load_image_encoder(model_name, "eager", encoders_dir=encoders_dir)
+    start = time.time()
+    reference = _embed(reference_encoder, reference_preprocess, images)
+    reference_time = time.time() - start
+
+    encoder, preprocess, _ = load_image_encoder(model_name, backend, encoders_dir=encoders_dir)
+    _embed(encoder, preprocess, images[:2])  # aquecimento (compile/onnx)
+    start = time.time()
+    candidate = _embed(encoder, preprocess, images)
+    candidate_time = time.time() - start
+
+    cosine = np.sum(reference * candidate, axis=1)
+    stored = np.asarray(catalog_vectors[[i for i, _ in found]], dtype="float32")
+    stored /= np.linalg.norm(stored, axis=1, keepdims=True)
+    cosine_stored = np.sum(stored * candidate, axis=1)
+
+    report = {
+        'backend': encoder.backend,
+        'images': len(images),
+        'min_cosine': float(cosine.min()),
+        'mean_cosine': float(cosine.mean()),
+        'mean_cosine_vs_catalog': float(cosine_stored.mean()),
+        'tolerance': tolerance,
+        'passed': bool(cosine.min() >= tolerance),
+        'reference_ms_per_image': reference_time * 1000 / len(images),
+        'backend_ms_per_image': candidate_time * 1000 / len(images),
+    }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta e valida backends do encoder de imagens")
+    parser.add_argument("command", choices=("export", "check"))
+    parser.add_argument("--backend", required=True, choices=BACKENDS)
+    parser.add_argument("--model", default="ViT-B/32")
+    parser.add_argument("--encoders-dir", default=DEFAULT_ENCODERS_DIR)
+    parser.add_argument("--embeddings", default="embeddings")
+    parser.add_argument("--sample-images", default="sample_images")
+    parser.add_argument("--tolerance", type=float, default=0.99, help="Cosseno mínimo contra o fp32")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "export":
+            path = export_encoder(args.model, args.backend, encoders_dir=args.encoders_dir)
+            print(f"✅ Encoder {args.backend} exportado para {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+            return 0
+
+        report = check_encoder(args.backend, args.model, args.tolerance, args.embeddings,
+                               args.sample_images, args.encoders_dir)
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return 1
+
+    print(json.dumps(report, indent=2))
+    if report['passed']:
+        print(f"✅ {report['backend']} dentro da tolerância (cosseno mínimo {report['min_cosine']:.5f})")
+        return 0
+    print(f"❌ {report['backend']} fora da tolerância (cosseno mínimo {report['min_cosine']:.5f} < {args.tolerance})")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
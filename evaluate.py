@@ -0,0 +1,333 @@
+# evaluate.py
+"""
+Avaliação offline de qualidade x velocidade da busca sobre o catálogo.
+
+Cada imagem do catálogo que tem outra imagem do mesmo produto (mesmo código
+NDC no nome do arquivo, ex.: as faces _0_0 e _0_1) vira uma consulta
+leave-one-out: o próprio vetor sai do resultado e as demais imagens do
+produto são as respostas certas. Para cada configuração são medidos
+recall@k, mAP, latência por consulta e memória do índice, e a tabela final
+marca as configurações na fronteira de Pareto (nenhuma outra é ao mesmo tempo
+mais precisa e mais rápida).
+
+Métrica sem rótulos ("exato@k"): cada vetor do catálogo (ou uma amostra de
+--exact-queries) é consultado e o resultado é comparado com os k vizinhos da
+busca exata (flat float32) sobre o catálogo original; exato@k é a fração dos
+k vizinhos exatos encontrada. Mede o quanto o índice (ou dtype/encoder)
+aproxima a busca exata, sem depender de rótulos. Com menos de
+MIN_LABELLED_QUERIES consultas rotuladas (o catálogo de exemplo tem poucas
+imagens por produto) o recall por rótulo anda em degraus grandes: a fronteira
+de Pareto e a recomendação passam a usar exato@k (--target).
+
+Configurações no formato backend[:chave=valor,...]:
+
+    flat
+    ivf_flat:nlist=64,nprobe=8
+    ivf_pq:pq_m=16,nprobe=16
+    hnsw:hnsw_m=32,ef_search=64
+    flat:dtype=float16              vetores arredondados como no store float16
+    flat:encoder=int8               recalcula o catálogo com outro encoder (imagens locais)
+
+    python evaluate.py --config flat --config hnsw:ef_search=32 --config ivf_flat:nprobe=4 --min-recall 0.9
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from benchmark import environment, summarize
+
+BUILD_KEYS = ("nlist", "pq_m", "pq_nbits", "hnsw_m")
+SEARCH_KEYS = ("nprobe", "ef_search")
+DEFAULT_KS = (1, 5, 10)
+MAP_DEPTH = 100
+# Abaixo disto o recall por rótulo é ruído demais para escolher uma configuração
+MIN_LABELLED_QUERIES = 100
+DEFAULT_EXACT_QUERIES = 1000
+# Latências p50 a menos de 5% da mais rápida contam como empate na recomendação
+LATENCY_TIE = 0.05
+TARGETS = {'labels': 'recall', 'exact': 'exact_recall'}
+
+
+def parse_config(text):
+    """'hnsw:hnsw_m=32,ef_search=64' -> dict com backend e parâmetros"""
+    backend, _, params = text.partition(":")
+    config = {'name': text, 'backend': backend or "flat", 'metric': "l2", 'dtype': "float32", 'encoder': None}
+    for item in filter(None, params.split(",")):
+        key, _, value = item.partition("=")
+        if key in BUILD_KEYS or key in SEARCH_KEYS:
+            config[key] = int(value)
+        elif key in ("metric", "dtype", "encoder"):
+            config[key] = value
+        else:
+            raise ValueError(f"Parâmetro desconhecido em {text}: {key}")
+    return config
+
+
+def load_catalog(embeddings_path):
+    """(vetores float32, caminhos) da versão ativa do catálogo"""
+    import snapshots
+    from embedding_store import EmbeddingStore
+    data_path = snapshots.version_path(embeddings_path, snapshots.current_version(embeddings_path))
+    store = EmbeddingStore.open(data_path)
+    if store is not None:
+        return np.asarray(store.vectors, dtype="float32"), store.paths.tolist()
+    vectors = np.load(os.path.join(data_path, "embeddings.npy")).astype("float32")
+    paths = [str(p) for p in np.load(os.path.join(data_path, "image_paths.npy"), allow_pickle=True)]
+    return vectors, paths
+
+
+def ground_truth(paths):
+    """Rótulo (código NDC) de cada imagem e as consultas que têm ao menos uma resposta certa"""
+    from zero_shot import product_code
+    labels = np.array([product_code(p) for p in paths])
+    _, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    queries = np.flatnonzero(counts[inverse] > 1)
+    return inverse, queries
+
+
+def exact_neighbors(vectors, rows, k):
+    """k vizinhos exatos (flat float32, sem a própria imagem) de cada linha em rows"""
+    import vector_index
+
+    index, meta = vector_index.build_index(np.ascontiguousarray(vectors, dtype="float32"), "flat", "l2")
+    k = min(k, len(vectors) - 1)
+    _, indices = vector_index.search_index(index, meta, vectors[rows], k + 1)
+    return np.array([found[found != i][:k] for i, found in zip(rows, indices)], dtype=np.int64).reshape(len(rows), k)
+
+
+def embed_catalog(paths, backend, model_name="ViT-B/32", sample_images_path="sample_images", batch_size=32):
+    """Recalcula os embeddings do catálogo com outro backend de encoder"""
+    import torch
+    from PIL import Image
+    from catalog import ResultCatalog
+    from encoders import load_image_encoder
+
+    catalog = ResultCatalog(paths, sample_images_path, refresh_interval=0)
+    sources = [catalog.entry(i)[0] for i in range(len(paths))]
+    missing = sum(1 for source in sources if not source)
+    if missing:
+        raise RuntimeError(f"{missing} imagens do catálogo não encontradas (encoder={backend} precisa dos arquivos)")
+
+    encoder, preprocess, _ = load_image_encoder(model_name, backend)
+    vectors = []
+    for start in range(0, len(sources), batch_size):
+        images = [Image.open(source).convert("RGB") for source in sources[start:start + batch_size]]
+        with torch.no_grad():
+            emb = encoder.encode(torch.stack([preprocess(img) for img in images]))
+            emb /= emb.norm(dim=-1, keepdim=True)
+        vectors.append(emb.cpu().numpy().astype("float32"))
+    return np.vstack(vectors)
+
+
+def average_precision(retrieved, relevant, total_relevant):
+    """AP dos primeiros MAP_DEPTH resultados, normalizado por min(relevantes, profundidade)"""
+    hits = np.isin(retrieved, relevant)
+    if not hits.any():
+        return 0.0
+    precision_at_hit = np.cumsum(hits)[hits] / (np.flatnonzero(hits) + 1)
+    return float(precision_at_hit.sum() / min(total_relevant, len(retrieved)))
+
+
+def evaluate_config(config, vectors, labels, queries, ks=DEFAULT_KS, depth=MAP_DEPTH, exact=None, exact_rows=()):
+    """Métricas de uma configuração: constrói o índice e faz as consultas uma a uma.
+
+    queries: consultas rotuladas (recall e mAP); exact_rows e exact: consultas e
+    vizinhos da busca exata de referência (exato@k).
+    """
+    import faiss
+    import vector_index
+
+    vectors = vectors.astype(config['dtype']).astype("float32")
+    build_config = {key: config[key] for key in BUILD_KEYS if key in config}
+    start = time.perf_counter()
+    index, meta = vector_index.build_index(vectors, config['backend'], config['metric'], **build_config)
+    build_seconds = time.perf_counter() - start
+    index_bytes = int(faiss.serialize_index(index).nbytes)
+
+    depth = min(depth, len(vectors) - 1)
+    k_search = depth + 1
+    labelled = set(int(i) for i in queries)
+    exact_position = {int(i): j for j, i in enumerate(exact_rows)}
+    recalls = {k: 0 for k in ks}
+    overlaps = {k: 0.0 for k in ks}
+    average_precisions = []
+    latencies = []
+    for i in np.union1d(np.asarray(queries, dtype=np.int64), np.asarray(exact_rows, dtype=np.int64)):
+        query = vectors[i:i + 1]
+        start = time.perf_counter()
+        _, indices = vector_index.search_index(index, meta, query, k_search,
+                                               nprobe=config.get('nprobe'), ef_search=config.get('ef_search'))
+        latencies.append(time.perf_counter() - start)
+
+        # Leave-one-out: a própria imagem não conta
+        retrieved = indices[0][(indices[0] != i) & (indices[0] >= 0)][:depth]
+        if i in labelled:
+            relevant = np.flatnonzero(labels == labels[i])
+            relevant = relevant[relevant != i]
+            for k in ks:
+                recalls[k] += bool(np.isin(retrieved[:k], relevant).any())
+            average_precisions.append(average_precision(retrieved, relevant, len(relevant)))
+        if i in exact_position:
+            reference = exact[exact_position[i]]
+            for k in ks:
+                overlaps[k] += len(np.intersect1d(retrieved[:k], reference[:k])) / max(1, min(k, len(reference)))
+
+    n, n_exact = len(labelled), len(exact_position)
+    return {
+        'config': config['name'],
+        'factory': meta['factory'],
+        'queries': n,
+        'exact_queries': n_exact,
+        'recall': {f"@{k}": round(recalls[k] / n, 4) if n else None for k in ks},
+        'map': round(float(np.mean(average_precisions)), 4) if n else None,
+        'exact_recall': {f"@{k}": round(overlaps[k] / n_exact, 4) if n_exact else None for k in ks},
+        'latency': summarize(latencies),
+        'build_seconds': round(build_seconds, 3),
+        'index_bytes': index_bytes,
+        'bytes_per_vector': round(index_bytes / len(vectors), 1),
+        'store_bytes': int(vectors.shape[0] * vectors.shape[1] * np.dtype(config['dtype']).itemsize),
+    }
+
+
+def pareto(results, k, metric="recall"):
+    """Marca as configurações que nenhuma outra supera em metric@k e latência p50 ao mesmo tempo.
+
+    Diferenças de latência menores que LATENCY_TIE são tratadas como empate (ruído da medição).
+    """
+    key = f"@{k}"
+    for result in results:
+        recall, latency = result[metric][key], result['latency']['p50_ms']
+        result['pareto'] = not any(
+            other[metric][key] >= recall and other['latency']['p50_ms'] <= latency * (1 + LATENCY_TIE)
+            and (other[metric][key] > recall or other['latency']['p50_ms'] < latency * (1 - LATENCY_TIE))
+            for other in results
+        )
+    return results
+
+
+def recommend(results, k, min_recall, metric="recall"):
+    """Mais rápida com metric@k >= min_recall.
+
+    Latências a menos de LATENCY_TIE da mais rápida empatam: vence a de maior
+    qualidade e, persistindo o empate, a que veio antes em --config.
+    """
+    key = f"@{k}"
+    accepted = [r for r in results if r[metric][key] >= min_recall]
+    if not accepted:
+        return None
+    fastest = min(r['latency']['p50_ms'] for r in accepted)
+    tied = [r for r in accepted if r['latency']['p50_ms'] <= fastest * (1 + LATENCY_TIE)]
+    best = max(r[metric][key] for r in tied)
+    return next(r for r in tied if r[metric][key] == best)
+
+
+def _cell(value):
+    return "-" if value is None else f"{value:.4f}"
+
+
+def print_table(results, ks, pareto_k, metric="recall"):
+    columns = ([f"recall@{k}" for k in ks] + ["mAP"] + [f"exato@{k}" for k in ks]
+               + ["p50 ms", "p95 ms", "índice MB", "pareto"])
+    width = max(len(result['config']) for result in results) + 2
+    print(f"{'configuração':{width}s}" + "".join(f"{column:>11s}" for column in columns))
+    for result in sorted(results, key=lambda r: r['latency']['p50_ms']):
+        values = [_cell(result['recall'][f'@{k}']) for k in ks] + [_cell(result['map'])]
+        values += [_cell(result['exact_recall'][f'@{k}']) for k in ks]
+        values += [f"{result['latency']['p50_ms']:.3f}", f"{result['latency']['p95_ms']:.3f}",
+                   f"{result['index_bytes'] / 1024 / 1024:.2f}", "*" if result['pareto'] else ""]
+        print(f"{result['config']:{width}s}" + "".join(f"{value:>11s}" for value in values))
+    label = "recall" if metric == "recall" else "exato"
+    print(f"(* fronteira de Pareto em {label}@{pareto_k} x latência p50)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Avaliação de recall/mAP x latência do índice de busca")
+    parser.add_argument("--embeddings", default="embeddings")
+    parser.add_argument("--config", action="append", help="backend[:chave=valor,...] (repetível)")
+    parser.add_argument("--k", type=int, nargs="+", default=list(DEFAULT_KS), help="Valores de k do recall")
+    parser.add_argument("--queries", type=int, help="Amostra de consultas rotuladas (padrão: todas)")
+    parser.add_argument("--exact-queries", type=int, default=DEFAULT_EXACT_QUERIES,
+                        help="Consultas da métrica sem rótulos exato@k (0 desliga)")
+    parser.add_argument("--target", choices=("auto", "labels", "exact"), default="auto",
+                        help="Métrica da fronteira de Pareto e da recomendação (auto: labels com "
+                             f"{MIN_LABELLED_QUERIES}+ consultas rotuladas, senão exact)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-recall", type=float,
+                        help="Recomenda a configuração mais rápida com recall@k (ou exato@k) acima disto")
+    parser.add_argument("--model", default="ViT-B/32")
+    parser.add_argument("--sample-images", default="sample_images")
+    parser.add_argument("--output", help="Arquivo JSON com os resultados")
+    args = parser.parse_args(argv)
+
+    try:
+        configs = [parse_config(text) for text in (args.config or ["flat"])]
+        vectors, paths = load_catalog(args.embeddings)
+        labels, queries = ground_truth(paths)
+        if args.queries and args.queries < len(queries):
+            queries = np.sort(np.random.RandomState(args.seed).choice(queries, args.queries, replace=False))
+        exact_rows = np.arange(len(paths))
+        if args.exact_queries < len(exact_rows):
+            exact_rows = np.sort(np.random.RandomState(args.seed).choice(exact_rows, max(0, args.exact_queries),
+                                                                         replace=False))
+        target = args.target
+        if target == "auto":
+            target = "labels" if len(queries) >= MIN_LABELLED_QUERIES else "exact"
+        if target == "labels" and not len(queries):
+            raise RuntimeError("Nenhuma imagem do catálogo tem outra imagem do mesmo produto")
+        if target == "exact" and not len(exact_rows):
+            raise RuntimeError("--target exact precisa de --exact-queries > 0")
+        metric = TARGETS[target]
+
+        print(f"📊 {len(paths)} imagens, {len(queries)} consultas leave-one-out, "
+              f"{len(exact_rows)} consultas contra a busca exata")
+        if len(queries) < MIN_LABELLED_QUERIES:
+            print(f"⚠️ Só {len(queries)} consultas rotuladas: recall@k anda em degraus de "
+                  f"{1 / max(1, len(queries)):.2f} e não serve para comparar configurações"
+                  + (" (fronteira e recomendação por exato@k)" if target == "exact" else ""))
+        exact = exact_neighbors(vectors, exact_rows, max(args.k)) if len(exact_rows) else None
+
+        encoded = {}
+        results = []
+        for config in configs:
+            catalog_vectors = vectors
+            if config['encoder']:
+                if config['encoder'] not in encoded:
+                    encoded[config['encoder']] = embed_catalog(paths, config['encoder'], args.model,
+                                                               args.sample_images)
+                catalog_vectors = encoded[config['encoder']]
+            results.append(evaluate_config(config, catalog_vectors, labels, queries, tuple(args.k),
+                                           exact=exact, exact_rows=exact_rows))
+            print(f"   {config['name']}: recall@{args.k[0]} {results[-1]['recall'][f'@{args.k[0]}']}, "
+                  f"exato@{args.k[0]} {results[-1]['exact_recall'][f'@{args.k[0]}']}, "
+                  f"p50 {results[-1]['latency']['p50_ms']} ms")
+    except Exception as e:
+        print(f"❌ Erro na avaliação: {e}")
+        return 1
+
+    pareto_k = args.k[-1]
+    label = "recall" if metric == "recall" else "exato"
+    pareto(results, pareto_k, metric)
+    print_table(results, args.k, pareto_k, metric)
+
+    if args.min_recall is not None:
+        best = recommend(results, pareto_k, args.min_recall, metric)
+        if best is not None:
+            print(f"✅ Mais rápida com {label}@{pareto_k} >= {args.min_recall}: {best['config']}")
+        else:
+            print(f"⚠️ Nenhuma configuração atinge {label}@{pareto_k} >= {args.min_recall}")
+
+    if args.output:
+        report = {'catalog_images': len(paths), 'queries': int(len(queries)), 'exact_queries': int(len(exact_rows)),
+                  'target': target, 'environment': environment(), 'results': results}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Resultados salvos em {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
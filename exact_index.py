@@ -0,0 +1,146 @@
+# exact_index.py
+"""
+Busca exata em NumPy para quando o FAISS não está instalado.
+
+Mesmo resultado de um IndexFlatL2 sobre os mesmos vetores:
+
+  - o catálogo é percorrido em blocos de EXACT_SEARCH_BLOCK linhas; em cada
+    bloco as distâncias saem de um matmul (||q||² + ||x||² - 2 q·x) e
+    argpartition separa os melhores candidatos do bloco;
+  - os candidatos de todos os blocos têm a distância refeita diretamente
+    (soma de (q - x)²) e são ordenados por (distância, id), então erros de
+    arredondamento do matmul não trocam a ordem final;
+  - os blocos rodam em EXACT_SEARCH_THREADS threads (o matmul do NumPy
+    libera o GIL).
+
+Com EXACT_SEARCH_DTYPE=float16 os vetores ficam em memória como float16
+(metade da RAM) e cada bloco é convertido para float32 só durante o matmul.
+As distâncias devolvidas são L2 ao quadrado, como as de vector_index.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Candidatos extras por bloco: folga para empates quase exatos no matmul
+RERANK_MARGIN = 8
+
+# Pool único do processo, compartilhado pelas versões do catálogo carregadas
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _thread_pool(threads):
+    # Criado na primeira busca (e recriado após um fork do gunicorn)
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="exact-search")
+            _pool_pid = os.getpid()
+    return _pool
+
+
+class ExactIndex:
+    def __init__(self, vectors, metric="l2", dtype=None, block_size=8192, threads=None):
+        if metric not in ("l2", "ip"):
+            raise ValueError(f"Métrica desconhecida: {metric}")
+        dtype = np.dtype(dtype or vectors.dtype)
+        if dtype not in (np.float16, np.float32):
+            raise ValueError(f"dtype não suportado: {dtype} (float16 ou float32)")
+        self.metric = metric
+        if metric == "ip":
+            # Vetores normalizados: ||a - b||² = 2 - 2·<a, b>, igual ao vector_index
+            vectors = np.asarray(vectors, dtype=np.float32)
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        if vectors.dtype != dtype:
+            vectors = np.asarray(vectors, dtype=dtype)
+        # Store em mmap com o mesmo dtype é usado direto (compartilhado pelo page cache)
+        self.vectors = vectors
+        self.block_size = max(1, int(block_size))
+        self.threads = max(1, int(threads or os.cpu_count() or 1))
+        self.norms = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), self.block_size):
+            block = self._block(start)
+            self.norms[start:start + len(block)] = np.einsum("ij,ij->i", block, block)
+
+    @classmethod
+    def from_env(cls, vectors, metric="l2"):
+        """EXACT_SEARCH_DTYPE (float16|float32, padrão: o dos vetores), EXACT_SEARCH_BLOCK, EXACT_SEARCH_THREADS"""
+        return cls(
+            vectors, metric,
+            dtype=os.environ.get('EXACT_SEARCH_DTYPE') or None,
+            block_size=int(os.environ.get('EXACT_SEARCH_BLOCK', 8192)),
+            threads=int(os.environ.get('EXACT_SEARCH_THREADS', 0)) or None,
+        )
+
+    @property
+    def ntotal(self):
+        return len(self.vectors)
+
+    @property
+    def d(self):
+        return self.vectors.shape[1]
+
+    def _block(self, start):
+        return np.asarray(self.vectors[start:start + self.block_size], dtype=np.float32)
+
+    def _search_block(self, queries, query_norms, start, k):
+        """Melhores candidatos de um bloco (ids globais), pela distância do matmul"""
+        block = self._block(start)
+        distances = query_norms[:, None] + self.norms[None, start:start + len(block)]
+        distances -= 2.0 * (queries @ block.T)
+        if len(block) > k:
+            ids = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            ids = np.broadcast_to(np.arange(len(block)), distances.shape)
+        return ids + start
+
+    def search(self, queries, k):
+        """(distâncias L2², ids) dos k vizinhos de cada consulta, como index.search do FAISS"""
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.d)
+        if self.metric == "ip":
+            queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        nq, n = len(queries), self.ntotal
+        k_out = int(k)
+        k = min(k_out, n)
+        # Sem vizinho suficiente: -1 e a maior distância float32, como o FAISS
+        distances = np.full((nq, k_out), np.finfo(np.float32).max, dtype=np.float32)
+        indices = np.full((nq, k_out), -1, dtype=np.int64)
+        if k <= 0 or nq == 0:
+            return distances, indices
+
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        starts = range(0, n, self.block_size)
+        k_block = k + RERANK_MARGIN
+        if self.threads > 1 and len(starts) > 1:
+            parts = list(_thread_pool(self.threads).map(
+                lambda start: self._search_block(queries, query_norms, start, k_block), starts
+            ))
+        else:
+            parts = [self._search_block(queries, query_norms, start, k_block) for start in starts]
+        candidates = np.hstack(parts)
+
+        # Distância exata de cada candidato, ordenada por (distância, id) como o IndexFlatL2
+        exact = np.empty(candidates.shape, dtype=np.float32)
+        for row in range(nq):
+            diff = np.asarray(self.vectors[candidates[row]], dtype=np.float32) - queries[row]
+            exact[row] = np.einsum("ij,ij->i", diff, diff)
+        order = np.lexsort((candidates, exact), axis=1)[:, :k]
+        distances[:, :k] = np.take_along_axis(exact, order, axis=1)
+        indices[:, :k] = np.take_along_axis(candidates, order, axis=1)
+        return distances, indices
+
+    def stats(self):
+        return {
+            'backend': 'numpy_exact',
+            'metric': self.metric,
+            'dtype': str(self.vectors.dtype),
+            'ntotal': self.ntotal,
+            'block_size': self.block_size,
+            'threads': self.threads,
+            'memory_bytes': int(self.vectors.nbytes + self.norms.nbytes),
+        }
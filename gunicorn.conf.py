@@ -0,0 +1,48 @@
+# gunicorn.conf.py
+"""
+Configuração do gunicorn: o modelo CLIP e o índice são carregados uma única
+vez no master (preload_app) e os workers herdam tudo via fork, compartilhando
+a memória copy-on-write. O aquecimento roda em background em cada worker;
+o /ready só responde 200 depois dele.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = 120
+preload_app = True
+
+
+def when_ready(server):
+    # Objetos criados no preload não serão mais visitados pelo GC, o que evita
+    # que a coleta toque (e copie) as páginas herdadas pelos workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Nenhuma inferência roda no master: threads do PyTorch/OpenMP criadas antes
+    # do fork podem travar nos filhos. O aquecimento acontece já no worker.
+    import app
+    app.init_worker()
+
+
+def worker_exit(server, worker):
+    # Grava o histórico que ainda estiver na fila antes do worker sair
+    import app
+    app.shutdown_worker()
+
+
+def child_exit(server, worker):
+    # Soma as métricas do worker que saiu no arquivo morto (totais monotônicos)
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    # O diretório padrão das métricas é por execução do master: remover ao sair
+    import shutil
+    import metrics
+    if not os.environ.get('METRICS_DIR'):
+        shutil.rmtree(metrics.METRICS_DIR, ignore_errors=True)
@@ -0,0 +1,253 @@
+# history_writer.py
+"""
+Gravação write-behind do histórico (uploads e resultados de busca).
+
+As rotas só enfileiram um registro; uma thread em background grava os
+registros em lotes, um único commit por lote. O arquivo enviado também é
+gravado pela thread, fora da requisição; os bytes na fila são limitados por
+PERSIST_QUEUE_MAX_MB, além do número de registros (PERSIST_QUEUE_SIZE). A fila é limitada: quando está
+cheia a requisição espera um pouco (backpressure) e, se ainda assim não houver
+espaço, o registro é descartado (sem gravar o arquivo) e contado em stats(). Ao encerrar o processo
+(atexit ou worker_exit do gunicorn) a fila é esvaziada antes de sair.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+import metrics
+
+_STOP = object()
+
+
+class HistoryWriter:
+    def __init__(self, app, max_queue=1000, batch_size=100, flush_interval=0.5, put_timeout=2.0,
+                 upload_folder="uploads", max_queue_mb=64):
+        self.app = app
+        self.max_queue = max(1, int(max_queue))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_interval))
+        self.put_timeout = put_timeout
+        self.upload_folder = upload_folder
+        self._queue = queue.Queue(self.max_queue)
+        # Bytes de arquivos enfileirados e ainda não gravados
+        self.max_queue_bytes = max(1, int(max_queue_mb * 1024 * 1024))
+        self._queued_bytes = 0
+        self._bytes_cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    @classmethod
+    def from_env(cls, app, upload_folder="uploads"):
+        return cls(
+            app,
+            max_queue=int(os.environ.get('PERSIST_QUEUE_SIZE', 1000)),
+            batch_size=int(os.environ.get('PERSIST_BATCH_SIZE', 100)),
+            flush_interval=float(os.environ.get('PERSIST_FLUSH_MS', 500)) / 1000.0,
+            put_timeout=float(os.environ.get('PERSIST_PUT_TIMEOUT', 2.0)),
+            upload_folder=upload_folder,
+            max_queue_mb=float(os.environ.get('PERSIST_QUEUE_MAX_MB', 64)),
+        )
+
+    def _ensure_started(self):
+        # A thread é criada no primeiro uso (e recriada após um fork do gunicorn)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue(self.max_queue)
+                self._queued_bytes = 0
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name="history-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _drop(self, reason):
+        self.dropped += 1
+        metrics.inc('app_history_dropped_total')
+        print(f"⚠️ {reason}: registro descartado")
+        return False
+
+    def _reserve(self, size):
+        """Espera (até put_timeout) espaço para size bytes de arquivo na fila"""
+        deadline = time.monotonic() + self.put_timeout
+        with self._bytes_cond:
+            # Um arquivo maior que o limite inteiro passa sozinho, com a fila vazia
+            while self._queued_bytes and self._queued_bytes + size > self.max_queue_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._bytes_cond.wait(remaining)
+            self._queued_bytes += size
+            return True
+
+    def _release(self, size):
+        if not size:
+            return
+        with self._bytes_cond:
+            self._queued_bytes = max(0, self._queued_bytes - size)
+            self._bytes_cond.notify_all()
+
+    def _put(self, record):
+        self._ensure_started()
+        try:
+            self._queue.put(record, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            return self._drop(f"Fila do histórico cheia ({self.max_queue})")
+
+    def record_upload(self, filename, original_filename, file_size, results=(), data=None):
+        """Enfileira um upload (opcionalmente com o arquivo a gravar e os resultados da busca)"""
+        size = len(data) if data is not None else 0
+        self._ensure_started()
+        if size and not self._reserve(size):
+            return self._drop(f"Fila do histórico com {self.max_queue_bytes / 1024 / 1024:.0f} MB em arquivos")
+        queued = self._put({
+            'filename': filename,
+            'original_filename': original_filename,
+            'file_size': file_size,
+            'results': [(r['original_path'], r['distance']) for r in results],
+            'data': data,
+            'reserved': size,
+        })
+        if not queued and size:
+            self._release(size)
+        return queued
+
+    def record_results(self, filename, results):
+        """Enfileira os resultados de uma busca sobre um upload já existente"""
+        return self._put({
+            'filename': filename,
+            'results': [(r['original_path'], r['distance']) for r in results],
+        })
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            stop = batch[-1] is _STOP
+            records = [record for record in batch if record is not _STOP]
+            if records:
+                self._write_batch(records)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _apply(self, record, uploads):
+        from database import db, UploadedImage, SearchResult
+
+        if record.get('data') is not None:
+            try:
+                with open(os.path.join(self.upload_folder, record['filename']), 'wb') as f:
+                    f.write(record['data'])
+                # Já gravado: a nova tentativa registro a registro não regrava
+                record['data'] = None
+            finally:
+                self._release(record.pop('reserved', 0))
+
+        filename = record['filename']
+        uploaded_image = uploads.get(filename)
+        if uploaded_image is None:
+            uploaded_image = UploadedImage.query.filter_by(filename=filename).first()
+        if uploaded_image is None:
+            # A busca pode chegar antes do registro do upload (outro worker ainda na fila)
+            original_filename = record.get('original_filename') or filename.split('_', 1)[-1]
+            file_size = record.get('file_size')
+            if file_size is None:
+                path = os.path.join(self.upload_folder, filename)
+                file_size = os.path.getsize(path) if os.path.exists(path) else None
+            uploaded_image = UploadedImage(filename=filename, original_filename=original_filename,
+                                           file_size=file_size)
+            db.session.add(uploaded_image)
+            db.session.flush()
+        uploads[filename] = uploaded_image
+
+        for similar_image_path, distance in record['results']:
+            db.session.add(SearchResult(
+                uploaded_image_id=uploaded_image.id,
+                similar_image_path=similar_image_path,
+                similarity_score=distance
+            ))
+
+    def _write_batch(self, records):
+        from database import db
+
+        with self.app.app_context():
+            try:
+                uploads = {}
+                with metrics.timer('app_stage_seconds', stage="db_commit"):
+                    for record in records:
+                        self._apply(record, uploads)
+                    db.session.commit()
+                self.written += len(records)
+                self.batches += 1
+                return
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Erro ao gravar lote do histórico ({len(records)} registros), gravando um a um: {e}")
+
+            # Isola o registro problemático sem perder o resto do lote
+            for record in records:
+                try:
+                    self._apply(record, {})
+                    db.session.commit()
+                    self.written += 1
+                except Exception as e:
+                    db.session.rollback()
+                    self.failed += 1
+                    print(f"❌ Erro ao gravar histórico de {record['filename']}: {e}")
+
+    def flush(self, timeout=None):
+        """Espera a fila atual ser gravada"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+
+    def close(self, timeout=30.0):
+        """Grava o que restou na fila e para a thread (idempotente)"""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            thread = self._thread
+            self._thread = None
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'max_queue': self.max_queue,
+            'queued_mb': round(self._queued_bytes / 1024 / 1024, 1),
+            'max_queue_mb': round(self.max_queue_bytes / 1024 / 1024, 1),
+            'batch_size': self.batch_size,
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
@@ -0,0 +1,215 @@
+# knn_graph.py
+"""
+Grafo dos k vizinhos mais próximos de cada imagem do catálogo.
+
+Calculado uma vez, em blocos de linhas (um matmul por bloco contra o catálogo
+inteiro + argpartition), e gravado junto do índice:
+
+    knn_ids.npy     int32   (n, K)  ids dos vizinhos, do mais próximo ao mais distante
+    knn_dist.npy    float16 (n, K)  distância L2 ao quadrado (a mesma do IndexFlatL2)
+    knn.json        K, n e a assinatura do store de onde o grafo saiu
+
+O /similar/<id> lê uma linha do grafo, sem CLIP e sem busca no índice.
+Quando imagens entram no catálogo, só as linhas novas são calculadas e as
+antigas recebem as novas como candidatas; na remoção, só as linhas que
+apontavam para imagens removidas são recalculadas.
+
+    python knn_graph.py embeddings --k 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+IDS_FILE = "knn_ids.npy"
+DISTANCES_FILE = "knn_dist.npy"
+META_FILE = "knn.json"
+# Elementos da matriz de distâncias de um bloco (~128 MB em float32)
+BLOCK_ELEMENTS = 32 * 1024 * 1024
+
+
+def _signature(data_path):
+    # Mesma ideia do índice: store.json (ou embeddings.npy) identifica a versão dos vetores
+    for name in ("store.json", "embeddings.npy"):
+        path = os.path.join(data_path, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            return {'file': name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return None
+
+
+def _top_k(distances, ids, k):
+    """Os k menores de cada linha, ordenados por (distância, id)"""
+    if distances.shape[1] > k:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        distances = np.take_along_axis(distances, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    order = np.lexsort((ids, distances), axis=1)
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+def _distances(query, vectors, norms):
+    """Distâncias L2 ao quadrado (len(query), len(vectors)) por um único matmul"""
+    # ||q - x||² = ||q||² + ||x||² - 2 q·x
+    distances = norms[None, :] - 2.0 * (query @ vectors.T)
+    distances += np.einsum("ij,ij->i", query, query)[:, None]
+    return np.maximum(distances, 0, out=distances)
+
+
+def _blocks(rows, columns, block_elements=BLOCK_ELEMENTS):
+    """Fatias de rows com no máximo block_elements distâncias cada"""
+    block = max(1, block_elements // max(columns, 1))
+    for start in range(0, rows, block):
+        yield slice(start, min(start + block, rows))
+
+
+def neighbors_of(row_ids, vectors, k):
+    """Top-k exato (sem a própria linha) de cada linha em row_ids contra todos os vectors"""
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    all_ids = np.arange(len(vectors), dtype=np.int64)
+    out_distances = np.empty((len(row_ids), k), dtype=np.float32)
+    out_ids = np.empty((len(row_ids), k), dtype=np.int64)
+    for rows in _blocks(len(row_ids), len(vectors)):
+        query_ids = row_ids[rows]
+        distances = _distances(vectors[query_ids], vectors, norms)
+        distances[np.arange(len(query_ids)), query_ids] = np.inf
+        ids = np.broadcast_to(all_ids, distances.shape)
+        out_distances[rows], out_ids[rows] = _top_k(distances, ids, k)
+    return out_distances, out_ids
+
+
+class KnnGraph:
+    def __init__(self, ids, distances):
+        self.ids = ids
+        self.distances = distances
+
+    @property
+    def k(self):
+        return self.ids.shape[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def neighbors(self, idx, k=None):
+        """(distâncias, ids) dos vizinhos de idx"""
+        k = self.k if k is None else max(0, min(k, self.k))
+        return self.distances[idx, :k].astype("float32"), self.ids[idx, :k]
+
+    @classmethod
+    def build(cls, vectors, k=20):
+        """Grafo completo: cada vetor contra todos, em blocos de linhas"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        k = max(0, min(k, len(vectors) - 1))
+        distances, ids = neighbors_of(np.arange(len(vectors)), vectors, k)
+        return cls(ids.astype(np.int32), distances.astype(np.float16))
+
+    def extend(self, vectors, k=None):
+        """Grafo para vectors = vetores atuais + novos no fim.
+
+        As linhas novas são calculadas contra todos; as antigas só comparam
+        com os vetores novos e fundem o resultado com a lista que já tinham.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n, total = len(self), len(vectors)
+        k = max(0, min(self.k if k is None else k, total - 1))
+        if n == 0 or self.k < min(k, n - 1):
+            # Lista antiga curta demais (catálogo era menor que k): refaz tudo
+            return KnnGraph.build(vectors, k)
+        new_distances, new_ids = neighbors_of(np.arange(n, total), vectors, k)
+
+        added = vectors[n:]
+        added_norms = np.einsum("ij,ij->i", added, added)
+        added_ids = np.arange(n, total, dtype=np.int64)
+        old_distances = np.empty((n, k), dtype=np.float32)
+        old_ids = np.empty((n, k), dtype=np.int64)
+        for rows in _blocks(n, total - n + self.k * vectors.shape[1]):
+            current_ids = np.asarray(self.ids[rows], dtype=np.int64)
+            # Distâncias atuais refeitas em float32 (as gravadas são float16) para não
+            # trocar a ordem de vizinhos quase empatados com os novos
+            current = vectors[current_ids] - vectors[rows][:, None, :]
+            distances = np.hstack([np.einsum("ijk,ijk->ij", current, current),
+                                   _distances(vectors[rows], added, added_norms)])
+            ids = np.hstack([current_ids, np.broadcast_to(added_ids, (rows.stop - rows.start, total - n))])
+            old_distances[rows], old_ids[rows] = _top_k(distances, ids, k)
+
+        return KnnGraph(np.vstack([old_ids, new_ids]).astype(np.int32),
+                        np.vstack([old_distances, new_distances]).astype(np.float16))
+
+    def remove(self, vectors, removed):
+        """Grafo sem as linhas removed; vectors são os vetores que ficaram, na ordem.
+
+        Só as linhas cuja lista tinha uma imagem removida são recalculadas;
+        nas outras os ids são apenas renumerados.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(removed, dtype=np.int64)] = False
+        k = max(0, min(self.k, len(vectors) - 1))
+        # id antigo -> id novo (-1 para removidos)
+        remap = np.where(keep, np.cumsum(keep) - 1, -1)
+
+        ids = remap[np.asarray(self.ids[keep], dtype=np.int64)]
+        distances = np.asarray(self.distances[keep], dtype=np.float32)
+        stale = np.flatnonzero((ids < 0).any(axis=1)) if ids.size else np.zeros(0, dtype=np.int64)
+        ids, distances = ids[:, :k], distances[:, :k]
+        if len(stale):
+            distances[stale], ids[stale] = neighbors_of(stale, vectors, k)
+        return KnnGraph(ids.astype(np.int32), distances.astype(np.float16))
+
+    def save(self, data_path):
+        meta_file = os.path.join(data_path, META_FILE)
+        for name, array in ((IDS_FILE, self.ids), (DISTANCES_FILE, self.distances)):
+            path = os.path.join(data_path, name)
+            with open(f"{path}.tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(f"{path}.tmp", path)
+        with open(f"{meta_file}.tmp", "w", encoding="utf-8") as f:
+            json.dump({'k': self.k, 'count': len(self), 'embeddings': _signature(data_path)}, f, indent=2)
+        os.replace(f"{meta_file}.tmp", meta_file)
+
+    @classmethod
+    def load(cls, data_path, count=None):
+        """Grafo gravado para estes vetores (mmap), ou None se não existe ou está desatualizado"""
+        try:
+            with open(os.path.join(data_path, META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('embeddings') != _signature(data_path) or (count is not None and meta.get('count') != count):
+            return None
+        return cls(np.load(os.path.join(data_path, IDS_FILE), mmap_mode="r"),
+                   np.load(os.path.join(data_path, DISTANCES_FILE), mmap_mode="r"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calcula o grafo de vizinhos do catálogo")
+    parser.add_argument("embeddings_path", nargs="?", default="embeddings")
+    parser.add_argument("--k", type=int, default=int(os.environ.get('KNN_GRAPH_K', 20)))
+    args = parser.parse_args(argv)
+
+    try:
+        import snapshots
+        from embedding_store import EmbeddingStore
+
+        data_path = snapshots.version_path(args.embeddings_path, snapshots.current_version(args.embeddings_path))
+        store = EmbeddingStore.open(data_path)
+        if store is not None:
+            vectors = store.vectors
+        else:
+            vectors = np.load(os.path.join(data_path, "embeddings.npy"), mmap_mode="r")
+        start = time.perf_counter()
+        graph = KnnGraph.build(vectors, args.k)
+        graph.save(data_path)
+    except Exception as e:
+        print(f"❌ Erro ao calcular o grafo de vizinhos: {e}")
+        return 1
+    print(f"✅ Grafo {len(graph)} x {graph.k} em {time.perf_counter() - start:.1f}s "
+          f"({(graph.ids.nbytes + graph.distances.nbytes) / 1024 / 1024:.1f} MB em {data_path})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+# metrics.py
+"""
+Métricas no formato texto do Prometheus (/metrics), agregadas entre os
+workers do gunicorn.
+
+Cada processo acumula contadores, histogramas e gauges em memória e grava um
+snapshot em METRICS_DIR/metrics_<pid>.json (a cada METRICS_FLUSH_SECONDS e a
+cada scrape). O /metrics soma os arquivos de todos os processos; quando um
+worker sai (child_exit do gunicorn) os contadores e histogramas dele são
+somados em metrics_archive.json, então os totais continuam monotônicos.
+Gauges são por processo e saem com o rótulo pid.
+"""
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# nome: (tipo, descrição)
+METRICS = {
+    'app_request_seconds': ('histogram', "Latência das requisições por rota"),
+    'app_requests_total': ('counter', "Requisições por rota e status"),
+    'app_stage_seconds': ('histogram', "Latência de cada etapa da consulta"),
+    'app_query_cache_total': ('counter', "Consultas ao cache de embeddings (hit/miss)"),
+    'app_dummy_results_total': ('counter', "Buscas que caíram nos resultados dummy"),
+    'app_perceptual_total': ('counter', "Consultas ao pré-filtro de hash perceptual (catalog/recent/miss)"),
+    'app_history_dropped_total': ('counter', "Registros do histórico descartados com a fila cheia"),
+    'app_queue_depth': ('gauge', "Itens aguardando nas filas em background"),
+    'app_index_vectors': ('gauge', "Vetores no índice carregado"),
+    'app_process_resident_memory_bytes': ('gauge', "Memória residente do processo"),
+}
+
+# O diretório é decidido no import (no master, com preload_app) e herdado pelos workers
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), f"app-metrics-{os.getpid()}")
+ARCHIVE_FILE = "metrics_archive.json"
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_gauges = {}
+_flusher = None
+_flusher_pid = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1.0, **labels):
+    _ensure_flusher()
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + amount
+
+
+def observe(name, value, **labels):
+    _ensure_flusher()
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+        buckets, _, _ = histogram
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def register_gauge(name, fn, **labels):
+    """Gauge lido na hora do snapshot (fn sem argumentos retorna o valor)"""
+    with _lock:
+        _gauges[_key(name, labels)] = fn
+
+
+def resident_memory_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+register_gauge('app_process_resident_memory_bytes', resident_memory_bytes)
+
+
+def snapshot():
+    """Estado deste processo (serializável em JSON)"""
+    with _lock:
+        counters = [[name, list(labels), value] for (name, labels), value in _counters.items()]
+        histograms = [[name, list(labels), list(h[0]), h[1], h[2]] for (name, labels), h in _histograms.items()]
+        gauge_fns = list(_gauges.items())
+    gauges = []
+    for (name, labels), fn in gauge_fns:
+        try:
+            value = fn()
+        except Exception:
+            continue
+        if value is not None:
+            gauges.append([name, list(labels), float(value)])
+    return {'pid': os.getpid(), 'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def flush():
+    """Grava o snapshot deste processo em METRICS_DIR"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_json(os.path.join(METRICS_DIR, f"metrics_{os.getpid()}.json"), snapshot())
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"⚠️ Erro ao gravar métricas: {e}")
+
+
+def _ensure_flusher():
+    # Criada no primeiro uso para sobreviver ao fork dos workers do gunicorn
+    global _flusher, _flusher_pid
+    if _flusher is not None and _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher is None or _flusher_pid != os.getpid():
+            if _flusher_pid is not None:
+                # Valores herdados do processo pai pertencem ao arquivo dele
+                _counters.clear()
+                _histograms.clear()
+            _flusher_pid = os.getpid()
+            _flusher = threading.Thread(target=_flush_loop, name="metrics-flusher", daemon=True)
+            _flusher.start()
+
+
+@contextmanager
+def _archive_lock():
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _merge(total, data):
+    for name, labels, value in data.get('counters', []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        total['counters'][key] = total['counters'].get(key, 0.0) + value
+    for name, labels, buckets, value_sum, count in data.get('histograms', []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        current = total['histograms'].get(key)
+        if current is None:
+            total['histograms'][key] = [list(buckets), value_sum, count]
+        else:
+            current[0] = [a + b for a, b in zip(current[0], buckets)]
+            current[1] += value_sum
+            current[2] += count
+
+
+def mark_process_dead(pid):
+    """Soma contadores/histogramas do processo que saiu no arquivo de arquivo morto"""
+    path = os.path.join(METRICS_DIR, f"metrics_{pid}.json")
+    data = _read_json(path)
+    with _archive_lock():
+        if data is not None:
+            archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+            total = {'counters': {}, 'histograms': {}}
+            _merge(total, _read_json(archive_path) or {})
+            _merge(total, data)
+            _write_json(archive_path, {
+                'counters': [[name, list(labels), value] for (name, labels), value in total['counters'].items()],
+                'histograms': [[name, list(labels), h[0], h[1], h[2]] for (name, labels), h in total['histograms'].items()],
+            })
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in labels) + "}"
+
+
+def _worker_files():
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics_*.json")):
+        name = os.path.basename(path)
+        if name == ARCHIVE_FILE:
+            continue
+        try:
+            yield path, int(name[len("metrics_"):-len(".json")])
+        except ValueError:
+            continue
+
+
+def render():
+    """Métricas de todos os processos no formato texto do Prometheus"""
+    flush()
+    # Workers mortos sem child_exit (ex.: fora do gunicorn) vão para o arquivo morto
+    for _, pid in list(_worker_files()):
+        if not _pid_alive(pid):
+            mark_process_dead(pid)
+
+    total = {'counters': {}, 'histograms': {}}
+    gauges = {}
+    with _archive_lock():
+        _merge(total, _read_json(os.path.join(METRICS_DIR, ARCHIVE_FILE)) or {})
+        for path, pid in _worker_files():
+            data = _read_json(path)
+            if data is None:
+                continue
+            _merge(total, data)
+            for name, labels, value in data.get('gauges', []):
+                key = (name, tuple(tuple(pair) for pair in labels) + (('pid', pid),))
+                gauges[key] = value
+
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for (metric, labels), value in sorted(total['counters'].items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        elif kind == 'gauge':
+            for (metric, labels), value in sorted(gauges.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        else:
+            for (metric, labels), (buckets, value_sum, count) in sorted(total['histograms'].items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+                    cumulative += bucket
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value_sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
@@ -2,18 +2,72 @@ import torch
 import numpy as np
 import os
 import sys
+import threading
+import time
 import traceback
 
+import metrics
+from batching import MicroBatcher
+from embedding_cache import QueryEmbeddingCache
+
+class IndexState:
+    """Uma versão carregada do catálogo: vetores, caminhos, índice e catálogo de resultados.
+
+    Não muda depois de montada. O classificador troca a versão inteira em uma
+    atribuição (self.state = nova), então uma busca que já pegou o seu estado
+    termina nele mesmo que uma versão nova entre no meio.
+    """
+    __slots__ = ('version', 'data_path', 'embeddings', 'image_paths', 'store', 'index', 'index_meta', 'catalog',
+                 'hash_index', 'knn_graph', 'exact_index')
+    
+    def __init__(self, version=None, data_path=None, embeddings=None, image_paths=(), store=None,
+                 index=None, index_meta=None, catalog=None, hash_index=None, knn_graph=None,
+                 exact_index=None):
+        self.version = version
+        self.data_path = data_path
+        self.embeddings = embeddings
+        self.image_paths = image_paths
+        self.store = store
+        self.index = index
+        self.index_meta = index_meta
+        self.catalog = catalog
+        self.hash_index = hash_index
+        self.knn_graph = knn_graph
+        self.exact_index = exact_index
+
 class ImageClassifier:
-    def __init__(self, embeddings_path="embeddings", sample_images_path="sample_images"):
+    def __init__(self, embeddings_path="embeddings", sample_images_path="sample_images", index_config=None,
+                 encoder_backend=None, model_name=None):
         self.device = "cpu"  # Forçar CPU no Render
+        self.model_name = model_name or os.environ.get('CLIP_MODEL', "ViT-B/32")
+        self.encoder_backend = encoder_backend or os.environ.get('ENCODER_BACKEND', 'eager').lower()
         print(f"Iniciando carregamento no dispositivo: {self.device}")
         
-        # Tentar carregar CLIP
+        self.embeddings_path = embeddings_path
+        self.sample_images_path = sample_images_path
+        self.index_config = index_config
+        
+        # Versão carregada do catálogo (trocada inteira por add_images/remove_images/VersionWatcher)
+        self.state = IndexState()
+        self.version_watcher = None
+        self._update_lock = threading.Lock()
+        self.text_encoder = None
+        self.label_matrix = None
+        self._zero_shot_lock = threading.Lock()
+        self.query_cache = None
+        self.preprocessor = None
+        self.perceptual = None
+        self.batcher = None
+        
+        # Tentar carregar o encoder de imagens do CLIP
         try:
-            import clip
-            self.model, self.preprocess = clip.load("ViT-B/32", device=self.device)
-            print("✅ Modelo CLIP carregado com sucesso")
+            from encoders import load_image_encoder
+            encoders_dir = os.environ.get('ENCODER_DIR', os.path.join(embeddings_path, "encoders"))
+            self.encoder, self.preprocess, self.model = load_image_encoder(
+                self.model_name, self.encoder_backend, device=self.device, encoders_dir=encoders_dir
+            )
+            self.encoder_backend = self.encoder.backend
+            print(f"✅ Modelo CLIP carregado com sucesso (backend {self.encoder_backend})")
             self.clip_loaded = True
         except Exception as e:
             print(f"❌ Erro ao carregar CLIP: {e}")
@@ -21,81 +75,213 @@ class ImageClassifier:
             self.clip_loaded = False
             return
         
-        self.embeddings_path = embeddings_path
-        self.sample_images_path = sample_images_path
+        # Pré-processamento rápido (decode reduzido + resize/crop em um passo + normalização em NumPy)
+        from preprocessing import FastPreprocessor
+        self.preprocessor = FastPreprocessor.from_env(self.preprocess)
         
-        # Carregar embeddings
-        self.embeddings = None
-        self.image_paths = []
-        self.index = None
+        # Cache de embeddings de consulta (chave = hash dos pixels + modelo/backend)
+        self.query_cache = QueryEmbeddingCache.from_env(namespace=f"{self.model_name}:{self.encoder_backend}")
+        
+        # Pré-filtro por hash perceptual: cópias e quase-cópias reusam um embedding conhecido
+        from perceptual import PerceptualFilter
+        self.perceptual = PerceptualFilter.from_env()
+        
+        # Micro-batching de consultas concorrentes (BATCH_WINDOW_MS > 0 ativa)
+        self.batcher = MicroBatcher.from_env(self._run_search_batch, name="clip-search-batcher")
         
         try:
             self.load_embeddings()
         except Exception as e:
             print(f"❌ Erro ao carregar embeddings: {e}")
             print(traceback.format_exc())
+        
+        # Matriz de rótulos zero-shot: por padrão carregada no primeiro uso
+        if os.environ.get('ZERO_SHOT_PRELOAD') == '1':
+            try:
+                self.get_label_matrix()
+            except Exception as e:
+                print(f"⚠️ Erro ao carregar matriz de rótulos: {e}")
+    
+    # Atalhos para a versão atual (leitura; buscas usam um único self.state do começo ao fim)
+    @property
+    def embeddings(self):
+        return self.state.embeddings
+    
+    @property
+    def image_paths(self):
+        return self.state.image_paths
+    
+    @property
+    def index(self):
+        return self.state.index
+    
+    @property
+    def index_meta(self):
+        return self.state.index_meta
+    
+    @property
+    def store(self):
+        return self.state.store
+    
+    @property
+    def catalog(self):
+        return self.state.catalog
     
     def load_embeddings(self):
-        """Carrega embeddings e informações das imagens"""
+        """Carrega a versão ativa do catálogo (embeddings, caminhos e índice)"""
         try:
-            # Carregar embeddings
-            embeddings_file = os.path.join(self.embeddings_path, "embeddings.npy")
-            if os.path.exists(embeddings_file):
-                self.embeddings = np.load(embeddings_file, allow_pickle=True)
-                print(f"✅ Embeddings carregados: {self.embeddings.shape}")
-            else:
-                print(f"⚠️ Arquivo não encontrado: {embeddings_file}")
-                # Criar embeddings dummy para teste
-                self.embeddings = np.random.randn(100, 512).astype("float32")
-                print("✅ Embeddings dummy criados para teste")
+            import snapshots
+            version = snapshots.current_version(self.embeddings_path)
+            data_path = snapshots.version_path(self.embeddings_path, version)
             
-            # Carregar caminhos das imagens
-            paths_file = os.path.join(self.embeddings_path, "image_paths.npy")
-            if os.path.exists(paths_file):
-                self.image_paths = np.load(paths_file, allow_pickle=True).tolist()
-                print(f"✅ Caminhos carregados: {len(self.image_paths)} imagens")
-            else:
-                print(f"⚠️ Arquivo não encontrado: {paths_file}")
-                self.image_paths = [f"image_{i}.jpg" for i in range(len(self.embeddings))]
-            
-            # Criar índice FAISS
+            # Índice particionado em shards (processos próprios) ou local, carregado com a versão
+            index = None
             try:
-                import faiss
-                d = self.embeddings.shape[1]
-                self.index = faiss.IndexFlatL2(d)
-                self.index.add(self.embeddings.astype("float32"))
-                print(f"✅ Índice FAISS criado com {self.index.ntotal} vetores")
+                import sharding
+                index = sharding.ShardedIndex.from_env(data_path, self.get_index_config())
+                if index is not None:
+                    print(f"✅ Índice em {index.meta['shards']} shards ({index.ntotal} vetores)")
             except ImportError:
-                print("⚠️ FAISS não disponível, usando busca simples")
-                self.index = None
+                pass
+            
+            self.state = self.load_state(version, index=index)
+            if index is not None and index.ntotal != len(self.image_paths):
+                print(f"⚠️ Shards com {index.ntotal} vetores, catálogo com {len(self.image_paths)}")
+            
+            # Versões publicadas por outros workers entram sem reiniciar (os shards não são recarregados)
+            if index is None:
+                self.version_watcher = snapshots.VersionWatcher(
+                    self.embeddings_path, self.reload_version,
+                    interval=float(os.environ.get('VERSION_POLL_SECONDS', 5))
+                )
             
         except Exception as e:
             print(f"❌ Erro crítico: {e}")
             print(traceback.format_exc())
     
-    def get_sample_images(self, count=20):
-        """Retorna algumas imagens de exemplo para exibição"""
-        sample_dir = self.sample_images_path
-        images = []
+    def get_index_config(self):
+        import vector_index
+        return dict(self.index_config or vector_index.index_config_from_env())
+    
+    def load_state(self, version=None, index=None):
+        """Abre uma versão do catálogo (None = embeddings direto na pasta, sem versões)"""
+        import snapshots
+        from embedding_store import EmbeddingStore
+        data_path = snapshots.version_path(self.embeddings_path, version)
+        store = EmbeddingStore.open(data_path)
+        if store is not None:
+            # Store em mmap: compartilhado entre workers pelo page cache
+            embeddings, image_paths = store.vectors, store.paths
+            print(f"✅ Store de embeddings aberto (mmap): {embeddings.shape} {embeddings.dtype}"
+                  + (f" versão {version}" if version else ""))
+        else:
+            embeddings, image_paths = self.load_npy_embeddings(data_path)
+        
+        catalog = self.build_catalog(image_paths, store, data_path)
+        hash_index = None
+        if self.perceptual is not None and self.perceptual.enabled:
+            import perceptual
+            hash_index = self.perceptual.catalog_index(image_paths, perceptual.load_hashes(self.embeddings_path))
+        
+        # Grafo de vizinhos pré-calculado (python knn_graph.py), se existir para estes vetores
+        from knn_graph import KnnGraph
+        knn = KnnGraph.load(data_path, count=len(image_paths))
+        if knn is not None:
+            print(f"✅ Grafo de vizinhos carregado: {len(knn)} x {knn.k}")
         
-        if os.path.exists(sample_dir):
+        # Carregar (ou criar) índice FAISS
+        index_meta = index.meta if index is not None else None
+        exact_index = None
+        if index is None:
             try:
-                for f in os.listdir(sample_dir):
-                    if f.lower().endswith((".jpg", ".jpeg", ".png")):
-                        path = os.path.join(sample_dir, f)
-                        images.append({
-                            'path': f"/sample_images/{f}",
-                            'filename': f,
-                            'full_path': path
-                        })
-            except Exception as e:
-                print(f"Erro ao listar imagens: {e}")
+                import vector_index
+                index, index_meta = vector_index.load_or_build_index(
+                    embeddings, data_path, **self.get_index_config()
+                )
+            except ImportError:
+                # Sem wheel do faiss-cpu: busca exata em NumPy (mesmos resultados do IndexFlatL2)
+                from exact_index import ExactIndex
+                metric = os.environ.get('INDEX_METRIC', 'l2').lower()
+                exact_index = ExactIndex.from_env(embeddings, metric)
+                print(f"⚠️ FAISS não disponível, usando busca exata em NumPy "
+                      f"({exact_index.ntotal} vetores {exact_index.vectors.dtype}, {exact_index.threads} threads)")
+        
+        return IndexState(version, data_path, embeddings, image_paths, store, index, index_meta, catalog, hash_index,
+                          knn, exact_index)
+    
+    def swap_state(self, state):
+        """Troca a versão em uso; buscas em andamento terminam na anterior"""
+        old = self.state
+        self.state = state
+        with self._zero_shot_lock:
+            # Rótulos dependem do catálogo: recalculados (ou lidos do disco) no próximo uso
+            self.label_matrix = None
+        if old.catalog is not None and old.catalog is not state.catalog:
+            old.catalog.stop()
+        print(f"♻️  Catálogo na versão {state.version} ({len(state.image_paths)} imagens, pid {os.getpid()})")
+    
+    def reload_version(self, version):
+        """Carrega a versão indicada se for outra que não a atual (chamado pelo VersionWatcher)"""
+        if version is None or version == self.state.version:
+            return False
+        with self._update_lock:
+            if version == self.state.version:
+                return False
+            self.swap_state(self.load_state(version))
+        return True
+    
+    def ensure_version_watcher(self):
+        if self.version_watcher is not None:
+            self.version_watcher.ensure_started()
+    
+    def build_catalog(self, image_paths, store, data_path):
+        """Resolve caminho de exibição, URL e metadados de cada vetor uma única vez"""
+        from catalog import ResultCatalog
+        from thumbnails import ThumbnailStore
+        if store is not None:
+            metadata = store.metadata
+        else:
+            from embedding_store import read_image_info
+            metadata = read_image_info(os.path.join(data_path, "image_info.csv"), image_paths)
+        return ResultCatalog(
+            image_paths, self.sample_images_path, metadata=metadata,
+            refresh_interval=float(os.environ.get('CATALOG_REFRESH_SECONDS', 30)),
+            thumbnails=ThumbnailStore.from_env().load_manifest()
+        )
+    
+    def load_npy_embeddings(self, data_path):
+        """Carrega o formato antigo (embeddings.npy + image_paths.npy)"""
+        # Carregar embeddings
+        embeddings_file = os.path.join(data_path, "embeddings.npy")
+        if os.path.exists(embeddings_file):
+            embeddings = np.load(embeddings_file, mmap_mode="r")
+            print(f"✅ Embeddings carregados: {embeddings.shape}")
+        else:
+            print(f"⚠️ Arquivo não encontrado: {embeddings_file}")
+            # Criar embeddings dummy para teste
+            embeddings = np.random.randn(100, 512).astype("float32")
+            print("✅ Embeddings dummy criados para teste")
+        
+        # Carregar caminhos das imagens
+        paths_file = os.path.join(data_path, "image_paths.npy")
+        if os.path.exists(paths_file):
+            image_paths = np.load(paths_file, allow_pickle=True).tolist()
+            print(f"✅ Caminhos carregados: {len(image_paths)} imagens")
+        else:
+            print(f"⚠️ Arquivo não encontrado: {paths_file}")
+            image_paths = [f"image_{i}.jpg" for i in range(len(embeddings))]
+        return embeddings, image_paths
+    
+    def get_sample_images(self, count=20):
+        """Retorna algumas imagens de exemplo para exibição"""
+        images = self.catalog.sample_images() if self.catalog is not None else []
         
         # Se não encontrar imagens, criar lista dummy
         if not images:
             images = [
                 {
                     'path': f"/static/placeholder_{i}.jpg",
+                    'thumbnail': f"/static/placeholder_{i}.jpg",
                     'filename': f"placeholder_{i}.jpg",
                     'full_path': f"static/placeholder_{i}.jpg"
                 }
@@ -104,74 +290,379 @@ class ImageClassifier:
         
         return images[:min(count, len(images))]
     
-    def search_similar_images(self, image_path, k=5):
-        """Busca imagens similares à imagem fornecida"""
+    def search_similar_images(self, image_path, k=5, nprobe=None, ef_search=None):
+        """Busca imagens similares à imagem fornecida.
+
+        nprobe (IVF) e ef_search (HNSW) trocam recall por latência só nesta busca.
+        """
         if not self.clip_loaded:
             print("⚠️ CLIP não carregado, retornando resultados dummy")
-            return self.get_dummy_results(k)
+            return self.get_dummy_results(k, reason="clip_not_loaded")
         
         try:
             if not os.path.exists(image_path):
                 print(f"❌ Arquivo não encontrado: {image_path}")
-                return self.get_dummy_results(k)
+                return self.get_dummy_results(k, reason="file_not_found")
             
-            from PIL import Image
-            img = Image.open(image_path).convert("RGB")
-            img_tensor = self.preprocess(img).unsqueeze(0).to(self.device)
+            with metrics.timer('app_stage_seconds', stage="decode"):
+                img, _, _ = self.decode_image(image_path)
+            return self.search_similar_pil(img, k=k, nprobe=nprobe, ef_search=ef_search)
             
-            with torch.no_grad():
-                query_emb = self.model.encode_image(img_tensor)
-                query_emb /= query_emb.norm()
-                query_emb = query_emb.cpu().numpy().astype("float32")
+        except Exception as e:
+            print(f"❌ Erro na busca: {e}")
+            print(traceback.format_exc())
+            return self.get_dummy_results(k, reason="error")
+    
+    def search_similar_pil(self, img, k=5, nprobe=None, ef_search=None):
+        """Busca imagens similares a uma imagem PIL RGB já decodificada"""
+        if self.batcher is not None:
+            item = {'image': img, 'k': k, 'nprobe': nprobe, 'ef_search': ef_search}
+            return self.batcher.submit(item).result()
+        
+        state = self.state
+        query_emb = self.get_query_embedding(img, state)
+        distances, indices = self.search_embeddings(query_emb, k, nprobe=nprobe, ef_search=ef_search, state=state)
+        return self.format_results(distances[0], indices[0], state=state)
+    
+    def decode_image(self, source):
+        """Decodifica uma consulta (caminho, bytes ou file-like): (imagem RGB, formato, tamanho original).
+        
+        Com o pré-processamento rápido, JPEGs grandes já saem reduzidos do decodificador.
+        """
+        from preprocessing import decode
+        return decode(source, self.preprocessor.draft_size if self.preprocessor is not None else None)
+    
+    def preprocess_images(self, images):
+        """Lote de imagens PIL RGB -> tensor de entrada do encoder"""
+        if self.preprocessor is not None:
+            return self.preprocessor.batch(images).to(self.device)
+        return torch.stack([self.preprocess(img) for img in images]).to(self.device)
+    
+    def embed_images(self, images):
+        """Roda o CLIP em um lote de imagens PIL e retorna embeddings normalizados (float32)"""
+        with metrics.timer('app_stage_seconds', stage="preprocess"):
+            batch = self.preprocess_images(images)
+        with metrics.timer('app_stage_seconds', stage="encode"):
+            emb = self.encoder.encode(batch)
+            emb /= emb.norm(dim=-1, keepdim=True)
+        return emb.cpu().numpy().astype("float32")
+    
+    def get_query_embedding(self, img, state=None):
+        """Embedding da consulta, consultando o cache e o pré-filtro perceptual antes do encode_image"""
+        key = self.query_cache.image_key(img)
+        query_emb = self.query_cache.get(key)
+        metrics.inc('app_query_cache_total', result="miss" if query_emb is None else "hit")
+        if query_emb is None:
+            query_emb, image_hash = self.perceptual_embedding(img, state or self.state)
+            if query_emb is None:
+                query_emb = self.embed_images([img])
+                self.perceptual.remember(image_hash, query_emb)
+            self.query_cache.put(key, query_emb)
+        return query_emb
+    
+    def perceptual_embedding(self, img, state):
+        """(embedding de uma imagem conhecida com hash próximo ou None, hash da imagem)"""
+        if self.perceptual is None or not self.perceptual.enabled:
+            return None, None
+        with metrics.timer('app_stage_seconds', stage="perceptual_hash"):
+            image_hash = self.perceptual.hash(img)
+            kind, match = self.perceptual.match(image_hash, state.hash_index)
+        metrics.inc('app_perceptual_total', result=kind or "miss")
+        if kind == 'catalog':
+            # Cópia de uma imagem do catálogo: o vetor armazenado dela é a consulta
+            return np.asarray(state.embeddings[match:match + 1], dtype="float32"), image_hash
+        return match, image_hash
+    
+    def search_similar_image_batch(self, images, k=5, nprobe=None, ef_search=None):
+        """Busca várias imagens PIL de uma vez; retorna uma lista de resultados por imagem"""
+        items = [{'image': img, 'k': k, 'nprobe': nprobe, 'ef_search': ef_search} for img in images]
+        return self._run_search_batch(items)
+    
+    def _run_search_batch(self, items):
+        """Executa um lote do micro-batcher: um encode_image e um index.search por lote"""
+        state = self.state
+        query_embs = [None] * len(items)
+        keys = [self.query_cache.image_key(item['image']) for item in items]
+        for i, key in enumerate(keys):
+            query_embs[i] = self.query_cache.get(key)
+        
+        missing = [i for i, emb in enumerate(query_embs) if emb is None]
+        metrics.inc('app_query_cache_total', len(items) - len(missing), result="hit")
+        metrics.inc('app_query_cache_total', len(missing), result="miss")
+        
+        # Cópias e quase-cópias de imagens conhecidas saem do lote do encode_image
+        hashes = {}
+        for i in missing:
+            query_embs[i], hashes[i] = self.perceptual_embedding(items[i]['image'], state)
+            if query_embs[i] is not None:
+                self.query_cache.put(keys[i], query_embs[i])
+        missing = [i for i in missing if query_embs[i] is None]
+        
+        if missing:
+            embs = self.embed_images([items[i]['image'] for i in missing])
+            for row, i in enumerate(missing):
+                query_embs[i] = embs[row:row + 1]
+                self.query_cache.put(keys[i], query_embs[i])
+                self.perceptual.remember(hashes[i], query_embs[i])
+        query_embs = np.vstack(query_embs)
+        
+        # Requisições com os mesmos parâmetros de busca compartilham o index.search
+        groups = {}
+        for i, item in enumerate(items):
+            groups.setdefault((item.get('nprobe'), item.get('ef_search')), []).append(i)
+        
+        results = [None] * len(items)
+        for (nprobe, ef_search), members in groups.items():
+            k_max = max(items[i]['k'] for i in members)
+            distances, indices = self.search_embeddings(
+                query_embs[members], k_max, nprobe=nprobe, ef_search=ef_search, state=state
+            )
+            for row, i in enumerate(members):
+                k = items[i]['k']
+                results[i] = self.format_results(distances[row][:k], indices[row][:k], state=state)
+        return results
+    
+    def search_embeddings(self, query_embs, k, nprobe=None, ef_search=None, state=None):
+        """Busca k vizinhos para cada linha de query_embs (na versão state, ou na atual)"""
+        self.ensure_version_watcher()
+        state = state or self.state
+        if state.index is not None:
+            import vector_index
+            with metrics.timer('app_stage_seconds', stage="search"):
+                return vector_index.search_index(
+                    state.index, state.index_meta, query_embs, k, nprobe=nprobe, ef_search=ef_search
+                )
+        
+        # Sem FAISS: busca exata em NumPy
+        if state.exact_index is not None:
+            with metrics.timer('app_stage_seconds', stage="search"):
+                return state.exact_index.search(query_embs, k)
+        
+        metrics.inc('app_dummy_results_total', len(query_embs), reason="no_index")
+        n = min(k, len(state.embeddings))
+        distances = np.tile(np.arange(n) * 0.1, (len(query_embs), 1))
+        indices = np.tile(np.arange(n), (len(query_embs), 1))
+        return distances, indices
+    
+    def format_results(self, distances, indices, state=None):
+        """Converte uma linha de (distâncias, índices) no formato de resultado da API"""
+        start = time.perf_counter()
+        state = state or self.state
+        image_paths, catalog = state.image_paths, state.catalog
+        results = []
+        for i, idx in enumerate(indices):
+            if 0 <= idx < len(image_paths):
+                display_path, url, filename = catalog.entry(idx)
+                distance = float(distances[i])
+                results.append({
+                    'id': int(idx),
+                    'original_path': image_paths[idx],
+                    'display_path': display_path,
+                    'url': url,
+                    'thumbnail_url': catalog.thumbnail_url(idx),
+                    'distance': distance,
+                    'filename': filename,
+                    'similarity_percent': max(0, 100 - distance * 10),
+                    'metadata': catalog.metadata_row(idx)
+                })
+        
+        metrics.observe('app_stage_seconds', time.perf_counter() - start, stage="path_resolution")
+        return results
+    
+    def similar(self, catalog_id, k=5):
+        """Imagens do catálogo mais parecidas com a imagem catalog_id, sem rodar o CLIP.
+        
+        Responde do grafo de vizinhos pré-calculado; sem grafo (ou com k maior
+        que o do grafo) busca no índice com o vetor já armazenado da imagem.
+        Retorna (resultados, origem) ou IndexError se o id não existe.
+        """
+        state = self.state
+        k = max(0, int(k))
+        if not 0 <= catalog_id < len(state.image_paths):
+            raise IndexError(f"Imagem {catalog_id} fora do catálogo ({len(state.image_paths)} imagens)")
+        
+        if state.knn_graph is not None and k <= state.knn_graph.k:
+            with metrics.timer('app_stage_seconds', stage="knn_graph"):
+                distances, indices = state.knn_graph.neighbors(catalog_id, k)
+            return self.format_results(distances, indices, state=state), 'knn_graph'
+        
+        query_emb = np.asarray(state.embeddings[catalog_id:catalog_id + 1], dtype="float32")
+        distances, indices = self.search_embeddings(query_emb, k + 1, state=state)
+        # A própria imagem não entra no resultado
+        keep = indices[0] != catalog_id
+        return self.format_results(distances[0][keep][:k], indices[0][keep][:k], state=state), 'index'
+    
+    def add_images(self, images, paths, metadata=None):
+        """Embeda imagens PIL novas e publica uma versão do catálogo com elas no fim.
+        
+        metadata: lista opcional (uma por imagem) de dicts coluna -> valor.
+        Retorna (versão, ids dos vetores novos).
+        """
+        if len(images) != len(paths):
+            raise ValueError(f"{len(images)} imagens para {len(paths)} caminhos")
+        if not self.clip_loaded:
+            raise RuntimeError("CLIP não carregado")
+        batch_size = int(os.environ.get('SEARCH_BATCH_SIZE', 32))
+        new_vectors = np.vstack([
+            self.embed_images(images[i:i + batch_size]) for i in range(0, len(images), batch_size)
+        ])
+        metadata = metadata or [{} for _ in paths]
+        new_hashes = {}
+        if self.perceptual is not None and self.perceptual.enabled:
+            import perceptual
+            new_hashes = {path: perceptual.to_hex(self.perceptual.hash(img)) for img, path in zip(images, paths)}
+        
+        def update(state):
+            dtype = state.store.header['dtype'] if state.store is not None else "float32"
+            # Mesmo arredondamento do store, para o índice bater com os vetores gravados
+            vectors = new_vectors.astype(dtype).astype("float32")
+            start = len(state.image_paths)
+            columns = self._metadata_columns(state)
+            for row in metadata:
+                for column in row:
+                    columns.setdefault(column, [""] * start)
+            for column, values in columns.items():
+                values.extend(str(row.get(column, "")) for row in metadata)
             
-            # Buscar imagens similares
-            if self.index is not None:
-                distances, indices = self.index.search(query_emb, k)
-            else:
-                # Busca simples se FAISS não estiver disponível
-                distances = []
-                indices = []
-                for i in range(min(k, len(self.embeddings))):
-                    distances.append([i * 0.1])
-                    indices.append([i])
-                distances = np.array(distances)
-                indices = np.array(indices)
+            index, index_meta = None, None
+            if state.index is not None:
+                import faiss
+                import vector_index
+                # Cópia própria da versão atual (a em uso pode estar em mmap somente leitura) + vetores novos
+                index = faiss.deserialize_index(faiss.serialize_index(state.index))
+                index.add(vector_index._prepare_vectors(vectors, state.index_meta['metric']))
+                index_meta = dict(state.index_meta, ntotal=int(index.ntotal))
             
-            # Preparar resultados
-            results = []
-            for i, idx in enumerate(indices[0]):
-                if idx < len(self.image_paths):
-                    img_path = self.image_paths[idx]
-                    
-                    # Verificar se o arquivo existe
-                    if os.path.exists(img_path):
-                        result_path = img_path
-                    else:
-                        # Tentar encontrar na pasta de samples
-                        filename = os.path.basename(img_path)
-                        sample_path = os.path.join(self.sample_images_path, filename)
-                        if os.path.exists(sample_path):
-                            result_path = sample_path
-                        else:
-                            result_path = None
-                    
-                    results.append({
-                        'original_path': img_path,
-                        'display_path': result_path,
-                        'distance': float(distances[0][i]),
-                        'filename': os.path.basename(img_path),
-                        'similarity_percent': max(0, 100 - distances[0][i] * 10)
-                    })
+            if new_hashes:
+                # Gravados antes da versão: quem carregá-la já encontra os hashes das imagens novas
+                import perceptual
+                hashes = perceptual.load_hashes(self.embeddings_path)
+                hashes.update(new_hashes)
+                perceptual.save_hashes(self.embeddings_path, hashes, self.perceptual.hash_size)
             
-            return results
+            embeddings = np.concatenate([np.asarray(state.embeddings, dtype="float32"), vectors])
+            # Grafo de vizinhos: só as linhas novas são calculadas; as antigas recebem as novas como candidatas
+            knn = state.knn_graph.extend(embeddings) if state.knn_graph is not None else None
+            return (embeddings, list(state.image_paths) + list(paths), columns, dtype, index, index_meta, knn,
+                    list(range(start, start + len(paths))))
+        
+        return self._publish(update)
+    
+    def remove_images(self, ids=(), paths=()):
+        """Publica uma versão do catálogo sem os vetores indicados (por id e/ou caminho).
+        
+        Os ids seguintes são renumerados. Retorna (versão, quantidade removida).
+        """
+        def update(state):
+            n = len(state.image_paths)
+            remove = {int(i) for i in ids if 0 <= int(i) < n}
+            if paths:
+                wanted = set(paths)
+                remove.update(i for i, path in enumerate(state.image_paths) if path in wanted)
+            if not remove:
+                raise ValueError("Nenhuma imagem do catálogo corresponde aos ids/caminhos informados")
+            if len(remove) == n:
+                raise ValueError("O catálogo não pode ficar vazio")
+            keep = [i for i in range(n) if i not in remove]
             
-        except Exception as e:
-            print(f"❌ Erro na busca: {e}")
-            print(traceback.format_exc())
-            return self.get_dummy_results(k)
+            dtype = state.store.header['dtype'] if state.store is not None else "float32"
+            embeddings = np.asarray(state.embeddings[keep], dtype="float32")
+            image_paths = [state.image_paths[i] for i in keep]
+            columns = {column: [values[i] for i in keep] for column, values in self._metadata_columns(state).items()}
+            
+            index, index_meta = None, None
+            if state.index is not None:
+                import vector_index
+                # Remover renumera os ids: o índice é recriado com a configuração atual
+                config = self.get_index_config()
+                index, index_meta = vector_index.build_index(
+                    embeddings, config.pop('backend', 'flat'), config.pop('metric', 'l2'), **config
+                )
+            # Grafo de vizinhos: recalcula só as linhas que apontavam para imagens removidas
+            knn = state.knn_graph.remove(embeddings, sorted(remove)) if state.knn_graph is not None else None
+            return embeddings, image_paths, columns, dtype, index, index_meta, knn, len(remove)
+        
+        return self._publish(update)
+    
+    @staticmethod
+    def _metadata_columns(state):
+        metadata = state.catalog.metadata if state.catalog is not None else {}
+        return {column: list(values) for column, values in metadata.items()}
+    
+    def _publish(self, update):
+        """Aplica update(state) sobre a versão mais recente, publica o resultado e passa a usá-lo"""
+        import snapshots
+        if self.index_meta and self.index_meta.get('sharded'):
+            raise RuntimeError("Atualização ao vivo não suportada com o índice em shards")
+        with self._update_lock, snapshots.update_lock(self.embeddings_path):
+            # Outro worker pode ter publicado uma versão desde a última verificação
+            version = snapshots.current_version(self.embeddings_path)
+            if version is not None and version != self.state.version:
+                self.swap_state(self.load_state(version))
+            
+            embeddings, image_paths, metadata, dtype, index, index_meta, knn, result = update(self.state)
+            version = snapshots.publish(self.embeddings_path, embeddings, image_paths, metadata, dtype,
+                                        index=index, index_meta=index_meta, knn_graph=knn)
+            # Reaberta do disco: vetores e índice em mmap, como nos outros workers
+            self.swap_state(self.load_state(version))
+        return version, result
+    
+    def close(self):
+        """Encerra threads e pools deste classificador (modelo descarregado pelo registro)"""
+        if self.version_watcher is not None:
+            self.version_watcher.stop()
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.preprocessor is not None:
+            self.preprocessor.close()
+        state = self.state
+        if state.catalog is not None:
+            state.catalog.stop()
+        if state.index_meta and state.index_meta.get('sharded'):
+            state.index.close()
+    
+    def get_label_matrix(self):
+        """Encoder de texto + matriz de rótulos (carregados uma única vez)"""
+        if self.label_matrix is None:
+            with self._zero_shot_lock:
+                if self.label_matrix is None:
+                    import zero_shot
+                    self.text_encoder = zero_shot.TextEncoder(
+                        model=self.model, model_name=self.model_name, device=self.device
+                    )
+                    state = self.state
+                    metadata = state.catalog.metadata if state.catalog is not None else {}
+                    # Gravada na pasta da versão: cada versão (e cada modelo) tem a sua matriz
+                    self.label_matrix = zero_shot.load_or_build(
+                        state.data_path, state.image_paths, metadata, self.text_encoder
+                    )
+        return self.label_matrix
+    
+    def classify_pil(self, img, k=5):
+        """Identificação zero-shot: produtos mais prováveis para uma imagem PIL RGB"""
+        query_emb = self.get_query_embedding(img)
+        return self.get_label_matrix().classify(query_emb, k)[0]
+    
+    def search_text(self, text, k=5, nprobe=None, ef_search=None):
+        """Busca imagens do catálogo a partir de um prompt de texto"""
+        self.get_label_matrix()
+        state = self.state
+        query_emb = self.text_encoder.encode_cached(text)
+        distances, indices = self.search_embeddings(query_emb, k, nprobe=nprobe, ef_search=ef_search, state=state)
+        return self.format_results(distances[0], indices[0], state=state)
+    
+    def warmup(self):
+        """Roda uma busca completa com uma imagem sintética (sem passar pelo cache)"""
+        if not self.clip_loaded:
+            raise RuntimeError("CLIP não carregado")
+        from PIL import Image
+        img = Image.new("RGB", (224, 224), (128, 128, 128))
+        query_emb = self.embed_images([img])
+        self.search_embeddings(query_emb, 5)
     
-    def get_dummy_results(self, k=5):
+    def get_dummy_results(self, k=5, reason="error"):
         """Retorna resultados dummy para teste"""
+        metrics.inc('app_dummy_results_total', reason=reason)
         results = []
         for i in range(min(k, 5)):
             results.append({
@@ -188,7 +679,21 @@ class ImageClassifier:
         return {
             'total_images': len(self.image_paths),
             'embedding_dimensions': self.embeddings.shape[1] if self.embeddings is not None else 0,
+            'embedding_dtype': str(self.embeddings.dtype) if self.embeddings is not None else None,
+            'embedding_store': 'mmap' if self.store is not None else 'npy',
+            'index_version': self.state.version,
             'has_sample_images': len(self.get_sample_images()) > 0,
             'clip_loaded': self.clip_loaded,
-            'faiss_available': self.index is not None
+            'model_name': self.model_name,
+            'encoder_backend': self.encoder_backend,
+            'zero_shot_labels': len(self.label_matrix.labels) if self.label_matrix is not None else None,
+            'faiss_available': self.index is not None,
+            'knn_graph_k': self.state.knn_graph.k if self.state.knn_graph is not None else None,
+            'index_backend': self.index_meta['factory'] if self.index_meta else None,
+            'exact_search': self.state.exact_index.stats() if self.state.exact_index is not None else None,
+            'index_metric': self.index_meta['metric'] if self.index_meta else None,
+            'preprocess': self.preprocessor.stats() if self.preprocessor is not None else {'backend': 'torchvision'},
+            'query_cache': self.query_cache.stats() if self.query_cache is not None else None,
+            'perceptual_filter': self.perceptual.stats() if self.perceptual is not None else None,
+            'batching': self.batcher.stats() if self.batcher is not None else None
         }
\ No newline at end of file
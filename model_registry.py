@@ -0,0 +1,280 @@
+# model_registry.py
+"""
+Registro de pares encoder + índice (um ImageClassifier por modelo).
+
+Cada modelo tem um nome usado nas requisições (campo "model") e é carregado
+só no primeiro uso. Ex.: um modelo pequeno para triagem e um maior para a
+identificação precisa, cada um com o seu catálogo de embeddings:
+
+    MODELS="triagem=ViT-B/32@embeddings,preciso=ViT-L/14@embeddings_vitl14"
+    MODELS="...,preciso_onnx=ViT-L/14@embeddings_vitl14@onnx"     (backend do encoder)
+    DEFAULT_MODEL=triagem            (padrão: o primeiro da lista)
+    MODEL_MEMORY_BUDGET_MB=6000      (0 = sem limite)
+
+O modelo padrão é carregado na inicialização e nunca sai da memória (é o que
+o aquecimento e o /ready acompanham). Os outros ficam em uma LRU: quando o RSS
+do processo passa de MODEL_MEMORY_BUDGET_MB, os usados há mais tempo são
+descarregados. A memória de cada modelo é o aumento do RSS medido durante o
+carregamento (vetores em mmap entram à medida que as páginas são lidas).
+
+As requisições pegam o classificador com acquire() e devolvem com release():
+um modelo escolhido para sair da memória só é fechado quando a última
+requisição que o usa termina.
+"""
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+DEFAULT_MODEL_NAME = "ViT-B/32"
+
+
+def parse_models(text, embeddings_path="embeddings"):
+    """'nome=modelo@embeddings[@backend],...' -> lista de specs (dicts) na ordem"""
+    specs = []
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, value = item.partition("=")
+        if not name or not value:
+            raise ValueError(f"Modelo inválido em MODELS: {item} (use nome=modelo@embeddings)")
+        model_name, _, rest = value.partition("@")
+        path, _, backend = rest.partition("@")
+        specs.append({
+            'name': name.strip(),
+            'model_name': model_name.strip(),
+            'embeddings_path': path.strip() or embeddings_path,
+            'encoder_backend': backend.strip() or None,
+        })
+    names = [spec['name'] for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Nomes de modelo repetidos em MODELS: {', '.join(names)}")
+    return specs
+
+
+def _release_memory():
+    # Devolve ao sistema as páginas livres do malloc (glibc) depois de descarregar um modelo
+    gc.collect()
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class ModelRegistry:
+    def __init__(self, specs, default=None, memory_budget_mb=0, sample_images_path="sample_images", factory=None):
+        if not specs:
+            raise ValueError("Nenhum modelo configurado")
+        self.specs = OrderedDict((spec['name'], spec) for spec in specs)
+        self.default = default or specs[0]['name']
+        if self.default not in self.specs:
+            raise ValueError(f"Modelo padrão desconhecido: {self.default} (opções: {', '.join(self.specs)})")
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.sample_images_path = sample_images_path
+        self.factory = factory
+        # nome -> {'classifier', 'memory_bytes', 'load_seconds', 'loaded_at', 'last_used', 'requests', 'active'},
+        # ordem LRU
+        self._resident = OrderedDict()
+        # Descarregados ainda em uso por alguma requisição (fechados no último release)
+        self._draining = []
+        # Memória medida no último carregamento de cada modelo (para abrir espaço antes de recarregar)
+        self._last_memory = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+        # Um carregamento por vez: o aumento do RSS medido é só do modelo que está entrando
+        self._load_lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls, embeddings_path="embeddings", sample_images_path="sample_images", factory=None):
+        """MODELS, DEFAULT_MODEL e MODEL_MEMORY_BUDGET_MB (sem MODELS: só o modelo de sempre)"""
+        text = os.environ.get('MODELS', '').strip()
+        if text:
+            specs = parse_models(text, embeddings_path)
+        else:
+            specs = [{'name': 'default', 'model_name': os.environ.get('CLIP_MODEL', DEFAULT_MODEL_NAME),
+                      'embeddings_path': embeddings_path, 'encoder_backend': None}]
+        return cls(
+            specs,
+            default=os.environ.get('DEFAULT_MODEL') or None,
+            memory_budget_mb=float(os.environ.get('MODEL_MEMORY_BUDGET_MB', 0)),
+            sample_images_path=sample_images_path,
+            factory=factory,
+        )
+
+    @property
+    def names(self):
+        return list(self.specs)
+
+    def _create(self, spec):
+        if self.factory is not None:
+            return self.factory(spec)
+        from model_loader import ImageClassifier
+        return ImageClassifier(
+            embeddings_path=spec['embeddings_path'],
+            sample_images_path=self.sample_images_path,
+            encoder_backend=spec['encoder_backend'],
+            model_name=spec['model_name'],
+        )
+
+    def get(self, name=None):
+        """Classificador do modelo (carregado agora se ainda não estiver na memória).
+
+        KeyError para um nome desconhecido; RuntimeError se a criação do classificador falhar.
+        Sem reserva: só para o modelo padrão, que nunca sai da memória (use acquire() nas requisições).
+        """
+        return self._get(name, lease=False)
+
+    def acquire(self, name=None):
+        """Como get(), reservando o classificador até o release() correspondente"""
+        return self._get(name, lease=True)
+
+    def release(self, classifier):
+        """Devolve um classificador de acquire(); fecha-o se já foi descarregado e ninguém mais o usa"""
+        with self._lock:
+            entry = next((entry for entry in list(self._resident.values()) + self._draining
+                          if entry['classifier'] is classifier), None)
+            if entry is None:
+                return
+            entry['active'] = max(0, entry['active'] - 1)
+            draining = [other for other in self._draining if other is not entry]
+            if entry['active'] or len(draining) == len(self._draining):
+                return
+            self._draining = draining
+        self._close(entry)
+
+    def _get(self, name, lease):
+        name = name or self.default
+        if name not in self.specs:
+            raise KeyError(name)
+        with self._lock:
+            entry = self._resident.get(name)
+            if entry is not None:
+                self._touch(name, entry, lease)
+                return entry['classifier']
+
+        with self._load_lock:
+            with self._lock:
+                entry = self._resident.get(name)
+                if entry is not None:
+                    self._touch(name, entry, lease)
+                    return entry['classifier']
+            # Abre espaço antes, se já se sabe quanto este modelo ocupa
+            self._evict(keep=name, incoming=self._last_memory.get(name, 0))
+            classifier = self.load(name)
+            with self._lock:
+                # Reservado antes do _evict abaixo, que só protege o próprio nome
+                self._touch(name, self._resident[name], lease, count=False)
+            self._evict(keep=name)
+        return classifier
+
+    def _touch(self, name, entry, lease=False, count=True):
+        entry['last_used'] = time.time()
+        if count:
+            entry['requests'] += 1
+        if lease:
+            entry['active'] += 1
+        self._resident.move_to_end(name)
+
+    def load(self, name):
+        """Carrega o modelo e o registra como residente (chamado com _load_lock)"""
+        spec = self.specs[name]
+        print(f"♻️  Carregando modelo {name} ({spec['model_name']}, {spec['embeddings_path']})...")
+        rss_before = metrics.resident_memory_bytes()
+        start = time.perf_counter()
+        try:
+            classifier = self._create(spec)
+        except Exception as e:
+            self._errors[name] = str(e)
+            raise RuntimeError(f"Modelo {name} não carregado: {e}")
+        self.register(name, classifier, max(0, metrics.resident_memory_bytes() - rss_before),
+                      time.perf_counter() - start)
+        if not getattr(classifier, 'clip_loaded', True):
+            # Fica registrado como antes do registro existir: responde com resultados dummy
+            self._errors[name] = "CLIP não carregado"
+        return classifier
+
+    def register(self, name, classifier, memory_bytes=0, load_seconds=None):
+        """Registra um classificador já carregado (ex.: o padrão, criado na inicialização do app)"""
+        now = time.time()
+        with self._lock:
+            self._resident[name] = {
+                'classifier': classifier,
+                'memory_bytes': int(memory_bytes),
+                'load_seconds': round(load_seconds, 3) if load_seconds is not None else None,
+                'loaded_at': now,
+                'last_used': now,
+                'requests': 0,
+                'active': 0,
+            }
+            self._last_memory[name] = int(memory_bytes)
+            self._errors.pop(name, None)
+            self.loads += 1
+        print(f"✅ Modelo {name} carregado ({memory_bytes / 1024 / 1024:.0f} MB)")
+        return classifier
+
+    def _evict(self, keep=None, incoming=0):
+        """Descarrega os modelos menos usados recentemente até o RSS caber no orçamento"""
+        if self.memory_budget <= 0:
+            return
+        while True:
+            with self._lock:
+                # Memória dos que ainda estão em uso já conta como liberada
+                pending = sum(entry['memory_bytes'] for entry in self._draining)
+                if metrics.resident_memory_bytes() - pending + incoming <= self.memory_budget:
+                    break
+                victims = [name for name in self._resident if name not in (keep, self.default)]
+                if not victims:
+                    break
+                name = victims[0]
+                entry = self._resident.pop(name)
+                self.evictions += 1
+                in_use = entry['active'] > 0
+                if in_use:
+                    self._draining.append(entry)
+            print(f"♻️  Modelo {name} descarregado (orçamento de "
+                  f"{self.memory_budget / 1024 / 1024:.0f} MB, pid {os.getpid()})"
+                  + (f", fechado quando {entry['active']} requisição(ões) terminarem" if in_use else ""))
+            if not in_use:
+                self._close(entry)
+            del entry
+
+    def _close(self, entry):
+        entry['classifier'].close()
+        entry.clear()
+        _release_memory()
+
+    def resident(self):
+        with self._lock:
+            return list(self._resident)
+
+    def stats(self):
+        with self._lock:
+            resident = {
+                name: {
+                    'model_name': self.specs[name]['model_name'],
+                    'embeddings_path': self.specs[name]['embeddings_path'],
+                    'encoder_backend': getattr(entry['classifier'], 'encoder_backend', None),
+                    'memory_mb': round(entry['memory_bytes'] / 1024 / 1024, 1),
+                    'load_seconds': entry['load_seconds'],
+                    'requests': entry['requests'],
+                    'active': entry['active'],
+                    'idle_seconds': round(time.time() - entry['last_used'], 1),
+                    'pinned': name == self.default,
+                }
+                for name, entry in self._resident.items()
+            }
+            return {
+                'default': self.default,
+                'available': self.names,
+                'resident': resident,
+                'rss_mb': round(metrics.resident_memory_bytes() / 1024 / 1024, 1),
+                'budget_mb': round(self.memory_budget / 1024 / 1024, 1) if self.memory_budget else None,
+                'draining': len(self._draining),
+                'errors': dict(self._errors),
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,230 @@
+# perceptual.py
+"""
+Pré-filtro por hash perceptual (dHash) antes do CLIP.
+
+Muitas consultas são a mesma foto reenviada, outra foto quase igual do mesmo
+comprimido ou uma cópia de uma imagem do catálogo. Um dHash (gradientes de uma
+miniatura em tons de cinza) custa uma redução da imagem, contra um forward
+inteiro do CLIP. Quando o hash da consulta está a até PHASH_THRESHOLD bits de:
+
+  - uma imagem do catálogo: a busca usa o embedding já armazenado dela;
+  - uma consulta recente (últimas PHASH_RECENT_SIZE deste processo): reusa o
+    embedding calculado para ela;
+
+e só nos outros casos o CLIP roda. Os hashes do catálogo ficam em
+embeddings/perceptual_hashes.json ({caminho: hash}) e são gerados no build:
+
+    python perceptual.py embeddings
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+HASH_FILE = "perceptual_hashes.json"
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:  # numpy < 2.0
+    def _popcount(words):
+        return np.unpackbits(words.view(np.uint8), axis=-1).reshape(words.shape + (64,)).sum(axis=-1)
+
+
+def dhash(img, hash_size=16):
+    """dHash de hash_size x hash_size bits de uma imagem PIL, como words uint64"""
+    from PIL import Image
+    # Reduz antes de converter para cinza: custo proporcional à miniatura, não à foto
+    small = img.resize((hash_size + 1, hash_size), Image.BILINEAR, reducing_gap=2.0).convert("L")
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return np.packbits(bits).view(np.uint64)
+
+
+def hamming(hashes, image_hash):
+    """Distância de Hamming entre cada linha de hashes (n, words) e um hash"""
+    return _popcount(np.bitwise_xor(hashes, image_hash)).sum(axis=-1)
+
+
+def to_hex(image_hash):
+    return image_hash.tobytes().hex()
+
+
+def from_hex(value):
+    return np.frombuffer(bytes.fromhex(value), dtype=np.uint64)
+
+
+class HashIndex:
+    """Hashes de um conjunto de imagens (ids = linhas do catálogo), só leitura"""
+
+    def __init__(self, hashes, ids):
+        self.hashes = hashes
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest(self, image_hash):
+        """(id, distância) da imagem mais próxima, ou (None, None) se vazio"""
+        if not len(self.ids):
+            return None, None
+        distances = hamming(self.hashes, image_hash)
+        row = int(np.argmin(distances))
+        return int(self.ids[row]), int(distances[row])
+
+
+class PerceptualFilter:
+    def __init__(self, hash_size=16, threshold=8, recent_size=1024):
+        if hash_size % 8:
+            raise ValueError(f"hash_size deve ser múltiplo de 8: {hash_size}")
+        self.hash_size = hash_size
+        self.threshold = threshold
+        self.recent_size = max(0, int(recent_size))
+        self.words = hash_size * hash_size // 64
+        self._recent_hashes = np.zeros((self.recent_size, self.words), dtype=np.uint64)
+        self._recent_embeddings = [None] * self.recent_size
+        self._recent_count = 0
+        self._lock = threading.Lock()
+        self.catalog_hits = 0
+        self.recent_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        """PHASH_THRESHOLD (bits; negativo desliga), PHASH_SIZE e PHASH_RECENT_SIZE"""
+        return cls(
+            hash_size=int(os.environ.get('PHASH_SIZE', 16)),
+            threshold=int(os.environ.get('PHASH_THRESHOLD', 8)),
+            recent_size=int(os.environ.get('PHASH_RECENT_SIZE', 1024)),
+        )
+
+    @property
+    def enabled(self):
+        return self.threshold >= 0
+
+    def hash(self, img):
+        return dhash(img, self.hash_size)
+
+    def catalog_index(self, image_paths, hashes):
+        """HashIndex das imagens do catálogo que têm hash ({caminho: hex})"""
+        rows, ids = [], []
+        for i, path in enumerate(image_paths):
+            value = hashes.get(path)
+            if value is not None and len(value) == self.words * 16:
+                rows.append(from_hex(value))
+                ids.append(i)
+        if not rows:
+            return HashIndex(np.zeros((0, self.words), dtype=np.uint64), np.zeros(0, dtype=np.int64))
+        return HashIndex(np.vstack(rows), np.array(ids, dtype=np.int64))
+
+    def match(self, image_hash, catalog_index=None):
+        """('catalog', id), ('recent', embedding) ou (None, None) dentro do limiar"""
+        if catalog_index is not None:
+            idx, distance = catalog_index.nearest(image_hash)
+            if idx is not None and distance <= self.threshold:
+                with self._lock:
+                    self.catalog_hits += 1
+                return 'catalog', idx
+
+        with self._lock:
+            count = min(self._recent_count, self.recent_size)
+            hashes = self._recent_hashes[:count].copy()
+            embeddings = self._recent_embeddings[:count]
+        if count:
+            distances = hamming(hashes, image_hash)
+            row = int(np.argmin(distances))
+            if distances[row] <= self.threshold:
+                with self._lock:
+                    self.recent_hits += 1
+                return 'recent', embeddings[row]
+
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def remember(self, image_hash, embedding):
+        """Guarda o embedding de uma consulta nova (anel com as últimas recent_size)"""
+        if image_hash is None or not self.recent_size:
+            return
+        with self._lock:
+            slot = self._recent_count % self.recent_size
+            self._recent_hashes[slot] = image_hash
+            self._recent_embeddings[slot] = embedding
+            self._recent_count += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.catalog_hits + self.recent_hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'hash_bits': self.hash_size * self.hash_size,
+                'threshold': self.threshold,
+                'recent': min(self._recent_count, self.recent_size),
+                'catalog_hits': self.catalog_hits,
+                'recent_hits': self.recent_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.catalog_hits + self.recent_hits) / lookups, 4) if lookups else None,
+            }
+
+
+def load_hashes(embeddings_path):
+    """{caminho da imagem: hash hex} gerado no build (vazio se não existir)"""
+    try:
+        with open(os.path.join(embeddings_path, HASH_FILE), encoding="utf-8") as f:
+            return json.load(f).get('hashes', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_hashes(embeddings_path, hashes, hash_size=16):
+    hash_file = os.path.join(embeddings_path, HASH_FILE)
+    with open(f"{hash_file}.tmp", "w", encoding="utf-8") as f:
+        json.dump({'hash_size': hash_size, 'hashes': hashes}, f)
+    os.replace(f"{hash_file}.tmp", hash_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera os hashes perceptuais das imagens do catálogo")
+    parser.add_argument("embeddings_path", nargs="?", default="embeddings")
+    parser.add_argument("--sample-images", default="sample_images")
+    parser.add_argument("--hash-size", type=int, default=int(os.environ.get('PHASH_SIZE', 16)))
+    args = parser.parse_args(argv)
+
+    try:
+        from PIL import Image
+        from catalog import ResultCatalog
+        import snapshots
+        from embedding_store import EmbeddingStore
+
+        # Caminhos da versão ativa; o arquivo de hashes fica na raiz (o servidor lê de lá)
+        data_path = snapshots.version_path(args.embeddings_path, snapshots.current_version(args.embeddings_path))
+        store = EmbeddingStore.open(data_path)
+        if store is not None:
+            paths = store.paths.tolist()
+        else:
+            paths = [str(p) for p in np.load(os.path.join(data_path, "image_paths.npy"), allow_pickle=True)]
+        catalog = ResultCatalog(paths, args.sample_images, refresh_interval=0)
+
+        hashes = {}
+        for i, path in enumerate(paths):
+            display_path = catalog.entry(i)[0]
+            if not display_path:
+                continue
+            try:
+                # Decodificação completa, como na consulta: cópias exatas dão o mesmo hash
+                with Image.open(display_path) as img:
+                    hashes[path] = to_hex(dhash(img.convert("RGB"), args.hash_size))
+            except Exception as e:
+                print(f"⚠️ Hash não gerado para {display_path}: {e}")
+        save_hashes(args.embeddings_path, hashes, args.hash_size)
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return 1
+    print(f"✅ {len(hashes)} hashes perceptuais em {os.path.join(args.embeddings_path, HASH_FILE)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+# preprocessing.py
+"""
+Pré-processamento rápido das consultas para o CLIP.
+
+Produz o mesmo tensor do preprocess do CLIP (Resize bicúbico do lado menor,
+CenterCrop, ToTensor, Normalize) com menos trabalho:
+
+  - JPEG decodificado já reduzido (draft: escala DCT de 1/2, 1/4 ou 1/8) até o
+    menor tamanho que ainda tem PREPROCESS_DRAFT_FACTOR x a resolução do modelo
+    no lado menor (0 desliga e decodifica a resolução cheia);
+  - resize e crop em uma única chamada do Pillow, com box = região do crop na
+    imagem, sem redimensionar a parte que o crop descartaria (os pesos do
+    filtro são os mesmos do resize seguido de crop);
+  - ToTensor + Normalize como uma única conta vetorizada em NumPy.
+
+Com PREPROCESS_WORKERS > 0, lotes de várias imagens são preparados em um pool
+de processos, fora do GIL do processo que atende as requisições.
+
+Diferença para o preprocess original em imagens reais:
+    python preprocessing.py check sample_images/*.jpg
+"""
+import argparse
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+_worker_preprocessor = None
+
+
+def decode(source, draft_size=None):
+    """Decodifica um arquivo (caminho, bytes ou file-like) em RGB.
+
+    Retorna (imagem, formato, tamanho original); com draft_size, JPEGs são
+    decodificados reduzidos, mantendo os dois lados >= draft_size.
+    """
+    from PIL import Image
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    img_format, img_size = img.format, img.size
+    if draft_size and img_format == "JPEG":
+        img.draft("RGB", (draft_size, draft_size))
+    img.load()
+    return img.convert("RGB"), img_format, img_size
+
+
+class FastPreprocessor:
+    """Substituto do preprocess do CLIP (chamável com uma imagem PIL RGB, retorna tensor CHW)"""
+
+    def __init__(self, n_px=224, mean=(0.48145466, 0.4578275, 0.40821073),
+                 std=(0.26862954, 0.26130258, 0.27577711), draft_factor=2, workers=0):
+        self.n_px = int(n_px)
+        self.mean = tuple(float(m) for m in mean)
+        self.std = tuple(float(s) for s in std)
+        self.draft_factor = draft_factor
+        self.workers = int(workers)
+        # (x / 255 - mean) / std  ==  x * scale + offset
+        std_array = np.array(self.std, dtype=np.float32)
+        self._scale = (1.0 / (255.0 * std_array)).astype(np.float32)
+        self._offset = (-np.array(self.mean, dtype=np.float32) / std_array).astype(np.float32)
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_transform(cls, transform, **kwargs):
+        """Lê resolução, média e desvio do Compose do CLIP (ValueError se não reconhecer)"""
+        from PIL import Image
+        steps = {type(step).__name__: step for step in getattr(transform, 'transforms', [])}
+        resize, crop, normalize = steps.get('Resize'), steps.get('CenterCrop'), steps.get('Normalize')
+        if resize is None or crop is None or normalize is None or 'ToTensor' not in steps:
+            raise ValueError(f"preprocess não reconhecido: {transform}")
+        size = resize.size if isinstance(resize.size, int) else resize.size[0]
+        crop_size = crop.size if isinstance(crop.size, int) else crop.size[0]
+        interpolation = getattr(resize.interpolation, 'value', resize.interpolation)
+        if size != crop_size or interpolation not in ("bicubic", Image.BICUBIC):
+            raise ValueError(f"preprocess não reconhecido: {transform}")
+        return cls(size, normalize.mean, normalize.std, **kwargs)
+
+    @classmethod
+    def from_env(cls, transform):
+        """PREPROCESS_BACKEND=fast|torchvision, PREPROCESS_DRAFT_FACTOR, PREPROCESS_WORKERS.
+
+        Retorna None (usar o preprocess original) com torchvision ou se o
+        preprocess não for o do CLIP.
+        """
+        if os.environ.get('PREPROCESS_BACKEND', 'fast').lower() != 'fast':
+            return None
+        try:
+            return cls.from_transform(
+                transform,
+                draft_factor=float(os.environ.get('PREPROCESS_DRAFT_FACTOR', 2)),
+                workers=int(os.environ.get('PREPROCESS_WORKERS', 0)),
+            )
+        except ValueError as e:
+            print(f"⚠️ Pré-processamento rápido indisponível: {e}")
+            return None
+
+    @property
+    def draft_size(self):
+        """Menor lado pedido ao decodificador de JPEG (None = resolução cheia)"""
+        return int(self.n_px * self.draft_factor) if self.draft_factor else None
+
+    def crop_box(self, width, height):
+        """Região da imagem que o Resize + CenterCrop do torchvision mantém"""
+        n_px = self.n_px
+        # Resize(n_px): lado menor vira n_px, o maior é truncado como no torchvision
+        if width <= height:
+            new_width, new_height = n_px, int(n_px * height / width)
+        else:
+            new_width, new_height = int(n_px * width / height), n_px
+        top = int(round((new_height - n_px) / 2.0))
+        left = int(round((new_width - n_px) / 2.0))
+        scale_x, scale_y = width / new_width, height / new_height
+        return (left * scale_x, top * scale_y, (left + n_px) * scale_x, (top + n_px) * scale_y)
+
+    def array(self, img):
+        """Imagem PIL RGB -> float32 (3, n_px, n_px) normalizado"""
+        from PIL import Image
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        small = img.resize((self.n_px, self.n_px), Image.BICUBIC, box=self.crop_box(*img.size))
+        pixels = np.asarray(small, dtype=np.float32)
+        return np.ascontiguousarray((pixels * self._scale + self._offset).transpose(2, 0, 1))
+
+    def __call__(self, img):
+        import torch
+        return torch.from_numpy(self.array(img))
+
+    def _ensure_pool(self):
+        # Criado no primeiro lote (e recriado após um fork do gunicorn)
+        if self._pool is not None and self._pool_pid == os.getpid():
+            return self._pool
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                import multiprocessing
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker, initargs=(self.n_px, self.mean, self.std),
+                )
+                self._pool_pid = os.getpid()
+        return self._pool
+
+    def batch(self, images):
+        """Lote de imagens PIL RGB -> tensor (N, 3, n_px, n_px), no pool se configurado"""
+        import torch
+        if self.workers > 0 and len(images) > 1:
+            chunksize = max(1, len(images) // (self.workers * 2))
+            arrays = list(self._ensure_pool().map(_worker_array, images, chunksize=chunksize))
+        else:
+            arrays = [self.array(img) for img in images]
+        return torch.from_numpy(np.stack(arrays))
+
+    def close(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {
+            'backend': 'fast',
+            'input_resolution': self.n_px,
+            'draft_size': self.draft_size,
+            'workers': self.workers,
+        }
+
+
+def _init_worker(n_px, mean, std):
+    global _worker_preprocessor
+    _worker_preprocessor = FastPreprocessor(n_px, mean, std, draft_factor=0)
+
+
+def _worker_array(img):
+    return _worker_preprocessor.array(img)
+
+
+def compare(paths, n_px=224, draft_factor=2):
+    """Diferença entre o preprocess do CLIP (decodificação completa) e o rápido, por imagem"""
+    from clip.clip import _transform
+    reference_transform = _transform(n_px)
+    fast = FastPreprocessor.from_transform(reference_transform, draft_factor=draft_factor)
+    rows = []
+    for path in paths:
+        full, _, _ = decode(path)
+        reference = reference_transform(full).numpy()
+        img, _, _ = decode(path, fast.draft_size)
+        candidate = fast.array(img)
+        diff = np.abs(candidate - reference)
+        rows.append({'path': path, 'max_abs': float(diff.max()), 'mean_abs': float(diff.mean()),
+                     'decoded_size': img.size, 'original_size': full.size})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pré-processamento rápido das consultas")
+    parser.add_argument("command", choices=("check",))
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--n-px", type=int, default=224)
+    parser.add_argument("--draft-factor", type=float, default=float(os.environ.get('PREPROCESS_DRAFT_FACTOR', 2)))
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Máximo aceito para o erro absoluto médio")
+    args = parser.parse_args(argv)
+
+    rows = compare(args.images, args.n_px, args.draft_factor)
+    for row in rows:
+        print(f"{row['path']}: média {row['mean_abs']:.5f}, máximo {row['max_abs']:.4f} "
+              f"({row['original_size'][0]}x{row['original_size'][1]} -> "
+              f"{row['decoded_size'][0]}x{row['decoded_size'][1]})")
+    worst = max(row['mean_abs'] for row in rows)
+    if worst > args.tolerance:
+        print(f"❌ Erro médio {worst:.5f} acima da tolerância {args.tolerance}")
+        return 1
+    print(f"✅ Erro médio máximo {worst:.5f} (tolerância {args.tolerance})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+# retention.py
+"""
+Retenção do histórico: apaga uploads antigos (registros, resultados e
+arquivos) segundo políticas configuráveis.
+
+    RETENTION_MAX_UPLOADS      mantém só os N uploads mais recentes (0 desliga)
+    RETENTION_MAX_AGE_DAYS     apaga uploads mais antigos que N dias (0 desliga)
+    RETENTION_MAX_DISK_MB      apaga os mais antigos até uploads/ caber na cota (0 desliga)
+    RETENTION_INTERVAL_SECONDS intervalo da execução em background (0 desliga)
+
+Tudo desligado por padrão: nada é apagado (nem os arquivos órfãos) sem uma
+política definida explicitamente, e a execução em background só roda com
+RETENTION_INTERVAL_SECONDS > 0 e ao menos uma política. O /clear_history,
+pedido explícito do operador, sem política configurada mantém os últimos
+CLEAR_HISTORY_KEEP uploads (padrão 50, o comportamento original da rota).
+
+Cada passo apaga um lote limitado (RETENTION_CHUNK_SIZE) com DELETEs por
+conjunto de ids e faz commit, então a trava de escrita do SQLite nunca fica
+presa por muito tempo. Os arquivos são removidos depois do commit, junto com
+os arquivos órfãos (sem registro no banco) mais antigos que ORPHAN_GRACE_SECONDS.
+A cota de disco apaga só os uploads mais antigos cuja soma de file_size
+(soma acumulada por função de janela) cobre o excesso.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+# Arquivos mais novos podem ter o registro ainda na fila do history_writer
+ORPHAN_GRACE_SECONDS = 600
+
+
+class RetentionJob:
+    def __init__(self, app, upload_folder="uploads", max_uploads=0, max_age_days=0, max_disk_mb=0,
+                 chunk_size=500, interval=0.0):
+        self.app = app
+        self.upload_folder = upload_folder
+        self.max_uploads = int(max_uploads)
+        self.max_age_days = float(max_age_days)
+        self.max_disk_bytes = int(float(max_disk_mb) * 1024 * 1024)
+        self.chunk_size = max(1, int(chunk_size))
+        self.interval = float(interval)
+        self.last_report = None
+        self._run_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    @classmethod
+    def from_env(cls, app, upload_folder="uploads"):
+        return cls(
+            app,
+            upload_folder=upload_folder,
+            max_uploads=int(os.environ.get('RETENTION_MAX_UPLOADS', 0)),
+            max_age_days=float(os.environ.get('RETENTION_MAX_AGE_DAYS', 0)),
+            max_disk_mb=float(os.environ.get('RETENTION_MAX_DISK_MB', 0)),
+            chunk_size=int(os.environ.get('RETENTION_CHUNK_SIZE', 500)),
+            interval=float(os.environ.get('RETENTION_INTERVAL_SECONDS', 0)),
+        )
+
+    @property
+    def enabled(self):
+        """Alguma política definida (sem nenhuma, a retenção não apaga nada)"""
+        return self.max_uploads > 0 or self.max_age_days > 0 or self.max_disk_bytes > 0
+
+    def policies(self):
+        return {
+            'max_uploads': self.max_uploads,
+            'max_age_days': self.max_age_days,
+            'max_disk_mb': round(self.max_disk_bytes / 1024 / 1024, 1),
+        }
+
+    def _delete_chunk(self, condition, report):
+        """Apaga o lote mais antigo que satisfaz a condição; retorna as linhas apagadas (ou None)"""
+        from database import db, UploadedImage
+
+        rows = (
+            db.session.query(UploadedImage.id, UploadedImage.filename)
+            .filter(condition)
+            .order_by(UploadedImage.upload_date, UploadedImage.id)
+            .limit(self.chunk_size)
+            .all()
+        )
+        return self._delete_rows(rows, report)
+
+    def _delete_rows(self, rows, report):
+        """Apaga os registros (e resultados) das linhas selecionadas; retorna as linhas ou None"""
+        from database import db, UploadedImage, SearchResult
+
+        if not rows:
+            return None
+
+        ids = [row.id for row in rows]
+        report['results_deleted'] += (
+            SearchResult.query.filter(SearchResult.uploaded_image_id.in_(ids)).delete(synchronize_session=False)
+        )
+        report['uploads_deleted'] += (
+            UploadedImage.query.filter(UploadedImage.id.in_(ids)).delete(synchronize_session=False)
+        )
+        db.session.commit()
+        return rows
+
+    def _remove_files(self, filenames, report):
+        for filename in filenames:
+            path = os.path.join(self.upload_folder, filename)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            report['files_deleted'] += 1
+            report['bytes_reclaimed'] += size
+
+    def _purge(self, condition, report):
+        while True:
+            rows = self._delete_chunk(condition, report)
+            if not rows:
+                return
+            self._remove_files([row.filename for row in rows], report)
+            if len(rows) < self.chunk_size:
+                return
+
+    def _count_cutoff(self, max_uploads):
+        """(upload_date, id) do N-ésimo upload mais recente, ou None se há menos que N"""
+        from database import db, UploadedImage
+
+        return (
+            db.session.query(UploadedImage.upload_date, UploadedImage.id)
+            .order_by(UploadedImage.upload_date.desc(), UploadedImage.id.desc())
+            .offset(max_uploads - 1)
+            .limit(1)
+            .first()
+        )
+
+    def _disk_usage(self):
+        total = 0
+        try:
+            with os.scandir(self.upload_folder) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        total += entry.stat().st_size
+        except OSError:
+            pass
+        return total
+
+    def _quota_rows(self, excess):
+        """Os uploads mais antigos cuja soma de file_size cobre excess bytes (no máximo chunk_size)"""
+        from sqlalchemy import func
+        from database import db, UploadedImage
+
+        size = func.coalesce(UploadedImage.file_size, 0)
+        # Total acumulado do mais antigo até cada upload (inclusive)
+        oldest = (
+            db.session.query(
+                UploadedImage.id, UploadedImage.filename, UploadedImage.upload_date,
+                func.sum(size).over(order_by=(UploadedImage.upload_date, UploadedImage.id)).label('cumulative'),
+                size.label('size'),
+            )
+            .subquery()
+        )
+        # Entra todo upload que começa antes de o acumulado anterior cobrir o excesso
+        return (
+            db.session.query(oldest.c.id, oldest.c.filename)
+            .filter(oldest.c.cumulative - oldest.c.size < excess)
+            .order_by(oldest.c.upload_date, oldest.c.id)
+            .limit(self.chunk_size)
+            .all()
+        )
+
+    def _enforce_quota(self, report):
+        """Apaga só os uploads mais antigos necessários para o diretório caber na cota"""
+        usage = self._disk_usage()
+        while usage > self.max_disk_bytes:
+            rows = self._delete_rows(self._quota_rows(usage - self.max_disk_bytes), report)
+            if not rows:
+                return
+            self._remove_files([row.filename for row in rows], report)
+            # Medido de novo: file_size pode faltar ou divergir do arquivo em disco
+            usage = self._disk_usage()
+
+    def _remove_orphans(self, report):
+        """Arquivos em uploads/ sem registro no banco (consultados em lotes pelo índice)"""
+        from database import db, UploadedImage
+
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        try:
+            with os.scandir(self.upload_folder) as entries:
+                candidates = [e.name for e in entries
+                              if e.is_file() and not e.name.startswith('.') and e.stat().st_mtime < cutoff]
+        except OSError:
+            return
+
+        orphans = []
+        for start in range(0, len(candidates), self.chunk_size):
+            chunk = candidates[start:start + self.chunk_size]
+            known = {
+                row.filename for row in
+                db.session.query(UploadedImage.filename).filter(UploadedImage.filename.in_(chunk))
+            }
+            orphans.extend(name for name in chunk if name not in known)
+        before = report['files_deleted']
+        self._remove_files(orphans, report)
+        report['orphan_files'] += report['files_deleted'] - before
+
+    def run(self, max_uploads=None):
+        """Aplica todas as políticas e retorna o relatório do que foi recuperado.
+
+        max_uploads substitui RETENTION_MAX_UPLOADS só nesta execução (usado pelo
+        /clear_history quando nenhuma política está configurada).
+        """
+        from sqlalchemy import tuple_
+        from database import db, UploadedImage
+
+        report = {
+            'uploads_deleted': 0, 'results_deleted': 0, 'files_deleted': 0,
+            'orphan_files': 0, 'bytes_reclaimed': 0, 'skipped': False,
+        }
+        max_uploads = self.max_uploads if max_uploads is None else int(max_uploads)
+        if not (self.enabled or max_uploads > 0):
+            report['skipped'] = True
+            return report
+        start = time.time()
+        with self._run_lock, _ProcessLock(os.path.join(self.upload_folder, '.retention.lock')) as acquired:
+            if not acquired:
+                # Outro worker já está aplicando a retenção
+                report['skipped'] = True
+                return report
+
+            with self.app.app_context():
+                try:
+                    if self.max_age_days > 0:
+                        cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+                        self._purge(UploadedImage.upload_date < cutoff, report)
+
+                    if max_uploads > 0:
+                        newest_kept = self._count_cutoff(max_uploads)
+                        if newest_kept is not None:
+                            self._purge(tuple_(UploadedImage.upload_date, UploadedImage.id) < tuple_(*newest_kept),
+                                        report)
+
+                    self._remove_orphans(report)
+
+                    if self.max_disk_bytes > 0:
+                        self._enforce_quota(report)
+
+                    # Devolve ao arquivo principal as páginas do WAL (o espaço liberado é reutilizado)
+                    db.session.execute(db.text("PRAGMA wal_checkpoint(TRUNCATE)"))
+                finally:
+                    db.session.remove()
+
+        report['seconds'] = round(time.time() - start, 3)
+        report['policies'] = self.policies()
+        self.last_report = report
+        if report['uploads_deleted'] or report['files_deleted']:
+            print(f"🧹 Retenção: {report['uploads_deleted']} uploads, {report['results_deleted']} resultados, "
+                  f"{report['files_deleted']} arquivos ({report['bytes_reclaimed'] / 1024 / 1024:.1f} MB) "
+                  f"em {report['seconds']}s")
+        return report
+
+    def _loop(self):
+        stop = self._stop
+        while not stop.wait(self.interval):
+            try:
+                self.run()
+            except Exception as e:
+                print(f"⚠️ Erro na retenção do histórico: {e}")
+
+    def start(self):
+        """Inicia a execução periódica (uma thread por processo)"""
+        if self.interval <= 0 or not self.enabled or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._stop = threading.Event()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name="retention", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self._stop.set()
+
+
+class _ProcessLock:
+    """Trava não bloqueante entre processos (fcntl); sempre adquirida sem fcntl"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return True
+        self._file = open(self.path, 'a')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
@@ -0,0 +1,296 @@
+# sharding.py
+"""
+Índice particionado em shards com busca scatter-gather.
+
+A matriz de embeddings é dividida em N faixas contíguas de linhas (a faixa de
+cada shard depende só de N e do total de vetores). Cada shard roda em seu
+próprio processo, local ou em outra máquina, e responde buscas por
+multiprocessing.connection. O coordenador envia a consulta a todos os shards
+em paralelo, converte os ids locais em globais e junta os top-k parciais
+ordenando por (distância, id global); com o backend flat o resultado é o
+mesmo da busca em um índice único.
+
+Shards locais (processos filhos iniciados pelo app):
+    INDEX_SHARDS=4
+
+Shards remotos (um processo por nó, mesma pasta de embeddings em cada um):
+    SHARD_AUTHKEY=segredo python sharding.py serve --shard 0 --shards 2 --port 6000
+    SHARD_AUTHKEY=segredo python sharding.py serve --shard 1 --shards 2 --port 6000
+    SHARD_ADDRESSES=no1:6000,no2:6000 SHARD_AUTHKEY=segredo gunicorn ...
+"""
+import argparse
+import atexit
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+READY_PREFIX = "SHARD_READY"
+
+
+def shard_ranges(n, num_shards):
+    """Faixas [início, fim) contíguas e determinísticas para n vetores em num_shards"""
+    num_shards = max(1, min(int(num_shards), max(n, 1)))
+    bounds = [n * i // num_shards for i in range(num_shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def merge_topk(distances, indices, k):
+    """Junta os top-k parciais (colunas concatenadas dos shards) em um top-k global.
+
+    Ordena cada linha por (distância, id) de forma estável; ids -1 (shard com
+    menos de k vetores) vão para o fim.
+    """
+    distances = np.asarray(distances, dtype="float32")
+    indices = np.asarray(indices, dtype="int64")
+    missing = indices < 0
+    sort_distances = np.where(missing, np.inf, distances)
+    sort_ids = np.where(missing, np.iinfo(np.int64).max, indices)
+
+    order = np.lexsort((sort_ids, sort_distances), axis=1)[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+def _load_vectors(embeddings_path):
+    from embedding_store import EmbeddingStore
+    store = EmbeddingStore.open(embeddings_path)
+    if store is not None:
+        return store.vectors
+    return np.load(os.path.join(embeddings_path, "embeddings.npy"), mmap_mode="r")
+
+
+class ShardServer:
+    """Um shard: a faixa de linhas dele em um índice próprio, atendendo conexões"""
+
+    def __init__(self, embeddings_path, shard_id, num_shards, index_config=None):
+        import vector_index
+
+        vectors = _load_vectors(embeddings_path)
+        self.shard_id = int(shard_id)
+        self.num_shards = int(num_shards)
+        self.start, self.end = shard_ranges(len(vectors), num_shards)[self.shard_id]
+        config = dict(index_config or vector_index.index_config_from_env())
+        backend = config.pop('backend', 'flat')
+        metric = config.pop('metric', 'l2')
+        rows = np.ascontiguousarray(vectors[self.start:self.end], dtype="float32")
+        self.index, self.meta = vector_index.build_index(rows, backend, metric, **config)
+
+    def info(self):
+        return {
+            'shard': self.shard_id,
+            'shards': self.num_shards,
+            'start': self.start,
+            'end': self.end,
+            'backend': self.meta['backend'],
+            'metric': self.meta['metric'],
+            'factory': self.meta['factory'],
+            'ntotal': int(self.index.ntotal),
+        }
+
+    def search(self, queries, k, nprobe=None, ef_search=None):
+        import vector_index
+        distances, indices = vector_index.search_index(
+            self.index, self.meta, queries, k, nprobe=nprobe, ef_search=ef_search
+        )
+        # Ids locais -> globais (o -1 de "sem resultado" continua -1)
+        indices = np.where(indices >= 0, indices + self.start, -1)
+        return distances, indices
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if request[0] == "search":
+                        _, queries, k, nprobe, ef_search = request
+                        conn.send(("ok", self.search(queries, k, nprobe, ef_search)))
+                    elif request[0] == "info":
+                        conn.send(("ok", self.info()))
+                    else:
+                        conn.send(("error", f"Comando desconhecido: {request[0]}"))
+                except Exception as e:
+                    conn.send(("error", str(e)))
+
+    def serve(self, address, authkey):
+        with Listener(address, authkey=authkey) as listener:
+            host, port = listener.address
+            print(f"{READY_PREFIX} {host}:{port}", flush=True)
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"⚠️ Conexão recusada no shard {self.shard_id}: {e}", file=sys.stderr)
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+
+def _parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class ShardedIndex:
+    """Coordenador: fan-out das consultas e merge exato dos top-k parciais"""
+
+    def __init__(self, addresses, authkey, processes=None):
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.processes = processes or []
+        self._owner_pid = os.getpid()
+        self._pools = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.shards = [self._request(i, ("info",)) for i in range(len(self.addresses))]
+        self.ntotal = sum(shard['ntotal'] for shard in self.shards)
+        self.meta = {
+            'backend': self.shards[0]['backend'],
+            'metric': self.shards[0]['metric'],
+            'factory': f"{len(self.shards)}x{self.shards[0]['factory']}",
+            'sharded': True,
+            'shards': len(self.shards),
+            'ntotal': self.ntotal,
+        }
+
+    @classmethod
+    def start_local(cls, embeddings_path, num_shards, index_config=None):
+        """Inicia num_shards processos locais (um por faixa) e conecta a eles"""
+        authkey = secrets.token_hex(16)
+        env = dict(os.environ, SHARD_AUTHKEY=authkey)
+        if index_config:
+            for key, value in index_config.items():
+                env[f"INDEX_{key.upper()}"] = str(value)
+        script = os.path.abspath(__file__)
+        processes = []
+        for shard_id in range(num_shards):
+            processes.append(subprocess.Popen(
+                [sys.executable, script, "serve", "--embeddings", embeddings_path,
+                 "--shard", str(shard_id), "--shards", str(num_shards), "--host", "127.0.0.1", "--port", "0"],
+                stdout=subprocess.PIPE, env=env, text=True,
+            ))
+        atexit.register(_stop_processes, processes, os.getpid())
+
+        addresses = []
+        for shard_id, process in enumerate(processes):
+            # O shard escreve o endereço quando o índice dele está pronto
+            line = process.stdout.readline()
+            while line and not line.startswith(READY_PREFIX):
+                line = process.stdout.readline()
+            if not line:
+                _stop_processes(processes, os.getpid())
+                raise RuntimeError(f"Shard {shard_id} não iniciou (código {process.poll()})")
+            addresses.append(line.split()[1])
+        return cls(addresses, authkey.encode(), processes)
+
+    @classmethod
+    def from_env(cls, embeddings_path, index_config=None):
+        """ShardedIndex conforme SHARD_ADDRESSES / INDEX_SHARDS, ou None se desligado"""
+        addresses = [a.strip() for a in os.environ.get('SHARD_ADDRESSES', '').split(',') if a.strip()]
+        if addresses:
+            authkey = os.environ.get('SHARD_AUTHKEY')
+            if not authkey:
+                raise RuntimeError("SHARD_AUTHKEY é obrigatório com SHARD_ADDRESSES")
+            return cls(addresses, authkey.encode())
+        num_shards = int(os.environ.get('INDEX_SHARDS', 0))
+        if num_shards > 1:
+            return cls.start_local(embeddings_path, num_shards, index_config)
+        return None
+
+    def _ensure_pools(self):
+        # Conexões não podem ser compartilhadas entre processos: recriadas após o fork
+        if self._pools is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pools is None or self._pid != os.getpid():
+                self._pools = [queue.LifoQueue() for _ in self.addresses]
+                self._executor = ThreadPoolExecutor(max_workers=len(self.addresses), thread_name_prefix="shard")
+                self._pid = os.getpid()
+
+    def _request(self, shard, message):
+        self._ensure_pools()
+        pool = self._pools[shard]
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = Client(_parse_address(self.addresses[shard]), authkey=self.authkey)
+        try:
+            conn.send(message)
+            status, payload = conn.recv()
+        except Exception:
+            conn.close()
+            raise
+        pool.put(conn)
+        if status != "ok":
+            raise RuntimeError(f"Shard {shard} ({self.addresses[shard]}): {payload}")
+        return payload
+
+    def search(self, queries, k, nprobe=None, ef_search=None):
+        """Busca em todos os shards em paralelo e retorna o top-k global (ids globais)"""
+        self._ensure_pools()
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        futures = [
+            self._executor.submit(self._request, shard, ("search", queries, k, nprobe, ef_search))
+            for shard in range(len(self.addresses))
+        ]
+        partial = [future.result() for future in futures]
+        distances = np.concatenate([d for d, _ in partial], axis=1)
+        indices = np.concatenate([i for _, i in partial], axis=1)
+        return merge_topk(distances, indices, k)
+
+    def stats(self):
+        return {'shards': self.shards, 'addresses': self.addresses, 'local': bool(self.processes)}
+
+    def close(self):
+        _stop_processes(self.processes, self._owner_pid)
+
+
+def _stop_processes(processes, owner_pid):
+    # Só o processo que iniciou os shards os encerra (não os workers após o fork)
+    if os.getpid() != owner_pid:
+        return
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shards do índice de embeddings")
+    parser.add_argument("command", choices=("serve",))
+    parser.add_argument("--embeddings", default="embeddings")
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=6000)
+    args = parser.parse_args(argv)
+
+    authkey = os.environ.get('SHARD_AUTHKEY')
+    if not authkey:
+        print("❌ Defina SHARD_AUTHKEY", file=sys.stderr)
+        return 1
+    try:
+        server = ShardServer(args.embeddings, args.shard, args.shards)
+    except Exception as e:
+        print(f"❌ Erro ao iniciar shard {args.shard}: {e}", file=sys.stderr)
+        return 1
+    info = server.info()
+    print(f"✅ Shard {info['shard']}/{info['shards']}: vetores [{info['start']}, {info['end']})", file=sys.stderr)
+    server.serve((args.host, args.port), authkey.encode())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# snapshots.py
+"""
+Versões do catálogo de referência para atualizações sem reiniciar o app.
+
+Cada versão é uma pasta imutável com um store completo (embedding_store) e o
+índice correspondente:
+
+    embeddings/versions/v000002/{store.json, vectors.bin, paths.*, meta_*, index.*, knn*}
+    embeddings/CURRENT              nome da versão ativa (trocado com os.replace)
+
+A versão nova é gravada inteira em uma pasta temporária e renomeada; só então
+CURRENT passa a apontar para ela, então quem lê CURRENT sempre encontra uma
+versão completa. Cada worker confere CURRENT periodicamente (VersionWatcher)
+e troca seu estado quando a versão muda. Sem CURRENT, vale o layout antigo
+direto em embeddings/.
+"""
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+LOCK_FILE = ".snapshots.lock"
+
+_VERSION_PATTERN = re.compile(r"^v(\d{6,})$")
+
+
+def current_version(embeddings_path):
+    """Nome da versão ativa, ou None se o catálogo não é versionado"""
+    try:
+        with open(os.path.join(embeddings_path, CURRENT_FILE), encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    return version or None
+
+
+def version_path(embeddings_path, version):
+    """Pasta com os dados da versão (a própria pasta de embeddings se version for None)"""
+    if version is None:
+        return embeddings_path
+    return os.path.join(embeddings_path, VERSIONS_DIR, version)
+
+
+def list_versions(embeddings_path):
+    try:
+        names = os.listdir(os.path.join(embeddings_path, VERSIONS_DIR))
+    except OSError:
+        return []
+    return sorted(name for name in names if _VERSION_PATTERN.match(name))
+
+
+def _next_version(embeddings_path):
+    versions = list_versions(embeddings_path)
+    number = int(_VERSION_PATTERN.match(versions[-1]).group(1)) + 1 if versions else 1
+    return f"v{number:06d}"
+
+
+@contextmanager
+def update_lock(embeddings_path):
+    """Serializa atualizações entre threads e workers (uma versão nova por vez)"""
+    os.makedirs(embeddings_path, exist_ok=True)
+    with _thread_lock, open(os.path.join(embeddings_path, LOCK_FILE), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_thread_lock = threading.Lock()
+
+
+def publish(embeddings_path, vectors, paths, metadata, dtype, index=None, index_meta=None, knn_graph=None,
+            keep=3):
+    """Grava uma versão nova completa e a torna a ativa; retorna o nome dela"""
+    from embedding_store import EmbeddingStore
+
+    version = _next_version(embeddings_path)
+    final_path = version_path(embeddings_path, version)
+    tmp_path = os.path.join(embeddings_path, VERSIONS_DIR, f".tmp-{version}-{os.getpid()}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+
+    EmbeddingStore.write(tmp_path, vectors, paths, metadata, dtype=dtype)
+    if index is not None:
+        import vector_index
+        vector_index.save_index(index, index_meta, tmp_path)
+    if knn_graph is not None:
+        knn_graph.save(tmp_path)
+    os.rename(tmp_path, final_path)
+
+    current_file = os.path.join(embeddings_path, CURRENT_FILE)
+    with open(f"{current_file}.tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(f"{current_file}.tmp", current_file)
+
+    prune(embeddings_path, keep)
+    return version
+
+
+def prune(embeddings_path, keep=3):
+    """Apaga as versões mais antigas (workers ainda nelas seguem lendo pelo mmap)"""
+    active = current_version(embeddings_path)
+    for version in list_versions(embeddings_path)[:-keep or None]:
+        if version != active:
+            shutil.rmtree(version_path(embeddings_path, version), ignore_errors=True)
+
+
+class VersionWatcher:
+    """Confere CURRENT a cada interval segundos e chama on_change(versão) quando muda"""
+
+    def __init__(self, embeddings_path, on_change, interval=5.0):
+        self.embeddings_path = embeddings_path
+        self.on_change = on_change
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _watch(self):
+        stop = self._stop
+        while not stop.wait(self.interval):
+            try:
+                self.on_change(current_version(self.embeddings_path))
+            except Exception as e:
+                print(f"⚠️ Erro ao carregar versão do catálogo: {e}")
+
+    def ensure_started(self):
+        # Criada no primeiro uso para sobreviver ao fork dos workers do gunicorn
+        if self.interval <= 0 or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._stop = threading.Event()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._watch, name="version-watcher", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self._stop.set()
@@ -91,32 +91,15 @@ async function searchSimilar() {
     // Criar FormData
     const formData = new FormData();
     formData.append('file', currentFile);
+    formData.append('k', 5);
     
     try {
-        // Fazer upload
-        const uploadResponse = await fetch('/upload', {
+        // Upload e busca em uma única requisição
+        const searchResponse = await fetch('/upload_search', {
             method: 'POST',
             body: formData
         });
         
-        const uploadData = await uploadResponse.json();
-        
-        if (!uploadData.success) {
-            throw new Error(uploadData.error || 'Erro no upload');
-        }
-        
-        // Buscar imagens similares
-        const searchResponse = await fetch('/search', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                filename: uploadData.filename,
-                k: 5
-            })
-        });
-        
         const searchData = await searchResponse.json();
         
         if (!searchData.success) {
@@ -134,6 +117,28 @@ async function searchSimilar() {
     }
 }
 
+// Mais como esta: vizinhos de uma imagem do catálogo
+async function showSimilar(catalogId) {
+    loading.style.display = 'block';
+    
+    try {
+        const response = await fetch(`/similar/${catalogId}?k=5`);
+        const data = await response.json();
+        
+        if (!data.success) {
+            throw new Error(data.error || 'Erro na busca');
+        }
+        
+        displayResults(data.results);
+        
+    } catch (error) {
+        console.error('Erro:', error);
+        alert(`Erro: ${error.message}`);
+    } finally {
+        loading.style.display = 'none';
+    }
+}
+
 // Exibir resultados
 function displayResults(results) {
     resultsGrid.innerHTML = '';
@@ -156,7 +161,7 @@ function displayResults(results) {
                 <div class="similarity-badge">
                     <i class="fas fa-percentage"></i> ${similarityPercent}%
                 </div>
-                <img src="${result.path}" 
+                <img src="${result.thumbnail_url || result.url}" loading="lazy"
                      alt="Imagem similar" 
                      onerror="this.src='https://via.placeholder.com/300x200?text=Imagem+não+encontrada'">
                 <div class="result-info">
@@ -165,6 +170,13 @@ function displayResults(results) {
                 </div>
             `;
             
+            // Clique no card: imagens do catálogo parecidas com esta (grafo de vizinhos, sem nova busca)
+            if (result.id !== undefined) {
+                resultCard.style.cursor = 'pointer';
+                resultCard.title = 'Ver imagens similares a esta';
+                resultCard.addEventListener('click', () => showSimilar(result.id));
+            }
+            
             resultsGrid.appendChild(resultCard);
         });
     }
@@ -0,0 +1,68 @@
+# ExactIndex deve devolver o mesmo que o IndexFlatL2 do FAISS
+import numpy as np
+import pytest
+
+from exact_index import ExactIndex
+
+faiss = pytest.importorskip("faiss")
+
+
+def _flat_search(vectors, queries, k):
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index.search(queries, k)
+
+
+@pytest.mark.parametrize("block_size, threads", [(8192, 1), (64, 1), (64, 3)])
+def test_matches_faiss_flat(block_size, threads):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((500, 32)).astype("float32")
+    queries = rng.standard_normal((25, 32)).astype("float32")
+
+    expected_distances, expected_ids = _flat_search(vectors, queries, 10)
+    distances, ids = ExactIndex(vectors, block_size=block_size, threads=threads).search(queries, 10)
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-5, atol=1e-4)
+
+
+def test_ties_ordered_by_id_like_faiss():
+    # Coordenadas inteiras pequenas: muitas distâncias exatamente iguais
+    rng = np.random.default_rng(1)
+    vectors = rng.integers(0, 3, (300, 8)).astype("float32")
+    queries = rng.integers(0, 3, (20, 8)).astype("float32")
+
+    expected_distances, expected_ids = _flat_search(vectors, queries, 10)
+    distances, ids = ExactIndex(vectors, block_size=64, threads=2).search(queries, 10)
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_array_equal(distances, expected_distances)
+
+
+def test_k_larger_than_catalog_is_padded_like_faiss():
+    rng = np.random.default_rng(2)
+    vectors = rng.standard_normal((5, 16)).astype("float32")
+    queries = rng.standard_normal((3, 16)).astype("float32")
+
+    expected_distances, expected_ids = _flat_search(vectors, queries, 8)
+    distances, ids = ExactIndex(vectors).search(queries, 8)
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    assert (ids[:, 5:] == -1).all()
+    np.testing.assert_array_equal(distances[:, 5:], expected_distances[:, 5:])
+    np.testing.assert_allclose(distances[:, :5], expected_distances[:, :5], rtol=1e-5, atol=1e-4)
+
+
+def test_inner_product_matches_vector_index():
+    import vector_index
+
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((200, 16)).astype("float32")
+    queries = rng.standard_normal((10, 16)).astype("float32")
+
+    index, meta = vector_index.build_index(vectors, "flat", "ip")
+    expected_distances, expected_ids = vector_index.search_index(index, meta, queries, 5)
+    distances, ids = ExactIndex(vectors, metric="ip").search(queries, 5)
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-5, atol=1e-5)
@@ -0,0 +1,44 @@
+# Atualizações incrementais do grafo devem dar o mesmo que recalcular tudo
+import numpy as np
+
+from knn_graph import KnnGraph
+
+
+def _vectors(n, d=24, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, d)).astype("float32")
+
+
+def _assert_same_graph(graph, expected):
+    assert graph.ids.shape == expected.ids.shape
+    np.testing.assert_array_equal(graph.ids, expected.ids)
+    np.testing.assert_allclose(np.asarray(graph.distances, dtype="float32"),
+                               np.asarray(expected.distances, dtype="float32"), rtol=1e-3)
+
+
+def test_extend_matches_build():
+    vectors = _vectors(260)
+    graph = KnnGraph.build(vectors[:200], k=10).extend(vectors)
+    _assert_same_graph(graph, KnnGraph.build(vectors, k=10))
+
+
+def test_extend_small_catalog_rebuilds_with_full_k():
+    vectors = _vectors(40, seed=1)
+    # Catálogo de 5 imagens: só 4 vizinhos por linha antes de crescer
+    graph = KnnGraph.build(vectors[:5], k=10)
+    assert graph.k == 4
+    _assert_same_graph(graph.extend(vectors, k=10), KnnGraph.build(vectors, k=10))
+
+
+def test_remove_matches_build():
+    vectors = _vectors(300, seed=2)
+    removed = np.random.default_rng(3).choice(300, size=25, replace=False)
+    kept = np.delete(vectors, removed, axis=0)
+
+    graph = KnnGraph.build(vectors, k=10).remove(kept, removed)
+    _assert_same_graph(graph, KnnGraph.build(kept, k=10))
+
+
+def test_neighbors_clamps_k():
+    graph = KnnGraph.build(_vectors(30, seed=4), k=5)
+    assert len(graph.neighbors(0, k=50)[1]) == 5
+    assert len(graph.neighbors(0, k=-3)[1]) == 0
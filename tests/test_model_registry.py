@@ -0,0 +1,116 @@
+# parse_models e a LRU de modelos com um factory falso (sem CLIP)
+import pytest
+
+import metrics
+import model_registry
+from model_registry import ModelRegistry, parse_models
+
+MB = 1024 * 1024
+
+
+def test_parse_models():
+    specs = parse_models("triagem=ViT-B/32@emb_b32, preciso=ViT-L/14@emb_l14@onnx,local=RN50@", "embeddings")
+    assert specs == [
+        {'name': 'triagem', 'model_name': 'ViT-B/32', 'embeddings_path': 'emb_b32', 'encoder_backend': None},
+        {'name': 'preciso', 'model_name': 'ViT-L/14', 'embeddings_path': 'emb_l14', 'encoder_backend': 'onnx'},
+        {'name': 'local', 'model_name': 'RN50', 'embeddings_path': 'embeddings', 'encoder_backend': None},
+    ]
+
+
+@pytest.mark.parametrize("text", ["sem_modelo", "=ViT-B/32@emb", "a=ViT-B/32@x,a=RN50@y"])
+def test_parse_models_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        parse_models(text)
+
+
+class FakeClassifier:
+    def __init__(self, spec, memory):
+        self.spec = spec
+        self.memory = memory
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        self.memory.rss -= 100 * MB
+
+
+class FakeMemory:
+    """RSS simulado: cada modelo carregado ocupa 100 MB até ser fechado"""
+
+    def __init__(self):
+        self.rss = 50 * MB
+
+    def factory(self, spec):
+        self.rss += 100 * MB
+        return FakeClassifier(spec, self)
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    memory = FakeMemory()
+    monkeypatch.setattr(metrics, "resident_memory_bytes", lambda: memory.rss)
+    monkeypatch.setattr(model_registry, "_release_memory", lambda: None)
+    return memory
+
+
+def _registry(memory, budget_mb=280):
+    specs = parse_models("a=A@ea,b=B@eb,c=C@ec")
+    return ModelRegistry(specs, memory_budget_mb=budget_mb, factory=memory.factory)
+
+
+def test_evicts_least_recently_used_but_keeps_default(memory):
+    registry = _registry(memory)
+    a = registry.get()
+    b = registry.acquire("b")
+    registry.release(b)
+    assert registry.resident() == ["a", "b"]
+
+    c = registry.acquire("c")
+    registry.release(c)
+
+    # 50 + 3 x 100 MB passa de 280: sai o menos usado que não é o padrão
+    assert registry.resident() == ["a", "c"]
+    assert b.closed and not a.closed and not c.closed
+    assert registry.stats()['evictions'] == 1
+    assert registry.stats()['resident']['a']['memory_mb'] == 100
+
+
+def test_model_in_use_closed_on_last_release(memory):
+    registry = _registry(memory)
+    registry.get()
+    b = registry.acquire("b")
+    c = registry.acquire("c")
+
+    assert registry.resident() == ["a", "c"]
+    assert not b.closed
+    assert registry.stats()['draining'] == 1
+
+    registry.release(b)
+    assert b.closed
+    assert registry.stats()['draining'] == 0
+    registry.release(c)
+    assert not c.closed
+
+
+def test_reload_makes_room_with_measured_memory(memory):
+    registry = _registry(memory)
+    registry.get()
+    registry.release(registry.acquire("b"))
+    registry.release(registry.acquire("c"))
+    # b volta: a memória medida antes (100 MB) já descarrega c antes de carregar
+    registry.release(registry.acquire("b"))
+    assert registry.resident() == ["a", "b"]
+    assert memory.rss == 250 * MB
+    assert registry.loads == 4
+
+
+def test_unknown_model_and_factory_errors(memory):
+    def failing(spec):
+        raise OSError("checkpoint ausente")
+
+    registry = ModelRegistry(parse_models("a=A@ea,b=B@eb"), factory=failing)
+    with pytest.raises(KeyError):
+        registry.get("x")
+    with pytest.raises(RuntimeError):
+        registry.get("b")
+    assert "checkpoint ausente" in registry.stats()['errors']['b']
@@ -0,0 +1,74 @@
+# O pré-processamento rápido deve reproduzir o preprocess do CLIP (Resize + CenterCrop + Normalize)
+import io
+
+import numpy as np
+import pytest
+
+import preprocessing
+
+transforms = pytest.importorskip("torchvision.transforms")
+Image = pytest.importorskip("PIL.Image")
+
+MEAN = (0.48145466, 0.4578275, 0.40821073)
+STD = (0.26862954, 0.26130258, 0.27577711)
+# Um nível de 8 bits depois do Normalize: arredondamentos diferentes do Pillow no resize
+ONE_LEVEL = 1.0 / (255.0 * min(STD)) + 1e-4
+
+
+def _clip_transform(n_px=224):
+    # Mesmo Compose de clip.clip._transform (sem importar o CLIP)
+    return transforms.Compose([
+        transforms.Resize(n_px, interpolation=transforms.InterpolationMode.BICUBIC),
+        transforms.CenterCrop(n_px),
+        lambda img: img.convert("RGB"),
+        transforms.ToTensor(),
+        transforms.Normalize(MEAN, STD),
+    ])
+
+
+def _image(width, height, seed=0):
+    # Ruído suave (ampliado) para o resize bicúbico ter o que interpolar
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).resize((width, height), Image.BILINEAR)
+
+
+def test_from_transform_reads_clip_parameters():
+    fast = preprocessing.FastPreprocessor.from_transform(_clip_transform(336))
+    assert fast.n_px == 336
+    assert fast.mean == pytest.approx(MEAN)
+    assert fast.std == pytest.approx(STD)
+
+
+def test_from_transform_rejects_other_pipelines():
+    with pytest.raises(ValueError):
+        preprocessing.FastPreprocessor.from_transform(transforms.Compose([transforms.ToTensor()]))
+
+
+@pytest.mark.parametrize("size", [(640, 480), (480, 640), (224, 224), (300, 1000), (1001, 333), (100, 80)])
+def test_matches_clip_preprocess(size):
+    transform = _clip_transform()
+    fast = preprocessing.FastPreprocessor.from_transform(transform, draft_factor=0)
+    img = _image(*size)
+
+    candidate = fast.array(img)
+    reference = transform(img).numpy()
+
+    assert candidate.shape == reference.shape == (3, 224, 224)
+    diff = np.abs(candidate - reference)
+    assert diff.max() <= ONE_LEVEL
+    assert diff.mean() < 1e-4
+
+
+def test_jpeg_draft_keeps_min_side():
+    fast = preprocessing.FastPreprocessor(224, MEAN, STD, draft_factor=2)
+    buffer = io.BytesIO()
+    _image(2000, 1500).save(buffer, "JPEG", quality=95)
+
+    img, img_format, original_size = preprocessing.decode(buffer.getvalue(), fast.draft_size)
+
+    assert img_format == "JPEG"
+    assert original_size == (2000, 1500)
+    # Reduzido pela escala DCT, sem ficar abaixo do pedido
+    assert img.size == (1000, 750)
+    assert min(img.size) >= fast.draft_size
@@ -0,0 +1,109 @@
+# Aritmética da cota de disco e das políticas da retenção sobre um SQLite temporário
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from flask import Flask  # noqa: E402
+
+from database import db, UploadedImage, SearchResult  # noqa: E402
+from retention import RetentionJob  # noqa: E402
+
+FILE_SIZE = 1000
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'database.db'}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def uploads(app, tmp_path):
+    """100 uploads de 1000 bytes, um segundo de diferença entre eles (f0 é o mais antigo)"""
+    folder = tmp_path / "uploads"
+    folder.mkdir()
+    start = datetime(2020, 1, 1)
+    with app.app_context():
+        for i in range(100):
+            name = f"f{i}.jpg"
+            (folder / name).write_bytes(b"x" * FILE_SIZE)
+            image = UploadedImage(filename=name, original_filename=name, file_size=FILE_SIZE,
+                                  upload_date=start + timedelta(seconds=i))
+            db.session.add(image)
+            db.session.flush()
+            db.session.add(SearchResult(uploaded_image_id=image.id, similar_image_path="x.jpg",
+                                        similarity_score=0.5))
+        db.session.commit()
+    return str(folder)
+
+
+def _remaining(app):
+    with app.app_context():
+        return [row.filename for row in
+                db.session.query(UploadedImage.filename).order_by(UploadedImage.upload_date)]
+
+
+def _files(uploads):
+    # Sem o .retention.lock criado pela execução
+    return [name for name in os.listdir(uploads) if name.endswith(".jpg")]
+
+
+def _quota_job(app, uploads, quota_bytes, chunk_size=500):
+    return RetentionJob(app, upload_folder=uploads, max_disk_mb=quota_bytes / MB, chunk_size=chunk_size)
+
+
+@pytest.mark.parametrize("over, deleted", [(1, 1), (FILE_SIZE, 1), (FILE_SIZE + 1, 2), (30 * FILE_SIZE, 30)])
+def test_quota_deletes_only_the_oldest_needed(app, uploads, over, deleted):
+    report = _quota_job(app, uploads, 100 * FILE_SIZE - over).run()
+
+    assert report['uploads_deleted'] == deleted
+    assert report['results_deleted'] == deleted
+    assert report['files_deleted'] == deleted
+    assert report['bytes_reclaimed'] == deleted * FILE_SIZE
+    assert _remaining(app)[0] == f"f{deleted}.jpg"
+    assert len(_files(uploads)) == 100 - deleted
+
+
+def test_quota_across_chunks(app, uploads):
+    report = _quota_job(app, uploads, 35 * FILE_SIZE, chunk_size=10).run()
+    assert report['uploads_deleted'] == 65
+    assert _remaining(app)[0] == "f65.jpg"
+
+
+def test_quota_already_met_deletes_nothing(app, uploads):
+    report = _quota_job(app, uploads, 100 * FILE_SIZE).run()
+    assert report['uploads_deleted'] == 0
+    assert len(_remaining(app)) == 100
+
+
+def test_quota_uses_disk_size_when_file_size_missing(app, uploads):
+    with app.app_context():
+        UploadedImage.query.update({UploadedImage.file_size: None})
+        db.session.commit()
+    report = _quota_job(app, uploads, 90 * FILE_SIZE, chunk_size=4).run()
+    # Sem file_size cada lote apaga chunk_size uploads e a cota é medida de novo no disco
+    assert report['uploads_deleted'] == 12
+    assert len(_files(uploads)) <= 90
+
+
+def test_max_uploads_keeps_newest(app, uploads):
+    report = RetentionJob(app, upload_folder=uploads, max_uploads=40, chunk_size=7).run()
+    assert report['uploads_deleted'] == 60
+    remaining = _remaining(app)
+    assert len(remaining) == 40
+    assert remaining[0] == "f60.jpg"
+
+
+def test_no_policy_skips(app, uploads):
+    report = RetentionJob(app, upload_folder=uploads).run()
+    assert report['skipped']
+    assert len(_remaining(app)) == 100
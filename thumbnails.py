@@ -0,0 +1,161 @@
+# thumbnails.py
+"""
+Miniaturas derivadas (WebP, ou JPEG se o Pillow não tiver WebP) para as
+imagens de resultado, de exemplo e enviadas.
+
+As miniaturas são endereçadas pelo conteúdo: o nome do arquivo é o hash do
+original + tamanho, então o mesmo nome sempre tem os mesmos bytes e pode ser
+servido com ETag forte e Cache-Control imutável. São geradas sob demanda na
+primeira requisição ou antecipadamente no build do índice:
+
+    python thumbnails.py embeddings
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+MANIFEST_FILE = "manifest.json"
+
+
+class ThumbnailStore:
+    def __init__(self, folder="thumbnails", size=256, fmt=None, quality=80, digest_cache_size=10000):
+        from PIL import features
+        self.folder = folder
+        self.size = int(size)
+        self.format = (fmt or ("WEBP" if features.check("webp") else "JPEG")).upper()
+        self.quality = quality
+        # LRU (caminho, mtime, tamanho) -> hash do conteúdo
+        self.digest_cache_size = max(0, int(digest_cache_size))
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, folder="thumbnails"):
+        return cls(
+            folder=os.environ.get('THUMBNAIL_FOLDER', folder),
+            size=int(os.environ.get('THUMBNAIL_SIZE', 256)),
+            fmt=os.environ.get('THUMBNAIL_FORMAT') or None,
+            digest_cache_size=int(os.environ.get('THUMBNAIL_DIGEST_CACHE_SIZE', 10000)),
+        )
+
+    @property
+    def extension(self):
+        return "webp" if self.format == "WEBP" else "jpg"
+
+    @property
+    def mimetype(self):
+        return "image/webp" if self.format == "WEBP" else "image/jpeg"
+
+    def _digest(self, source_path):
+        """Hash do conteúdo do original, memorizado por (caminho, mtime, tamanho)"""
+        stat = os.stat(source_path)
+        key = (source_path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+                return digest
+        h = hashlib.sha1()
+        with open(source_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        with self._lock:
+            self._digests[key] = digest
+            while len(self._digests) > self.digest_cache_size:
+                self._digests.popitem(last=False)
+        return digest
+
+    def thumbnail_name(self, digest):
+        return f"{digest}_{self.size}.{self.extension}"
+
+    def ensure(self, source_path):
+        """Gera a miniatura se ainda não existir; retorna (nome do arquivo, etag)"""
+        digest = self._digest(source_path)
+        name = self.thumbnail_name(digest)
+        path = os.path.join(self.folder, name)
+        if not os.path.exists(path):
+            self._generate(source_path, path)
+        return name, name.rsplit(".", 1)[0]
+
+    def _generate(self, source_path, path):
+        from PIL import Image
+        with Image.open(source_path) as img:
+            # JPEG: decodifica já reduzido (draft) em vez da resolução cheia
+            img.draft("RGB", (self.size, self.size))
+            img = img.convert("RGB")
+            img.thumbnail((self.size, self.size))
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            img.save(tmp_path, self.format, quality=self.quality)
+        os.replace(tmp_path, path)
+
+    def generate_many(self, source_paths):
+        """Gera miniaturas para vários originais; retorna {original: nome da miniatura}"""
+        manifest = {}
+        for source_path in source_paths:
+            try:
+                manifest[source_path], _ = self.ensure(source_path)
+            except Exception as e:
+                print(f"⚠️ Miniatura não gerada para {source_path}: {e}")
+        return manifest
+
+    def save_manifest(self, manifest):
+        manifest_file = os.path.join(self.folder, MANIFEST_FILE)
+        with open(f"{manifest_file}.tmp", "w", encoding="utf-8") as f:
+            json.dump({'size': self.size, 'format': self.format, 'thumbnails': manifest}, f)
+        os.replace(f"{manifest_file}.tmp", manifest_file)
+
+    def load_manifest(self):
+        """Miniaturas geradas no build ({caminho de exibição: nome}), se compatíveis"""
+        manifest_file = os.path.join(self.folder, MANIFEST_FILE)
+        if not os.path.exists(manifest_file):
+            return {}
+        try:
+            with open(manifest_file, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('size') != self.size or manifest.get('format') != self.format:
+            return {}
+        return manifest.get('thumbnails', {})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera as miniaturas das imagens do catálogo")
+    parser.add_argument("embeddings_path", nargs="?", default="embeddings")
+    parser.add_argument("--sample-images", default="sample_images")
+    args = parser.parse_args(argv)
+
+    try:
+        import numpy as np
+        from catalog import ResultCatalog
+        import snapshots
+        from embedding_store import EmbeddingStore
+
+        data_path = snapshots.version_path(args.embeddings_path, snapshots.current_version(args.embeddings_path))
+        store = EmbeddingStore.open(data_path)
+        if store is not None:
+            paths = store.paths.tolist()
+        else:
+            paths = [str(p) for p in np.load(os.path.join(data_path, "image_paths.npy"), allow_pickle=True)]
+        catalog = ResultCatalog(paths, args.sample_images, refresh_interval=0)
+        sources = sorted({catalog.entry(i)[0] for i in range(len(catalog)) if catalog.entry(i)[0]})
+        sources += [s['full_path'] for s in catalog.sample_images() if s['full_path'] not in sources]
+
+        thumbnails = ThumbnailStore.from_env()
+        manifest = thumbnails.generate_many(sources)
+        thumbnails.save_manifest(manifest)
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return 1
+    print(f"✅ {len(manifest)} miniaturas em {thumbnails.folder}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
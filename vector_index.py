@@ -0,0 +1,244 @@
+# vector_index.py
+"""
+Backends de índice FAISS configuráveis (flat, ivf_flat, ivf_pq, hnsw) com
+persistência do índice treinado ao lado de embeddings.npy.
+
+As distâncias devolvidas são sempre L2 ao quadrado (como o IndexFlatL2
+original). Com a métrica "ip" os vetores são normalizados e o produto interno
+é convertido com ||a - b||² = 2 - 2·<a, b>, então o formato dos resultados não
+depende do backend escolhido.
+
+Os k-means (listas do IVF e codebooks do PQ) precisam de pelo menos
+MIN_POINTS_PER_CENTROID vetores de treino por centroide: nlist e pq_nbits
+padrão diminuem com catálogos pequenos, e ivf_pq é recusado quando nem
+codebooks de 2^PQ_MIN_NBITS centroides teriam treino suficiente. Abaixo de
+PQ_LARGE_CATALOG vetores o pq_m padrão é menor (treino mais curto).
+"""
+import json
+import math
+import os
+
+import faiss
+import numpy as np
+
+INDEX_FILE = "index.faiss"
+INDEX_META_FILE = "index.json"
+
+BACKENDS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+METRICS = ("l2", "ip")
+
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+# Mesmo limite abaixo do qual o faiss avisa que o k-means tem poucos pontos
+MIN_POINTS_PER_CENTROID = 39
+PQ_MIN_NBITS = 4
+# pq_m padrão: o treino do PQ cresce com o número de subquantizadores
+PQ_M_SMALL, PQ_M_LARGE, PQ_LARGE_CATALOG = 16, 64, 100000
+BUILD_KEYS = ('nlist', 'pq_m', 'pq_nbits', 'hnsw_m')
+
+
+def index_config_from_env():
+    """Lê a configuração do índice das variáveis de ambiente"""
+    config = {
+        'backend': os.environ.get('INDEX_BACKEND', 'flat').lower(),
+        'metric': os.environ.get('INDEX_METRIC', 'l2').lower(),
+    }
+    for key in BUILD_KEYS:
+        env = f"INDEX_{key.upper()}"
+        if os.environ.get(env):
+            config[key] = int(os.environ[env])
+    return config
+
+
+def _requested(config):
+    """Parâmetros de construção pedidos explicitamente (gravados no index.json)"""
+    return {key: int(config[key]) for key in BUILD_KEYS if config.get(key)}
+
+
+def _factory_string(backend, d, n, config):
+    if backend == "flat":
+        return "Flat", {}
+
+    if backend in ("ivf_flat", "ivf_pq"):
+        nlist = config.get('nlist') or min(int(4 * math.sqrt(n)), n // MIN_POINTS_PER_CENTROID)
+        nlist = max(1, min(nlist, n))
+        params = {'nlist': nlist}
+        if backend == "ivf_flat":
+            return f"IVF{nlist},Flat", params
+
+        # Cada subquantizador treina sobre todos os n vetores (na sua fatia de d/pq_m dimensões):
+        # o que limita é o número de centroides, 2^nbits, frente a n
+        max_nbits = int(math.log2(n / MIN_POINTS_PER_CENTROID)) if n >= MIN_POINTS_PER_CENTROID else 0
+        if max_nbits < PQ_MIN_NBITS:
+            raise ValueError(
+                f"ivf_pq precisa de pelo menos {MIN_POINTS_PER_CENTROID * 2 ** PQ_MIN_NBITS} vetores para "
+                f"treinar os codebooks (o catálogo tem {n}); use flat, ivf_flat ou hnsw"
+            )
+        pq_nbits = min(config.get('pq_nbits') or 8, max_nbits)
+        pq_m = config.get('pq_m') or (PQ_M_LARGE if n >= PQ_LARGE_CATALOG else PQ_M_SMALL)
+        while d % pq_m:
+            pq_m -= 1
+        params.update(pq_m=pq_m, pq_nbits=pq_nbits)
+        return f"IVF{nlist},PQ{pq_m}x{pq_nbits}", params
+
+    if backend == "hnsw":
+        hnsw_m = config.get('hnsw_m') or 32
+        return f"HNSW{hnsw_m},Flat", {'hnsw_m': hnsw_m}
+
+    raise ValueError(f"Backend de índice desconhecido: {backend} (opções: {', '.join(BACKENDS)})")
+
+
+def _prepare_vectors(embeddings, metric):
+    vectors = np.ascontiguousarray(embeddings, dtype="float32")
+    if metric == "ip":
+        vectors = vectors.copy()
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def build_index(embeddings, backend="flat", metric="l2", **config):
+    """Cria (e treina, se necessário) um índice para os embeddings"""
+    if metric not in METRICS:
+        raise ValueError(f"Métrica desconhecida: {metric} (opções: {', '.join(METRICS)})")
+
+    n, d = embeddings.shape
+    factory, params = _factory_string(backend, d, n, config)
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "ip" else faiss.METRIC_L2
+
+    vectors = _prepare_vectors(embeddings, metric)
+    index = faiss.index_factory(d, factory, faiss_metric)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+
+    meta = {
+        'backend': backend,
+        'metric': metric,
+        'factory': factory,
+        'ntotal': int(index.ntotal),
+        'dimensions': int(d),
+        'params': params,
+        'config': _requested(config),
+    }
+    apply_default_params(index, meta)
+    return index, meta
+
+
+def apply_default_params(index, meta):
+    """Define nprobe/efSearch padrão do índice (podem ser trocados por requisição)"""
+    backend = meta.get('backend')
+    if backend in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = min(DEFAULT_NPROBE, meta['params']['nlist'])
+    elif backend == "hnsw":
+        index.hnsw.efSearch = DEFAULT_EF_SEARCH
+
+
+def _embeddings_signature(embeddings_path):
+    # store.json é gravado por último, então identifica a versão do store em mmap
+    for name in ("store.json", "embeddings.npy"):
+        embeddings_file = os.path.join(embeddings_path, name)
+        if os.path.exists(embeddings_file):
+            stat = os.stat(embeddings_file)
+            return {'file': name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return None
+
+
+def save_index(index, meta, embeddings_path):
+    """Grava o índice e seus metadados de forma atômica"""
+    index_file = os.path.join(embeddings_path, INDEX_FILE)
+    meta_file = os.path.join(embeddings_path, INDEX_META_FILE)
+    meta = dict(meta, embeddings=_embeddings_signature(embeddings_path))
+
+    faiss.write_index(index, f"{index_file}.tmp")
+    with open(f"{meta_file}.tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(f"{index_file}.tmp", index_file)
+    os.replace(f"{meta_file}.tmp", meta_file)
+
+
+def read_index_file(index_file):
+    """Lê o índice com mmap dos códigos quando o faiss suporta (vetores compartilhados entre processos)"""
+    mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    if mmap_flag:
+        try:
+            return faiss.read_index(index_file, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass
+    return faiss.read_index(index_file)
+
+
+def load_index(embeddings_path, backend="flat", metric="l2", ntotal=None, **config):
+    """Carrega o índice persistido se ele corresponder à configuração atual"""
+    index_file = os.path.join(embeddings_path, INDEX_FILE)
+    meta_file = os.path.join(embeddings_path, INDEX_META_FILE)
+    if not (os.path.exists(index_file) and os.path.exists(meta_file)):
+        return None, None
+
+    with open(meta_file, encoding="utf-8") as f:
+        meta = json.load(f)
+
+    if meta.get('backend') != backend or meta.get('metric') != metric:
+        return None, None
+    # INDEX_NLIST / INDEX_PQ_M / ... mudaram desde a construção: recria
+    if meta.get('config', {}) != _requested(config):
+        return None, None
+    if ntotal is not None and meta.get('ntotal') != ntotal:
+        return None, None
+    signature = _embeddings_signature(embeddings_path)
+    if signature is None or meta.get('embeddings') != signature:
+        return None, None
+
+    index = read_index_file(index_file)
+    apply_default_params(index, meta)
+    return index, meta
+
+
+def load_or_build_index(embeddings, embeddings_path, backend="flat", metric="l2", **config):
+    """Usa o índice salvo em disco ou cria um novo e tenta persisti-lo"""
+    index, meta = load_index(embeddings_path, backend, metric, ntotal=len(embeddings), **config)
+    if index is not None:
+        print(f"✅ Índice {meta['factory']} carregado de {INDEX_FILE}")
+        return index, meta
+
+    index, meta = build_index(embeddings, backend, metric, **config)
+    print(f"✅ Índice {meta['factory']} criado com {index.ntotal} vetores")
+    if _embeddings_signature(embeddings_path) is None:
+        # Embeddings dummy: não faz sentido persistir
+        return index, meta
+    try:
+        save_index(index, meta, embeddings_path)
+        # Reabrir do disco troca a cópia privada pela versão em mmap
+        index = read_index_file(os.path.join(embeddings_path, INDEX_FILE))
+        apply_default_params(index, meta)
+    except Exception as e:
+        print(f"⚠️ Não foi possível salvar o índice: {e}")
+    return index, meta
+
+
+def search_index(index, meta, queries, k, nprobe=None, ef_search=None):
+    """Busca no índice com parâmetros opcionais por requisição.
+
+    Os parâmetros vão em SearchParameters, sem alterar o índice
+    compartilhado, então requisições concorrentes não interferem entre si.
+    """
+    if meta.get('sharded'):
+        # sharding.ShardedIndex: cada shard prepara as consultas e aplica os parâmetros
+        return index.search(queries, k, nprobe=nprobe, ef_search=ef_search)
+
+    queries = _prepare_vectors(queries, meta['metric'])
+    backend = meta['backend']
+
+    params = None
+    if backend in ("ivf_flat", "ivf_pq") and nprobe:
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe))
+    elif backend == "hnsw" and ef_search:
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search))
+
+    if params is not None:
+        distances, indices = index.search(queries, k, params=params)
+    else:
+        distances, indices = index.search(queries, k)
+
+    if meta['metric'] == "ip":
+        distances = np.maximum(2.0 - 2.0 * distances, 0.0)
+    return distances, indices
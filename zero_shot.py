@@ -0,0 +1,261 @@
+# zero_shot.py
+"""
+Identificação zero-shot de comprimidos com os embeddings de texto do CLIP.
+
+Os nomes dos arquivos do ePillID trazem o código NDC do produto
+(ex.: 50436-6124_0_0.jpg -> 50436-6124). Para cada produto conhecido é
+calculado, uma única vez, o embedding normalizado dos seus prompts; a matriz
+resultante fica em label_embeddings.npy (+ labels.json) ao lado de
+embeddings.npy, na pasta da versão do catálogo em uso (versions/vNNNNNN). Classificar uma consulta é então um único produto de matrizes
+seguido de top-k sobre o embedding de imagem que a busca já calcula.
+
+Gerar a matriz de rótulos:
+    python zero_shot.py embeddings
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+LABELS_FILE = "labels.json"
+LABEL_EMBEDDINGS_FILE = "label_embeddings.npy"
+
+PROMPT_TEMPLATES = (
+    "a photo of the pill with NDC code {code}",
+    "a pill, product {code}",
+)
+DESCRIPTION_TEMPLATE = "a photo of {description}"
+
+_NDC_PATTERN = re.compile(r"^(\d+)-(\d+)")
+
+
+def product_code(filename):
+    """Código NDC do produto (fabricante-produto) a partir do nome do arquivo"""
+    name = os.path.basename(filename)
+    match = _NDC_PATTERN.match(name)
+    if match:
+        return f"{match.group(1)}-{match.group(2)}"
+    return os.path.splitext(name)[0].split("_")[0]
+
+
+def collect_labels(image_paths, metadata=None):
+    """Lista os produtos conhecidos no catálogo (com descrição, se o CSV tiver)"""
+    descriptions = (metadata or {}).get('description')
+    labels = OrderedDict()
+    for i, p in enumerate(image_paths):
+        code = product_code(p)
+        label = labels.setdefault(code, {'code': code, 'description': "", 'count': 0})
+        label['count'] += 1
+        if descriptions is not None and not label['description'] and descriptions[i]:
+            label['description'] = descriptions[i]
+    return list(labels.values())
+
+
+def label_prompts(label):
+    prompts = [template.format(code=label['code']) for template in PROMPT_TEMPLATES]
+    if label['description']:
+        prompts.append(DESCRIPTION_TEMPLATE.format(description=label['description']))
+    return prompts
+
+
+class TextEncoder:
+    """Encoder de texto do CLIP, carregado uma única vez, com cache LRU por prompt"""
+
+    def __init__(self, model=None, model_name="ViT-B/32", device="cpu", cache_size=1024):
+        self.model_name = model_name
+        self.device = device
+        self.model = model
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _ensure_model(self):
+        if self.model is None:
+            import clip
+            print(f"Carregando encoder de texto do CLIP ({self.model_name})...")
+            self.model, _ = clip.load(self.model_name, device=self.device)
+            self.model.eval()
+
+    def encode(self, texts, batch_size=256):
+        """Embeddings normalizados (float32) para uma lista de textos"""
+        import clip
+        import torch
+
+        self._ensure_model()
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            tokens = clip.tokenize(texts[start:start + batch_size], truncate=True).to(self.device)
+            with torch.no_grad():
+                emb = self.model.encode_text(tokens).float()
+                emb /= emb.norm(dim=-1, keepdim=True)
+            embeddings.append(emb.cpu().numpy().astype("float32"))
+        return np.concatenate(embeddings)
+
+    def remember(self, text, emb):
+        with self._lock:
+            self._cache[text] = emb
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def encode_cached(self, text):
+        """Embedding (1, d) de um prompt, reaproveitando o cache"""
+        with self._lock:
+            emb = self._cache.get(text)
+            if emb is not None:
+                self._cache.move_to_end(text)
+                return emb
+        emb = self.encode([text])
+        self.remember(text, emb)
+        return emb
+
+
+class LabelMatrix:
+    """Matriz (rótulos x dimensões) de embeddings de texto normalizados"""
+
+    def __init__(self, labels, embeddings, model_name):
+        self.labels = labels
+        self.embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+        self.model_name = model_name
+
+    @staticmethod
+    def signature(labels, model_name):
+        h = hashlib.sha1(model_name.encode("utf-8"))
+        h.update("|".join(PROMPT_TEMPLATES).encode("utf-8"))
+        for label in labels:
+            h.update(f"{label['code']}\0{label['description']}\0".encode("utf-8"))
+        return h.hexdigest()
+
+    @classmethod
+    def build(cls, labels, text_encoder):
+        """Calcula o embedding de cada rótulo (média normalizada dos seus prompts)"""
+        prompts = []
+        owners = []
+        for i, label in enumerate(labels):
+            for prompt in label_prompts(label):
+                prompts.append(prompt)
+                owners.append(i)
+        prompt_embeddings = text_encoder.encode(prompts)
+
+        matrix = np.zeros((len(labels), prompt_embeddings.shape[1]), dtype="float32")
+        np.add.at(matrix, np.array(owners), prompt_embeddings)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+        # Os prompts já calculados também servem para a busca por texto
+        for prompt, emb in zip(prompts, prompt_embeddings):
+            text_encoder.remember(prompt, emb[None, :])
+        return cls(labels, matrix, text_encoder.model_name)
+
+    def save(self, embeddings_path):
+        labels_file = os.path.join(embeddings_path, LABELS_FILE)
+        matrix_file = os.path.join(embeddings_path, LABEL_EMBEDDINGS_FILE)
+        with open(f"{matrix_file}.tmp", "wb") as f:
+            np.save(f, self.embeddings)
+        with open(f"{labels_file}.tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                'model': self.model_name,
+                'signature': self.signature(self.labels, self.model_name),
+                'labels': self.labels,
+            }, f)
+        os.replace(f"{matrix_file}.tmp", matrix_file)
+        os.replace(f"{labels_file}.tmp", labels_file)
+
+    @classmethod
+    def load(cls, embeddings_path, labels, model_name):
+        """Carrega a matriz salva se ela corresponder aos rótulos atuais"""
+        labels_file = os.path.join(embeddings_path, LABELS_FILE)
+        matrix_file = os.path.join(embeddings_path, LABEL_EMBEDDINGS_FILE)
+        if not (os.path.exists(labels_file) and os.path.exists(matrix_file)):
+            return None
+        with open(labels_file, encoding="utf-8") as f:
+            info = json.load(f)
+        if info.get('signature') != cls.signature(labels, model_name):
+            return None
+        return cls(info['labels'], np.load(matrix_file), model_name)
+
+    def classify(self, query_embs, k=5):
+        """Top-k rótulos para cada consulta: um matmul + argpartition"""
+        query_embs = np.atleast_2d(np.asarray(query_embs, dtype="float32"))
+        scores = query_embs @ self.embeddings.T
+        k = max(0, min(int(k), scores.shape[1]))
+        if k == 0:
+            return [[] for _ in range(len(query_embs))]
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+
+        # Probabilidades com a escala de logits do CLIP (100)
+        logits = scores * 100.0
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+
+        results = []
+        for row in range(len(query_embs)):
+            results.append([
+                {
+                    'code': self.labels[j]['code'],
+                    'description': self.labels[j]['description'],
+                    'catalog_images': self.labels[j]['count'],
+                    'score': float(scores[row, j]),
+                    'probability': float(probs[row, j]),
+                }
+                for j in top[row]
+            ])
+        return results
+
+
+def load_or_build(embeddings_path, image_paths, metadata, text_encoder):
+    """Usa a matriz salva ou calcula uma nova e tenta persisti-la"""
+    labels = collect_labels(image_paths, metadata)
+    matrix = LabelMatrix.load(embeddings_path, labels, text_encoder.model_name)
+    if matrix is not None:
+        print(f"✅ Matriz de rótulos carregada: {len(matrix.labels)} produtos")
+        return matrix
+
+    matrix = LabelMatrix.build(labels, text_encoder)
+    print(f"✅ Matriz de rótulos criada: {len(matrix.labels)} produtos")
+    try:
+        matrix.save(embeddings_path)
+    except OSError as e:
+        print(f"⚠️ Não foi possível salvar a matriz de rótulos: {e}")
+    return matrix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera a matriz de embeddings de texto dos produtos")
+    parser.add_argument("embeddings_path", nargs="?", default="embeddings")
+    parser.add_argument("--model", default="ViT-B/32")
+    args = parser.parse_args(argv)
+
+    try:
+        import snapshots
+        from embedding_store import EmbeddingStore, read_image_info
+        data_path = snapshots.version_path(args.embeddings_path, snapshots.current_version(args.embeddings_path))
+        store = EmbeddingStore.open(data_path)
+        if store is not None:
+            paths, metadata = store.paths.tolist(), store.metadata
+        else:
+            paths = [str(p) for p in np.load(os.path.join(data_path, "image_paths.npy"), allow_pickle=True)]
+            metadata = read_image_info(os.path.join(data_path, "image_info.csv"), paths)
+
+        labels = collect_labels(paths, metadata)
+        matrix = LabelMatrix.build(labels, TextEncoder(model_name=args.model))
+        matrix.save(data_path)
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return 1
+    print(f"✅ {len(matrix.labels)} rótulos salvos em {data_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())